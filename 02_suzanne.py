@@ -3,6 +3,7 @@
 import bpy
 import sys
 import math
+import numpy as np
 import os
 
 working_dir_path = os.path.dirname(os.path.abspath(__file__))
@@ -13,10 +14,21 @@ import utils
 
 def set_scene_objects() -> bpy.types.Object:
     num_suzannes = 15
-    for index in range(num_suzannes):
-        utils.create_smooth_monkey(location=((index - (num_suzannes - 1) / 2) * 3.0, 0.0, 0.0),
-                                   name="Suzanne" + str(index))
-    return bpy.data.objects["Suzanne" + str(int((num_suzannes - 1) / 2))]
+
+    # Subdivide one Suzanne and share the subdivided mesh among all the copies instead of letting each copy evaluate
+    # its own subdivision surface (see utils.create_point_instancer for thousands of copies)
+    source_object = utils.create_smooth_monkey()
+    source_mesh = source_object.data
+    mesh = utils.add_evaluated_mesh(source_object, name="Suzanne")
+    bpy.data.objects.remove(source_object)
+    bpy.data.meshes.remove(source_mesh)
+
+    transforms = np.zeros((num_suzannes, 9))
+    transforms[:, 0] = (np.arange(num_suzannes) - (num_suzannes - 1) / 2) * 3.0
+    transforms[:, 6:9] = 1.0
+    suzannes = utils.create_linked_duplicates(bpy.context.scene, mesh, transforms, "Suzanne")
+
+    return suzannes[(num_suzannes - 1) // 2]
 
 
 # Args
@@ -45,3 +57,6 @@ utils.create_sun_light(rotation=(0.0, math.pi * 0.5, -math.pi * 0.1))
 scene = bpy.data.scenes["Scene"]
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
@@ -131,7 +131,7 @@ def build_scene_composition(scene: bpy.types.Scene) -> None:
     scene.node_tree.links.new(color_correction_node.outputs['Image'], glare_node.inputs['Image'])
     scene.node_tree.links.new(glare_node.outputs['Image'], composite_node.inputs['Image'])
 
-    utils.arrange_nodes(scene.node_tree)
+    utils.request_arrange_nodes(scene.node_tree)
 
 
 # Args
@@ -168,3 +168,6 @@ build_scene_composition(scene)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
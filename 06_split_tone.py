@@ -77,3 +77,6 @@ set_composition(scene)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
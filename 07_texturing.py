@@ -48,39 +48,39 @@ texture_paths = {
 
 
 def add_named_material(name: str, scale=(1.0, 1.0, 1.0), displacement_scale: float = 1.0) -> bpy.types.Material:
-    mat = utils.add_material(name, use_nodes=True, make_node_tree_empty=True)
-    utils.build_pbr_textured_nodes(mat.node_tree,
-                                   color_texture_path=texture_paths[name]["color"],
-                                   roughness_texture_path=texture_paths[name]["roughness"],
-                                   normal_texture_path=texture_paths[name]["normal"],
-                                   metallic_texture_path=texture_paths[name]["metallic"],
-                                   displacement_texture_path=texture_paths[name]["displacement"],
-                                   ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
-                                   scale=scale,
-                                   displacement_scale=displacement_scale)
-    return mat
+    # Materials with the same textures and parameters are shared instead of being built again
+    return utils.get_or_add_pbr_textured_material(
+        name,
+        color_texture_path=texture_paths[name]["color"],
+        roughness_texture_path=texture_paths[name]["roughness"],
+        normal_texture_path=texture_paths[name]["normal"],
+        metallic_texture_path=texture_paths[name]["metallic"],
+        displacement_texture_path=texture_paths[name]["displacement"],
+        ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
+        scale=scale,
+        displacement_scale=displacement_scale)
 
 
 def set_scene_objects():
-    add_named_material("Leather05")
-    add_named_material("Metal07")
-    add_named_material("Fabric02")
-    add_named_material("Marble01", displacement_scale=0.02)
+    leather_material = add_named_material("Leather05")
+    metal_material = add_named_material("Metal07")
+    fabric_material = add_named_material("Fabric02")
+    marble_material = add_named_material("Marble01", displacement_scale=0.02)
 
     left_object, center_object, right_object = utils.create_three_smooth_monkeys()
 
-    left_object.data.materials.append(bpy.data.materials["Leather05"])
-    center_object.data.materials.append(bpy.data.materials["Metal07"])
-    right_object.data.materials.append(bpy.data.materials["Fabric02"])
+    left_object.data.materials.append(leather_material)
+    center_object.data.materials.append(metal_material)
+    right_object.data.materials.append(fabric_material)
 
     current_object = utils.create_plane(size=12.0, name="Floor")
-    current_object.data.materials.append(bpy.data.materials["Marble01"])
+    current_object.data.materials.append(marble_material)
 
     current_object = utils.create_plane(size=12.0,
                                         location=(0.0, 4.0, 0.0),
                                         rotation=(math.pi * 90.0 / 180.0, 0.0, 0.0),
                                         name="Wall")
-    current_object.data.materials.append(bpy.data.materials["Marble01"])
+    current_object.data.materials.append(marble_material)
 
     bpy.ops.object.empty_add(location=(0.0, -0.70, 1.0))
     focus_target = bpy.context.object
@@ -132,3 +132,9 @@ utils.build_scene_composition(scene)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples)
+
+# Texture LOD (no effect unless the levels have been generated by generate_texture_lods.py)
+utils.apply_texture_lods(scene)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
@@ -4,6 +4,7 @@
 import bpy
 import sys
 import math
+import numpy as np
 import os
 
 working_dir_path = os.path.dirname(os.path.abspath(__file__))
@@ -33,42 +34,36 @@ texture_paths = {
 
 
 def add_named_material(name: str, scale=(1.0, 1.0, 1.0), displacement_scale: float = 1.0) -> bpy.types.Material:
-    mat = utils.add_material(name, use_nodes=True, make_node_tree_empty=True)
-    utils.build_pbr_textured_nodes(mat.node_tree,
-                                   color_texture_path=texture_paths[name]["color"],
-                                   roughness_texture_path=texture_paths[name]["roughness"],
-                                   normal_texture_path=texture_paths[name]["normal"],
-                                   metallic_texture_path=texture_paths[name]["metallic"],
-                                   displacement_texture_path=texture_paths[name]["displacement"],
-                                   ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
-                                   scale=scale,
-                                   displacement_scale=displacement_scale)
-    return mat
+    # Materials with the same textures and parameters are shared instead of being built again
+    return utils.get_or_add_pbr_textured_material(
+        name,
+        color_texture_path=texture_paths[name]["color"],
+        roughness_texture_path=texture_paths[name]["roughness"],
+        normal_texture_path=texture_paths[name]["normal"],
+        metallic_texture_path=texture_paths[name]["metallic"],
+        displacement_texture_path=texture_paths[name]["displacement"],
+        ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
+        scale=scale,
+        displacement_scale=displacement_scale)
 
 
 def set_scene_objects():
-    add_named_material("Metal07")
-    add_named_material("Marble01", displacement_scale=0.02)
+    metal_material = add_named_material("Metal07")
+    marble_material = add_named_material("Marble01", displacement_scale=0.02)
 
     current_object = utils.create_smooth_monkey(location=(0.0, 0.0, 1.0), rotation=(0.0, 0.0, -math.pi * 60.0 / 180.0))
-    current_object.data.materials.append(bpy.data.materials["Metal07"])
-
-    # Keyframes
-    current_object.location = (0.0, 0.0, 0.2)
-    current_object.scale = (0.0, 0.0, 0.0)
-    current_object.rotation_euler = (0.0, 0.0, -math.pi * (360.0 * 3.0 + 60.0) / 180.0)
-    current_object.keyframe_insert(data_path='location', frame=4)
-    current_object.keyframe_insert(data_path='scale', frame=4)
-    current_object.keyframe_insert(data_path='rotation_euler', frame=4)
-    current_object.location = (0.0, 0.0, 1.0)
-    current_object.scale = (1.0, 1.0, 1.0)
-    current_object.rotation_euler = (0.0, 0.0, -math.pi * 60.0 / 180.0)
-    current_object.keyframe_insert(data_path='location', frame=42)
-    current_object.keyframe_insert(data_path='scale', frame=42)
-    current_object.keyframe_insert(data_path='rotation_euler', frame=42)
+    current_object.data.materials.append(metal_material)
+
+    # Keyframes (all the keys of each property are written at once)
+    frames = np.array([4, 42])
+    utils.set_keyframes(current_object, 'location', frames, np.array([(0.0, 0.0, 0.2), (0.0, 0.0, 1.0)]))
+    utils.set_keyframes(current_object, 'scale', frames, np.array([(0.0, 0.0, 0.0), (1.0, 1.0, 1.0)]))
+    utils.set_keyframes(current_object, 'rotation_euler', frames,
+                        np.array([(0.0, 0.0, -math.pi * (360.0 * 3.0 + 60.0) / 180.0),
+                                  (0.0, 0.0, -math.pi * 60.0 / 180.0)]))
 
     current_object = utils.create_plane(size=12.0, name="Floor")
-    current_object.data.materials.append(bpy.data.materials["Marble01"])
+    current_object.data.materials.append(marble_material)
 
     bpy.ops.object.empty_add(location=(0.0, -0.70, 1.0))
     focus_target = bpy.context.object
@@ -112,3 +107,9 @@ utils.set_animation(scene, fps=24, frame_start=1, frame_end=48)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples, use_motion_blur=True)
+
+# Texture LOD (no effect unless the levels have been generated by generate_texture_lods.py)
+utils.apply_texture_lods(scene)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
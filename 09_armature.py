@@ -4,6 +4,7 @@
 import bpy
 import sys
 import math
+import numpy as np
 import os
 
 working_dir_path = os.path.dirname(os.path.abspath(__file__))
@@ -33,17 +34,17 @@ texture_paths = {
 
 
 def add_named_material(name: str, scale=(1.0, 1.0, 1.0), displacement_scale: float = 1.0) -> bpy.types.Material:
-    mat = utils.add_material(name, use_nodes=True, make_node_tree_empty=True)
-    utils.build_pbr_textured_nodes(mat.node_tree,
-                                   color_texture_path=texture_paths[name]["color"],
-                                   roughness_texture_path=texture_paths[name]["roughness"],
-                                   normal_texture_path=texture_paths[name]["normal"],
-                                   metallic_texture_path=texture_paths[name]["metallic"],
-                                   displacement_texture_path=texture_paths[name]["displacement"],
-                                   ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
-                                   scale=scale,
-                                   displacement_scale=displacement_scale)
-    return mat
+    # Materials with the same textures and parameters are shared instead of being built again
+    return utils.get_or_add_pbr_textured_material(
+        name,
+        color_texture_path=texture_paths[name]["color"],
+        roughness_texture_path=texture_paths[name]["roughness"],
+        normal_texture_path=texture_paths[name]["normal"],
+        metallic_texture_path=texture_paths[name]["metallic"],
+        displacement_texture_path=texture_paths[name]["displacement"],
+        ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
+        scale=scale,
+        displacement_scale=displacement_scale)
 
 
 def create_skinned_object():
@@ -62,22 +63,18 @@ def create_skinned_object():
     bpy.ops.object.mode_set(mode='POSE')
     bone2 = armature.pose.bones['Bone2']
     bone2.rotation_mode = 'XYZ'
-    bone2.rotation_euler = (0.0, 0.0, 0.0)
-    bone2.keyframe_insert(data_path='rotation_euler', frame=4)
-    bone2.rotation_euler = (+math.pi * 30.0 / 180.0, 0.0, 0.0)
-    bone2.keyframe_insert(data_path='rotation_euler', frame=12)
-    bone2.rotation_euler = (-math.pi * 30.0 / 180.0, 0.0, 0.0)
-    bone2.keyframe_insert(data_path='rotation_euler', frame=20)
-    bone2.rotation_euler = (+math.pi * 30.0 / 180.0, 0.0, 0.0)
-    bone2.keyframe_insert(data_path='rotation_euler', frame=28)
-    bone2.rotation_euler = (0.0, 0.0, 0.0)
-    bone2.keyframe_insert(data_path='rotation_euler', frame=36)
+    utils.set_pose_bone_keyframes(armature, 'Bone2', 'rotation_euler', np.array([4, 12, 20, 28, 36]),
+                                  np.array([(0.0, 0.0, 0.0),
+                                            (+math.pi * 30.0 / 180.0, 0.0, 0.0),
+                                            (-math.pi * 30.0 / 180.0, 0.0, 0.0),
+                                            (+math.pi * 30.0 / 180.0, 0.0, 0.0),
+                                            (0.0, 0.0, 0.0)]))
 
     # Object mode
     bpy.ops.object.mode_set(mode='OBJECT')
 
     # Material
-    add_named_material("Metal07")
+    metal_material = add_named_material("Metal07")
 
     # Mesh
     bpy.ops.mesh.primitive_cube_add(location=(0.0, 0.0, 1.0), calc_uvs=True)
@@ -87,7 +84,7 @@ def create_skinned_object():
     utils.add_subdivision_surface_modifier(cube, 3, is_simple=True)
     utils.add_subdivision_surface_modifier(cube, 3, is_simple=False)
     utils.set_smooth_shading(cube.data)
-    cube.data.materials.append(bpy.data.materials["Metal07"])
+    cube.data.materials.append(metal_material)
 
     # Set the armature as the parent of the cube using the "Automatic Weight" armature option
     bpy.ops.object.select_all(action='DESELECT')
@@ -105,13 +102,13 @@ def create_skinned_object():
 
 
 def set_scene_objects():
-    add_named_material("Marble01", displacement_scale=0.02)
+    marble_material = add_named_material("Marble01", displacement_scale=0.02)
 
     current_object = create_skinned_object()
     current_object.rotation_euler = (0.0, 0.0, math.pi * 60.0 / 180.0)
 
     current_object = utils.create_plane(size=12.0, name="Floor")
-    current_object.data.materials.append(bpy.data.materials["Marble01"])
+    current_object.data.materials.append(marble_material)
 
     bpy.ops.object.empty_add(location=(0.0, 0.0, 1.0))
     focus_target = bpy.context.object
@@ -155,3 +152,9 @@ utils.set_animation(scene, fps=24, frame_start=1, frame_end=40)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples, use_motion_blur=True)
+
+# Texture LOD (no effect unless the levels have been generated by generate_texture_lods.py)
+utils.apply_texture_lods(scene)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
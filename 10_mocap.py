@@ -1,10 +1,11 @@
-# blender --background --python 10_mocap.py --render-frame 1 -- </path/to/input/bvh> </path/to/output/directory>/<name> <resolution_percentage> <num_samples>
+# blender --background --python 10_mocap.py --render-frame 1 -- </path/to/input/bvh> </path/to/output/directory>/<name> <resolution_percentage> <num_samples> [--motion-cache-dir </path/to/cache/directory>]
 # ffmpeg -r 24 -i </path/to/output/directory>/<name>%04d.png -pix_fmt yuv420p out.mp4
 
 import bpy
 import sys
 import math
 import os
+from typing import Optional
 
 working_dir_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(working_dir_path)
@@ -25,39 +26,44 @@ texture_paths = {
 
 
 def add_named_material(name: str, scale=(1.0, 1.0, 1.0), displacement_scale: float = 1.0) -> bpy.types.Material:
-    mat = utils.add_material(name, use_nodes=True, make_node_tree_empty=True)
-    utils.build_pbr_textured_nodes(mat.node_tree,
-                                   color_texture_path=texture_paths[name]["color"],
-                                   roughness_texture_path=texture_paths[name]["roughness"],
-                                   normal_texture_path=texture_paths[name]["normal"],
-                                   metallic_texture_path=texture_paths[name]["metallic"],
-                                   displacement_texture_path=texture_paths[name]["displacement"],
-                                   ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
-                                   scale=scale,
-                                   displacement_scale=displacement_scale)
-    return mat
-
-
-def create_armature_from_bvh(bvh_path: str) -> bpy.types.Object:
+    # Materials with the same textures and parameters are shared instead of being built again
+    return utils.get_or_add_pbr_textured_material(
+        name,
+        color_texture_path=texture_paths[name]["color"],
+        roughness_texture_path=texture_paths[name]["roughness"],
+        normal_texture_path=texture_paths[name]["normal"],
+        metallic_texture_path=texture_paths[name]["metallic"],
+        displacement_texture_path=texture_paths[name]["displacement"],
+        ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
+        scale=scale,
+        displacement_scale=displacement_scale)
+
+
+def create_armature_from_bvh(scene: bpy.types.Scene,
+                             bvh_path: str,
+                             motion_cache_dir_path: Optional[str] = None) -> bpy.types.Object:
     global_scale = 0.056444  # This value needs to be changed depending on the motion data
 
-    bpy.ops.import_anim.bvh(filepath=bvh_path,
-                            axis_forward='-Z',
-                            axis_up='Y',
-                            target='ARMATURE',
-                            global_scale=global_scale,
-                            frame_start=1,
-                            use_fps_scale=True,
-                            update_scene_fps=False,
-                            update_scene_duration=True)
-    armature = bpy.context.object
+    # Equivalent to bpy.ops.import_anim.bvh with the same settings, but the keyframes are written in bulk; with a
+    # motion cache directory, the converted motion is reused across runs with the same file
+    armature = utils.create_armature_from_bvh(scene,
+                                              bvh_path,
+                                              global_scale=global_scale,
+                                              axis_forward='-Z',
+                                              axis_up='Y',
+                                              frame_start=1,
+                                              use_fps_scale=True,
+                                              update_scene_duration=True,
+                                              motion_cache_dir_path=motion_cache_dir_path)
     return armature
 
 
-def build_scene(scene: bpy.types.Scene, input_bvh_path: str) -> bpy.types.Object:
+def build_scene(scene: bpy.types.Scene,
+                input_bvh_path: str,
+                motion_cache_dir_path: Optional[str] = None) -> bpy.types.Object:
 
     # Build a concrete material for the floor and the wall
-    add_named_material("Concrete07", scale=(0.25, 0.25, 0.25))
+    concrete_material = add_named_material("Concrete07", scale=(0.25, 0.25, 0.25))
 
     # Build a metal material for the humanoid body
     mat = utils.add_material("BlueMetal", use_nodes=True, make_node_tree_empty=True)
@@ -67,20 +73,20 @@ def build_scene(scene: bpy.types.Scene, input_bvh_path: str) -> bpy.types.Object
     principled_node.inputs['Metallic'].default_value = 0.9
     principled_node.inputs['Roughness'].default_value = 0.1
     mat.node_tree.links.new(principled_node.outputs['BSDF'], output_node.inputs['Surface'])
-    utils.arrange_nodes(mat.node_tree)
+    utils.request_arrange_nodes(mat.node_tree)
 
     # Import the motion file and create a humanoid object
-    armature = create_armature_from_bvh(bvh_path=input_bvh_path)
+    armature = create_armature_from_bvh(scene, bvh_path=input_bvh_path, motion_cache_dir_path=motion_cache_dir_path)
     armature_mesh = utils.create_armature_mesh(scene, armature, 'Mesh')
     armature_mesh.data.materials.append(mat)
 
     # Create a floor object
     current_object = utils.create_plane(size=16.0, name="Floor")
-    current_object.data.materials.append(bpy.data.materials["Concrete07"])
+    current_object.data.materials.append(concrete_material)
 
     # Create a wall object
     current_object = utils.create_plane(size=16.0, name="Wall")
-    current_object.data.materials.append(bpy.data.materials["Concrete07"])
+    current_object.data.materials.append(concrete_material)
     current_object.location = (0.0, 6.0, 0.0)
     current_object.rotation_euler = (0.5 * math.pi, 0.0, 0.0)
 
@@ -97,11 +103,17 @@ def build_scene(scene: bpy.types.Scene, input_bvh_path: str) -> bpy.types.Object
     return focus_target
 
 
+def get_optional_arg(name: str) -> Optional[str]:
+    args = sys.argv[sys.argv.index('--') + 1:]
+    return args[args.index(name) + 1] if name in args else None
+
+
 # Args
 input_bvh_path = str(sys.argv[sys.argv.index('--') + 1])  # "./assets/motion/102_01.bvh"
 output_file_path = bpy.path.relpath(str(sys.argv[sys.argv.index('--') + 2])) # "./out/frame_"
 resolution_percentage = int(sys.argv[sys.argv.index('--') + 3])  # 100
 num_samples = int(sys.argv[sys.argv.index('--') + 4])  # 128
+motion_cache_dir_path = get_optional_arg("--motion-cache-dir")  # "./out/motion_cache"
 
 # Parameters
 hdri_path = os.path.join(working_dir_path, "assets/HDRIs/green_point_park_2k.hdr")
@@ -117,7 +129,7 @@ utils.clean_objects()
 utils.set_animation(scene, fps=24, frame_start=1, frame_end=40)  # frame_end will be overriden later
 
 ## Scene
-focus_target_object = build_scene(scene, input_bvh_path)
+focus_target_object = build_scene(scene, input_bvh_path, motion_cache_dir_path)
 
 ## Camera
 camera_object = utils.create_camera(location=(0.0, -10.0, 1.0))
@@ -139,3 +151,9 @@ utils.build_scene_composition(scene)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples, use_motion_blur=True, use_adaptive_sampling=True)
+
+# Texture LOD (no effect unless the levels have been generated by generate_texture_lods.py)
+utils.apply_texture_lods(scene)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
@@ -2,9 +2,8 @@
 
 import bpy
 import sys
-import math
+import numpy as np
 import os
-import random
 from typing import List, Tuple
 
 working_dir_path = os.path.dirname(os.path.abspath(__file__))
@@ -13,27 +12,13 @@ sys.path.append(working_dir_path)
 import utils
 
 
-def get_random_numbers(length: int) -> List[float]:
-    numbers = []
-    for i in range(length):
-        numbers.append(random.random())
-    return numbers
-
-
-def get_color(x: float) -> Tuple[float, float, float]:
-    colors = [
+def get_color_ramp() -> List[Tuple[float, float, float]]:
+    return [
         (0.776470, 0.894117, 0.545098),
         (0.482352, 0.788235, 0.435294),
         (0.137254, 0.603921, 0.231372),
     ]
 
-    a = x * (len(colors) - 1)
-    t = a - math.floor(a)
-    c0 = colors[math.floor(a)]
-    c1 = colors[math.ceil(a)]
-
-    return ((1.0 - t) * c0[0] + t * c1[0], (1.0 - t) * c0[1] + t * c1[1], (1.0 - t) * c0[2] + t * c1[2])
-
 
 def set_scene_objects() -> bpy.types.Object:
     # Instantiate a floor plane
@@ -45,10 +30,9 @@ def set_scene_objects() -> bpy.types.Object:
 
     # Assign random colors for each triangle
     mesh = current_object.data
-    mesh.vertex_colors.new(name='Col')
-    random_numbers = get_random_numbers(len(mesh.vertex_colors['Col'].data))
-    for index, vertex_color in enumerate(mesh.vertex_colors['Col'].data):
-        vertex_color.color = get_color(random_numbers[index // 3]) + tuple([1.0])
+    face_values = np.random.random(len(mesh.polygons))
+    face_colors = utils.get_colors_from_ramp(face_values, get_color_ramp())
+    utils.set_vertex_colors_in_numpy(mesh, face_colors, domain='FACE', name='Col')
 
     # Setup a material with wireframe visualization and per-face colors
     mat = utils.add_material("Material_Visualization", use_nodes=True, make_node_tree_empty=True)
@@ -72,7 +56,7 @@ def set_scene_objects() -> bpy.types.Object:
     mat.node_tree.links.new(wire_node.outputs['Fac'], mix_node.inputs['Fac'])
     mat.node_tree.links.new(mix_node.outputs['Shader'], output_node.inputs['Surface'])
 
-    utils.arrange_nodes(mat.node_tree)
+    utils.request_arrange_nodes(mat.node_tree)
 
     bpy.ops.object.empty_add(location=(0.0, -0.8, 0.0))
     focus_target = bpy.context.object
@@ -110,3 +94,6 @@ utils.build_environment_texture_background(world, hdri_path)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples, use_transparent_bg=True)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
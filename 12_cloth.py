@@ -1,10 +1,11 @@
-# blender --background --python 12_cloth.py --render-anim -- </path/to/output/directory>/<name> <resolution_percentage> <num_samples>
+# blender --background --python 12_cloth.py --render-anim -- </path/to/output/directory>/<name> <resolution_percentage> <num_samples> [--cloth-cache-dir </path/to/cache/directory>] [--export-alembic </path/to/output.abc>]
 # ffmpeg -r 24 -i </path/to/output/directory>/<name>%04d.png -pix_fmt yuv420p out.mp4
 
 import bpy
 import sys
 import math
 import os
+from typing import Any, Dict, Optional
 
 working_dir_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(working_dir_path)
@@ -32,18 +33,22 @@ texture_paths = {
 }
 
 
-def add_named_material(name: str, scale=(1.0, 1.0, 1.0), displacement_scale: float = 1.0) -> bpy.types.Material:
-    mat = utils.add_material(name, use_nodes=True, make_node_tree_empty=True)
-    utils.build_pbr_textured_nodes(mat.node_tree,
-                                   color_texture_path=texture_paths[name]["color"],
-                                   roughness_texture_path=texture_paths[name]["roughness"],
-                                   normal_texture_path=texture_paths[name]["normal"],
-                                   metallic_texture_path=texture_paths[name]["metallic"],
-                                   displacement_texture_path=texture_paths[name]["displacement"],
-                                   ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
-                                   scale=scale,
-                                   displacement_scale=displacement_scale)
-    return mat
+def add_named_material(name: str,
+                       scale=(1.0, 1.0, 1.0),
+                       displacement_scale: float = 1.0,
+                       principled_values: Optional[Dict[str, Any]] = None) -> bpy.types.Material:
+    # Materials with the same textures and parameters are shared instead of being built again
+    return utils.get_or_add_pbr_textured_material(
+        name,
+        color_texture_path=texture_paths[name]["color"],
+        roughness_texture_path=texture_paths[name]["roughness"],
+        normal_texture_path=texture_paths[name]["normal"],
+        metallic_texture_path=texture_paths[name]["metallic"],
+        displacement_texture_path=texture_paths[name]["displacement"],
+        ambient_occlusion_texture_path=texture_paths[name]["ambient_occlusion"],
+        scale=scale,
+        displacement_scale=displacement_scale,
+        principled_values=principled_values)
 
 
 def set_floor_and_lights() -> None:
@@ -68,16 +73,14 @@ def set_floor_and_lights() -> None:
 
 
 def set_scene_objects() -> bpy.types.Object:
-    add_named_material("Fabric02")
-    add_named_material("Fabric03")
-    bpy.data.materials["Fabric02"].node_tree.nodes["Principled BSDF"].inputs["Sheen"].default_value = 4.0
-    bpy.data.materials["Fabric03"].node_tree.nodes["Principled BSDF"].inputs["Sheen"].default_value = 4.0
+    cloth_material = add_named_material("Fabric02", principled_values={"sheen": 4.0})
+    monkey_material = add_named_material("Fabric03", principled_values={"sheen": 4.0})
 
     set_floor_and_lights()
 
     current_object = utils.create_smooth_monkey(location=(0.0, 0.0, 1.0))
-    current_object.data.materials.append(bpy.data.materials["Fabric03"])
-    bpy.ops.object.modifier_add(type='COLLISION')
+    current_object.data.materials.append(monkey_material)
+    current_object.modifiers.new(name="Collision", type='COLLISION')
 
     if bpy.app.version >= (2, 80, 0):
         bpy.ops.mesh.primitive_grid_add(x_subdivisions=75, y_subdivisions=75, size=3.0, location=(0.0, 0.0, 2.75))
@@ -95,17 +98,50 @@ def set_scene_objects() -> bpy.types.Object:
     cloth_object.modifiers["Cloth"].settings.quality = 10
     utils.set_smooth_shading(cloth_object.data)
     utils.add_subdivision_surface_modifier(cloth_object, 2)
-    cloth_object.data.materials.append(bpy.data.materials["Fabric02"])
+    cloth_object.data.materials.append(cloth_material)
 
     bpy.ops.object.empty_add(location=(0.0, -0.75, 1.05))
     focus_target = bpy.context.object
     return focus_target
 
 
+def get_optional_arg(name: str) -> Optional[str]:
+    args = sys.argv[sys.argv.index('--') + 1:]
+    return args[args.index(name) + 1] if name in args else None
+
+
+def bake_or_reuse_cloth_cache(scene: bpy.types.Scene, cloth_object: bpy.types.Object, cache_dir_path: str) -> None:
+    # The cache is keyed by a hash of the cloth settings, the grid, the collision object and the frame range, so any
+    # change to the simulation results in a new bake
+    cache_key = utils.get_cloth_cache_key(scene, cloth_object)
+    blend_file_path = os.path.join(os.path.abspath(cache_dir_path), "cloth_" + cache_key + ".blend")
+    disk_cache_dir_path = utils.get_disk_cache_dir_path(blend_file_path)
+
+    point_cache = cloth_object.modifiers["Cloth"].point_cache
+    point_cache.name = "Cloth"
+    point_cache.index = 0
+    point_cache.frame_start = scene.frame_start
+    point_cache.frame_end = scene.frame_end
+
+    if utils.is_point_cache_baked_on_disk(point_cache, disk_cache_dir_path, scene.frame_end):
+        print("Reusing the baked cloth cache: " + disk_cache_dir_path)
+        utils.set_external_point_cache(point_cache, disk_cache_dir_path)
+    else:
+        print("Baking the cloth cache: " + disk_cache_dir_path)
+        os.makedirs(os.path.dirname(blend_file_path), exist_ok=True)
+        utils.bake_point_caches_to_disk(scene, blend_file_path)
+
+        # The default cache path is relative to the open .blend file, so it would be lost when the scene is saved
+        # elsewhere (e.g., as a snapshot of render_cached.py)
+        utils.set_external_point_cache(point_cache, disk_cache_dir_path)
+
+
 # Args
 output_file_path = bpy.path.relpath(str(sys.argv[sys.argv.index('--') + 1]))
 resolution_percentage = int(sys.argv[sys.argv.index('--') + 2])
 num_samples = int(sys.argv[sys.argv.index('--') + 3])
+cloth_cache_dir_path = get_optional_arg("--cloth-cache-dir")
+alembic_file_path = get_optional_arg("--export-alembic")
 
 # Scene Building
 scene = bpy.data.scenes["Scene"]
@@ -135,3 +171,18 @@ utils.build_scene_composition(scene, dispersion=0.0)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples, use_motion_blur=True)
+
+# Texture LOD (no effect unless the levels have been generated by generate_texture_lods.py)
+utils.apply_texture_lods(scene)
+
+# Simulation Cache (after the render settings because baking saves the scene as a .blend file in the cache directory)
+if cloth_cache_dir_path is not None:
+    bake_or_reuse_cloth_cache(scene, bpy.data.objects["Cloth"], cloth_cache_dir_path)
+
+# Export the simulated cloth so that it can be reloaded by utils.create_cached_mesh_from_alembic
+if alembic_file_path is not None:
+    utils.export_mesh_to_alembic(bpy.data.objects["Cloth"], alembic_file_path, scene.frame_start, scene.frame_end)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is); without a baked
+# cache, jumping to later frames would not simulate the cloth up to them, so only the first frame is probed
+utils.calibrate_sampling_from_environment(scene, None if cloth_cache_dir_path is not None else [scene.frame_start])
@@ -82,7 +82,7 @@ def build_scene_composition(scene):
     scene.node_tree.links.new(color_correction_node.outputs['Image'], split_tone_node.inputs['Image'])
     scene.node_tree.links.new(split_tone_node.outputs['Image'], composite_node.inputs['Image'])
 
-    utils.arrange_nodes(scene.node_tree)
+    utils.request_arrange_nodes(scene.node_tree)
 
 
 build_scene_composition(scene)
@@ -90,3 +90,6 @@ build_scene_composition(scene)
 # Render Setting
 utils.set_output_properties(scene, resolution_percentage, output_file_path)
 utils.set_cycles_renderer(scene, camera_object, num_samples, use_denoising=False)
+
+# Sampling Calibration (the last step of building the scene because the probes render it as it is)
+utils.calibrate_sampling_from_environment(scene)
@@ -0,0 +1,86 @@
+# blender --background --python benchmarks/bvh_import_benchmark.py -- [</path/to/bvh> ...]
+#
+# Compare bpy.ops.import_anim.bvh with utils.create_armature_from_bvh (NumPy parsing and bulk F-Curve writing) on the
+# settings of 10_mocap.py. The default files are the bundled ones (assets/motion/102_01.bvh and 131_03.bvh). The
+# maximum distance between the bone heads of both armatures over the frames is also reported as a sanity check.
+
+import bpy
+import numpy as np
+import os
+import sys
+import time
+
+root_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir_path)
+
+import utils
+
+global_scale = 0.056444
+
+
+def import_with_operator(scene: bpy.types.Scene, bvh_path: str) -> bpy.types.Object:
+    bpy.ops.import_anim.bvh(filepath=bvh_path,
+                            axis_forward='-Z',
+                            axis_up='Y',
+                            target='ARMATURE',
+                            global_scale=global_scale,
+                            frame_start=1,
+                            use_fps_scale=True,
+                            update_scene_fps=False,
+                            update_scene_duration=True)
+    return bpy.context.object
+
+
+def import_with_utils(scene: bpy.types.Scene, bvh_path: str) -> bpy.types.Object:
+    return utils.create_armature_from_bvh(scene, bvh_path, global_scale=global_scale)
+
+
+def get_bone_heads(armature_object: bpy.types.Object) -> np.ndarray:
+    return np.array([armature_object.matrix_world @ pose_bone.head for pose_bone in armature_object.pose.bones])
+
+
+def remove_armature(armature_object: bpy.types.Object) -> None:
+    armature = armature_object.data
+    action = armature_object.animation_data.action
+    bpy.data.objects.remove(armature_object)
+    bpy.data.armatures.remove(armature)
+    bpy.data.actions.remove(action)
+
+
+if __name__ == "__main__":
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    bvh_paths = args if args else [
+        os.path.join(root_dir_path, "assets/motion/102_01.bvh"),
+        os.path.join(root_dir_path, "assets/motion/131_03.bvh"),
+    ]
+
+    scene = bpy.context.scene
+    utils.clean_objects()
+    utils.set_animation(scene, fps=24, frame_start=1, frame_end=1)
+
+    print("----")
+    print("{:>12} {:>8} {:>14} {:>14} {:>10} {:>16}".format("file", "frames", "operator [s]", "utils [s]", "speedup",
+                                                           "max error [m]"))
+    for bvh_path in bvh_paths:
+        start_time = time.perf_counter()
+        operator_object = import_with_operator(scene, bvh_path)
+        operator_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        utils_object = import_with_utils(scene, bvh_path)
+        utils_time = time.perf_counter() - start_time
+
+        max_error = 0.0
+        for frame in range(scene.frame_start, scene.frame_end + 1):
+            scene.frame_set(frame)
+            max_error = max(max_error, np.abs(get_bone_heads(operator_object) - get_bone_heads(utils_object)).max())
+
+        num_frames = utils.parse_bvh(bvh_path)["motion"].shape[0]
+        print("{:>12} {:>8} {:>14.3f} {:>14.3f} {:>9.1f}x {:>16.2e}".format(os.path.basename(bvh_path), num_frames,
+                                                                          operator_time, utils_time,
+                                                                          operator_time / utils_time, max_error))
+
+        remove_armature(operator_object)
+        remove_armature(utils_object)
+        scene.frame_end = 1
+    print("----")
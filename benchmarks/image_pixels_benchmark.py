@@ -0,0 +1,56 @@
+# blender --background --python benchmarks/image_pixels_benchmark.py -- [<size> ...]
+#
+# Compare reading/writing image pixels through "image.pixels[:]" (a Python list of floats) with utils.get/set_image_
+# pixels_in_numpy (foreach_get/foreach_set into float32 buffers). The default sizes are 2K and 8K (RGBA). The list-based
+# path is measured only up to 4K because it needs tens of GB of memory for an 8K image.
+
+import bpy
+import numpy as np
+import os
+import sys
+import time
+
+root_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir_path)
+
+import utils
+
+max_list_based_size = 4096
+
+
+def measure(function, num_repeats: int = 3) -> float:
+    elapsed_times = []
+    for i in range(num_repeats):
+        start_time = time.perf_counter()
+        function()
+        elapsed_times.append(time.perf_counter() - start_time)
+    return min(elapsed_times)
+
+
+if __name__ == "__main__":
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    sizes = [int(arg) for arg in args] if args else [2048, 8192]
+
+    print("----")
+    print("{:>6} {:>14} {:>14} {:>14} {:>14} {:>14}".format("size", "list get [s]", "numpy get [s]", "reused get [s]",
+                                                          "list set [s]", "numpy set [s]"))
+    for size in sizes:
+        image = bpy.data.images.new("Benchmark", width=size, height=size, alpha=True, float_buffer=True)
+        pixels = np.random.random((size, size, 4)).astype(np.float32)
+        buffer = np.empty((size, size, 4), dtype=np.float32)
+
+        numpy_get_time = measure(lambda: utils.get_image_pixels_in_numpy(image))
+        reused_get_time = measure(lambda: utils.get_image_pixels_in_numpy(image, out=buffer))
+        numpy_set_time = measure(lambda: utils.set_image_pixels_in_numpy(image, pixels))
+
+        if size <= max_list_based_size:
+            list_get_time = "{:>14.3f}".format(measure(lambda: np.array(image.pixels[:]), num_repeats=1))
+            list_set_time = "{:>14.3f}".format(measure(lambda: setattr(image, "pixels", pixels.flatten()), 1))
+        else:
+            list_get_time = list_set_time = "{:>14}".format("n/a")
+
+        print("{:>6} {} {:>14.3f} {:>14.3f} {} {:>14.3f}".format(size, list_get_time, numpy_get_time, reused_get_time,
+                                                                list_set_time, numpy_set_time))
+
+        bpy.data.images.remove(image)
+    print("----")
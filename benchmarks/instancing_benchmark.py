@@ -0,0 +1,107 @@
+# blender --background --python benchmarks/instancing_benchmark.py -- [<num_copies> ...]
+#
+# Compare three ways of placing copies of a subdivided Suzanne on a grid: independent objects created by
+# utils.create_smooth_monkey (each with its own mesh and Subdivision Surface modifier), utils.create_linked_duplicates
+# (objects sharing one subdivided mesh) and utils.create_point_instancer (one geometry-nodes instancer). For each, the
+# scene building time, the render time of one sample at a low resolution, the BVH building time and the peak render
+# memory are reported. The default counts are 15, 100, 1k, 10k and 100k; the object-based methods are skipped for large
+# counts because they take too long.
+
+import bpy
+import math
+import numpy as np
+import os
+import sys
+import time
+
+root_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir_path)
+
+import utils
+
+max_num_copies = {"copies": 1_000, "linked": 10_000, "instancer": 100_000_000}
+
+
+def get_grid_transforms(num_copies: int) -> np.ndarray:
+    n = int(math.ceil(math.sqrt(num_copies)))
+    indices = np.arange(num_copies)
+
+    transforms = np.zeros((num_copies, 9))
+    transforms[:, 0] = (indices % n - (n - 1) / 2) * 3.0
+    transforms[:, 1] = (indices // n - (n - 1) / 2) * 3.0
+    transforms[:, 6:9] = 1.0
+
+    return transforms
+
+
+def build_copies(scene: bpy.types.Scene, method: str, transforms: np.ndarray) -> None:
+    if method == "copies":
+        for location in transforms[:, 0:3]:
+            utils.create_smooth_monkey(location=tuple(location))
+        return
+
+    source_object = utils.create_smooth_monkey()
+    if method == "linked":
+        mesh = utils.add_evaluated_mesh(source_object)
+        bpy.data.objects.remove(source_object)
+        utils.create_linked_duplicates(scene, mesh, transforms, "Suzanne")
+    else:
+        utils.create_point_instancer(scene, source_object, transforms, "Suzannes")
+
+
+def build_camera(scene: bpy.types.Scene, transforms: np.ndarray) -> None:
+    extent = np.abs(transforms[:, 0:2]).max() + 3.0
+
+    camera_object = utils.create_camera(location=(0.0, 0.0, 2.0 * extent))
+    camera_object.data.type = 'ORTHO'
+    camera_object.data.ortho_scale = 2.0 * extent
+    scene.camera = camera_object
+
+    utils.create_sun_light()
+
+
+def render() -> None:
+    bpy.ops.render.render(write_still=False)
+
+
+if __name__ == "__main__":
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    copy_counts = [int(arg) for arg in args] if args else [15, 100, 1_000, 10_000, 100_000]
+
+    utils.enable_render_profiling()
+
+    print("----")
+    print("{:>10} {:>10} {:>10} {:>11} {:>9} {:>12}".format("copies", "method", "build [s]", "render [s]", "bvh [s]",
+                                                           "peak [MB]"))
+    for num_copies in copy_counts:
+        transforms = get_grid_transforms(num_copies)
+
+        for method in ("copies", "linked", "instancer"):
+            if num_copies > max_num_copies[method]:
+                continue
+
+            # Start from an empty scene without the datablocks of the previous method
+            bpy.ops.wm.read_homefile(use_factory_startup=True)
+            utils.clear_node_group_registry()
+            scene = bpy.context.scene
+            utils.clean_objects()
+
+            start_time = time.perf_counter()
+            build_copies(scene, method, transforms)
+            build_time = time.perf_counter() - start_time
+
+            build_camera(scene, transforms)
+            utils.set_output_properties(scene, resolution_percentage=10)
+            utils.set_cycles_renderer(scene, scene.camera, num_samples=1, use_denoising=False)
+
+            bvh_time = utils.render_stage_timings.get("bvh", 0.0)
+            start_time = time.perf_counter()
+            render()
+            render_time = time.perf_counter() - start_time
+            bvh_time = utils.render_stage_timings.get("bvh", 0.0) - bvh_time
+
+            peak_memory = utils.frame_records[-1]["peak_memory_mb"] if utils.frame_records else None
+            print("{:>10} {:>10} {:>10.3f} {:>11.3f} {:>9.3f} {:>12}".format(
+                num_copies, method, build_time, render_time, bvh_time,
+                "-" if peak_memory is None else "{:.1f}".format(peak_memory)))
+    print("----")
@@ -0,0 +1,68 @@
+# blender --background --python benchmarks/mesh_construction_benchmark.py -- [<num_faces> ...]
+#
+# Compare utils.create_mesh_from_pydata (Python lists) with utils.create_mesh_from_numpy (bulk foreach_set) on
+# triangulated grids. The default face counts are 10k, 1M and 10M.
+
+import bpy
+import math
+import numpy as np
+import os
+import sys
+import time
+from typing import Tuple
+
+root_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir_path)
+
+import utils
+
+
+def get_grid_triangles(num_faces: int) -> Tuple[np.ndarray, np.ndarray]:
+    n = max(1, int(math.ceil(math.sqrt(num_faces / 2.0))))
+
+    xs, ys = np.meshgrid(np.arange(n + 1, dtype=np.float32), np.arange(n + 1, dtype=np.float32), indexing='ij')
+    vertices = np.stack((xs.ravel(), ys.ravel(), np.zeros(xs.size, dtype=np.float32)), axis=1)
+
+    v00 = (np.arange(n)[:, None] * (n + 1) + np.arange(n)[None, :]).ravel()
+    v10 = v00 + (n + 1)
+    faces = np.concatenate((np.stack((v00, v10, v10 + 1), axis=1), np.stack((v00, v10 + 1, v00 + 1), axis=1)))
+
+    return vertices, faces[:num_faces]
+
+
+def remove_object(object: bpy.types.Object) -> None:
+    mesh = object.data
+    bpy.data.objects.remove(object)
+    bpy.data.meshes.remove(mesh)
+
+
+if __name__ == "__main__":
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    face_counts = [int(arg) for arg in args] if args else [10_000, 1_000_000, 10_000_000]
+
+    scene = bpy.context.scene
+
+    print("----")
+    print("{:>12} {:>16} {:>16} {:>10}".format("faces", "from_pydata [s]", "foreach_set [s]", "speedup"))
+    for num_faces in face_counts:
+        vertices, faces = get_grid_triangles(num_faces)
+
+        # Python lists are prepared beforehand, as callers of create_mesh_from_pydata typically have them
+        vertex_list = vertices.tolist()
+        face_list = faces.tolist()
+
+        start_time = time.perf_counter()
+        pydata_object = utils.create_mesh_from_pydata(scene, vertex_list, face_list, "PyData", "PyData")
+        pydata_time = time.perf_counter() - start_time
+        remove_object(pydata_object)
+
+        start_time = time.perf_counter()
+        loop_vertex_indices, loop_starts, loop_totals = utils.get_loop_arrays_from_faces(faces)
+        numpy_object = utils.create_mesh_from_numpy(scene, vertices, loop_vertex_indices, loop_starts, loop_totals,
+                                                    "NumPy", "NumPy")
+        numpy_time = time.perf_counter() - start_time
+        remove_object(numpy_object)
+
+        print("{:>12} {:>16.3f} {:>16.3f} {:>9.1f}x".format(num_faces, pydata_time, numpy_time,
+                                                           pydata_time / numpy_time))
+    print("----")
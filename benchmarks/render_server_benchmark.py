@@ -0,0 +1,103 @@
+# python benchmarks/render_server_benchmark.py [</path/to/blender>] [<resolution_percentage>] [<num_samples>]
+#
+# Compare the throughput of run.sh (one Blender process per script) with render_server.py (one long-lived Blender
+# process rendering the same jobs back to back). The defaults follow the TEST mode of run.sh.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+root_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_jobs(out_dir_path: str, resolution_percentage: int, num_samples: int) -> List[Dict[str, Any]]:
+    still_scripts = [
+        "01_cube", "02_suzanne", "03_ibl", "04_principled_bsdf", "05_composition", "06_split_tone", "07_texturing",
+        "11_mesh_visualization", "13_matcap", "14_procedural_texturing"
+    ]
+    anim_scripts = ["08_animation", "09_armature", "12_cloth"]
+
+    common_args = [str(resolution_percentage), str(num_samples)]
+    frames = [1, 2, 3, 4, 5]
+
+    jobs = []
+    for name in still_scripts:
+        jobs.append({
+            "script": name + ".py",
+            "args": [os.path.join(out_dir_path, name + "_")] + common_args,
+            "frames": [1],
+        })
+    for name in anim_scripts:
+        jobs.append({
+            "script": name + ".py",
+            "args": [os.path.join(out_dir_path, name[:2], "frame_")] + common_args,
+            "frames": frames,
+        })
+    jobs.append({
+        "script": "10_mocap.py",
+        "args": [os.path.join(root_dir_path, "assets/motion/102_01.bvh"),
+                 os.path.join(out_dir_path, "10", "frame_")] + common_args,
+        "frames": frames,
+    })
+
+    return jobs
+
+
+def get_frame_option(job: Dict[str, Any]) -> List[str]:
+    frames = job["frames"]
+    if len(frames) == 1:
+        return ["--render-frame", str(frames[0])]
+    return ["--render-frame", "{}..{}".format(frames[0], frames[-1])]
+
+
+def run_per_process(blender_path: str, jobs: List[Dict[str, Any]]) -> float:
+    start_time = time.time()
+    for job in jobs:
+        command = [blender_path, "--background", "-noaudio", "--python", os.path.join(root_dir_path, job["script"])]
+        command += get_frame_option(job) + ["--"] + job["args"]
+        subprocess.run(command, cwd=root_dir_path, stdout=subprocess.DEVNULL)
+    return time.time() - start_time
+
+
+def run_render_server(blender_path: str, jobs: List[Dict[str, Any]], spool_dir_path: str) -> float:
+    shutil.rmtree(spool_dir_path, ignore_errors=True)
+    os.makedirs(os.path.join(spool_dir_path, "pending"))
+
+    for index, job in enumerate(jobs):
+        with open(os.path.join(spool_dir_path, "pending", "{:04d}.json".format(index)), "w") as file:
+            json.dump(job, file)
+
+    start_time = time.time()
+    command = [blender_path, "--background", "-noaudio", "--python", os.path.join(root_dir_path, "render_server.py")]
+    command += ["--", spool_dir_path, "--exit-when-idle"]
+    subprocess.run(command, cwd=root_dir_path, stdout=subprocess.DEVNULL)
+    return time.time() - start_time
+
+
+if __name__ == "__main__":
+    blender_path = sys.argv[1] if len(sys.argv) > 1 else "blender"
+    resolution_percentage = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    num_samples = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    out_dir_path = os.path.join(root_dir_path, "out", "benchmark")
+
+    per_process_jobs = get_jobs(os.path.join(out_dir_path, "per_process"), resolution_percentage, num_samples)
+    server_jobs = get_jobs(os.path.join(out_dir_path, "server"), resolution_percentage, num_samples)
+
+    per_process_time = run_per_process(blender_path, per_process_jobs)
+    server_time = run_render_server(blender_path, server_jobs, os.path.join(out_dir_path, "spool"))
+
+    num_failed_jobs = len(os.listdir(os.path.join(out_dir_path, "spool", "failed"))) // 2
+
+    print("----")
+    print("Jobs: {} ({} failed on the render server)".format(len(server_jobs), num_failed_jobs))
+    print("One process per script: {:8.2f} sec ({:.2f} jobs/min)".format(per_process_time,
+                                                                       60.0 * len(per_process_jobs) / per_process_time))
+    print("Render server:          {:8.2f} sec ({:.2f} jobs/min)".format(server_time,
+                                                                       60.0 * len(server_jobs) / server_time))
+    print("Speedup: {:.2f}x".format(per_process_time / server_time))
+    print("----")
@@ -0,0 +1,65 @@
+# blender --background --python benchmarks/scattering_benchmark.py -- [<num_samples> ...]
+#
+# Measure utils.get_plane_scatter_transforms (on a square floor) and utils.get_surface_scatter_transforms (on a
+# subdivided sphere) for two Suzanne sizes whose radii come from utils.get_bounding_radius. The domains are sized so
+# that the requested samples cover about 30% of them. The default sample counts are 1k, 100k and 1M. The number of
+# accepted samples and the number of candidates drawn by the dart throwing are also reported.
+
+import bpy
+import math
+import os
+import sys
+import time
+
+root_dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir_path)
+
+import utils
+
+coverage = 0.3
+
+
+def get_counter(name: str) -> int:
+    return utils.counters.get(name, 0)
+
+
+if __name__ == "__main__":
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    sample_counts = [int(arg) for arg in args] if args else [1_000, 100_000, 1_000_000]
+
+    scene = bpy.context.scene
+    utils.clean_objects()
+
+    monkey_object = utils.create_smooth_monkey()
+    radius = utils.get_bounding_radius(monkey_object)
+    radii = [radius, 0.5 * radius]
+    mean_disk_area = math.pi * (radii[0]**2 + radii[1]**2) / 2.0
+
+    print("----")
+    print("{:>10} {:>8} {:>10} {:>12} {:>10} {:>14}".format("samples", "domain", "accepted", "candidates", "time [s]",
+                                                          "samples/s"))
+    for num_samples in sample_counts:
+        area = num_samples * mean_disk_area / coverage
+
+        sphere_radius = math.sqrt(area / (4.0 * math.pi))
+        sphere_object = utils.create_smooth_sphere(radius=sphere_radius, subdivision_level=2)
+
+        for domain in ("plane", "surface"):
+            num_candidates = get_counter("poisson_disk_candidates")
+
+            start_time = time.perf_counter()
+            if domain == "plane":
+                transforms, _ = utils.get_plane_scatter_transforms(num_samples, radii, size=math.sqrt(area))
+            else:
+                transforms, _ = utils.get_surface_scatter_transforms(sphere_object, num_samples, radii)
+            elapsed_time = time.perf_counter() - start_time
+
+            print("{:>10} {:>8} {:>10} {:>12} {:>10.3f} {:>14.0f}".format(
+                num_samples, domain, transforms.shape[0],
+                get_counter("poisson_disk_candidates") - num_candidates, elapsed_time,
+                transforms.shape[0] / elapsed_time))
+
+        sphere_mesh = sphere_object.data
+        bpy.data.objects.remove(sphere_object)
+        bpy.data.meshes.remove(sphere_mesh)
+    print("----")
@@ -0,0 +1,299 @@
+# blender --background -noaudio --python generate_dataset.py -- </path/to/output/dir> <num_images> <resolution_percentage> <num_samples> [options]
+#
+# Example:
+#   blender --background -noaudio --python generate_dataset.py -- ./out/dataset 1000 25 64 --seed 1
+#
+# Render a domain-randomized synthetic dataset. The base scene (Suzannes on a floor under an HDRI, and a camera
+# tracking a target) is built once; for each image, only the randomized parameters are changed before rendering:
+# the object placements (non-overlapping, by utils.get_plane_scatter_transforms), their Principled BSDF values, the
+# HDRI rotation and the camera pose. Persistent render data is enabled so that Cycles keeps the scene between images
+# and only synchronizes what has changed.
+#
+# The images are written as "<output>/<index>.png" and their labels as one JSON line each in "<output>/labels.jsonl"
+# (the randomized parameters, the camera matrices and the 2D bounding boxes of the objects in pixels). With --passes,
+# the images are multilayer OpenEXR files with the given passes from the same render instead (read them with
+# utils.load_exr_channels), and the labels include the object pass indices of the IndexOB pass. The throughput
+# (images/hour overall and for the render time only) is printed at the end and written to "<output>/summary.json".
+#
+# Options:
+#   --seed <seed>                 Seed of the random parameters (default: 0)
+#   --num-objects <num_objects>   The number of Suzannes (default: 5)
+#   --hdri <path>                 Environment texture (default: assets/HDRIs/green_point_park_2k.hdr)
+#   --passes <names>              Comma-separated render passes (e.g., "Depth,Normal,IndexOB,CryptoObject")
+
+import bpy
+import argparse
+import colorsys
+import json
+import math
+import numpy as np
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+working_dir_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(working_dir_path)
+
+import utils
+
+floor_size = 40.0
+placement_size = 12.0
+
+
+def parse_args(args: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="generate_dataset.py")
+    parser.add_argument("output_dir_path", help="Where the images and the labels are written")
+    parser.add_argument("num_images", type=int)
+    parser.add_argument("resolution_percentage", type=int)
+    parser.add_argument("num_samples", type=int)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random parameters")
+    parser.add_argument("--num-objects", type=int, default=5, help="The number of Suzannes")
+    parser.add_argument("--hdri",
+                        default=os.path.join(working_dir_path, "assets/HDRIs/green_point_park_2k.hdr"),
+                        help="Environment texture")
+    parser.add_argument("--passes", default="", help="Comma-separated render passes written to multilayer OpenEXR")
+
+    return parser.parse_args(args)
+
+
+def add_principled_material(name: str) -> Tuple[bpy.types.Material, bpy.types.Node]:
+    material = utils.add_material(name, use_nodes=True, make_node_tree_empty=True)
+    output_node = material.node_tree.nodes.new(type='ShaderNodeOutputMaterial')
+    principled_node = material.node_tree.nodes.new(type='ShaderNodeBsdfPrincipled')
+    material.node_tree.links.new(principled_node.outputs['BSDF'], output_node.inputs['Surface'])
+
+    return material, principled_node
+
+
+def build_base_scene(scene: bpy.types.Scene, num_objects: int,
+                     hdri_path: str) -> Tuple[List[bpy.types.Object], List[bpy.types.Node], bpy.types.Object]:
+    '''
+    Build everything that does not change between the images. Returns the randomized objects, their Principled BSDF
+    nodes and the camera target.
+    '''
+
+    floor_object = utils.create_plane(size=floor_size, name="Floor")
+    floor_material, floor_principled_node = add_principled_material("Material_Floor")
+    utils.set_principled_node(floor_principled_node, base_color=(0.8, 0.8, 0.8, 1.0), roughness=0.4)
+    floor_object.data.materials.append(floor_material)
+
+    mesh_objects = []
+    principled_nodes = []
+    for index in range(num_objects):
+        mesh_object = utils.create_smooth_monkey(name="Suzanne" + str(index))
+        material, principled_node = add_principled_material("Material_Suzanne" + str(index))
+        mesh_object.data.materials.append(material)
+        mesh_objects.append(mesh_object)
+        principled_nodes.append(principled_node)
+
+    camera_target_object = utils.create_object(None, "Camera Target", (0.0, 0.0, 0.5))
+    camera_object = utils.create_camera(location=(0.0, -10.0, 3.0))
+    camera_object.data.lens = 50.0
+    utils.add_track_to_constraint(camera_object, camera_target_object)
+    scene.camera = camera_object
+
+    utils.build_environment_texture_background(scene.world, hdri_path)
+
+    return mesh_objects, principled_nodes, camera_target_object
+
+
+def set_random_parameters(scene: bpy.types.Scene, mesh_objects: List[bpy.types.Object],
+                          principled_nodes: List[bpy.types.Node], camera_target_object: bpy.types.Object,
+                          radius: float, ground_offset: float, rng: np.random.Generator) -> Dict[str, Any]:
+    '''
+    Change only the randomized parameters of the base scene and return them as labels.
+    '''
+
+    # Object placements; the objects that do not fit in the placement area are hidden
+    transforms, _ = utils.get_plane_scatter_transforms(len(mesh_objects), [radius],
+                                                       size=placement_size,
+                                                       seed=int(rng.integers(2**31)))
+    for index, mesh_object in enumerate(mesh_objects):
+        mesh_object.hide_render = index >= transforms.shape[0]
+        if mesh_object.hide_render:
+            continue
+        mesh_object.location = (transforms[index, 0], transforms[index, 1], transforms[index, 2] + ground_offset)
+        mesh_object.rotation_euler = transforms[index, 3:6]
+
+    # Materials
+    object_labels = []
+    for mesh_object, principled_node in zip(mesh_objects[:transforms.shape[0]], principled_nodes):
+        base_color = colorsys.hsv_to_rgb(rng.uniform(0.0, 1.0), rng.uniform(0.2, 1.0), rng.uniform(0.2, 1.0)) + (1.0, )
+        roughness = rng.uniform(0.05, 0.9)
+        metallic = 1.0 if rng.random() < 0.3 else 0.0
+        utils.set_principled_node(principled_node, base_color=base_color, roughness=roughness, metallic=metallic)
+
+        object_labels.append({
+            "name": mesh_object.name,
+            "location": list(mesh_object.location),
+            "rotation_euler": list(mesh_object.rotation_euler),
+            "base_color": list(base_color),
+            "roughness": roughness,
+            "metallic": metallic,
+        })
+
+    # Environment
+    hdri_rotation = rng.uniform(0.0, 2.0 * math.pi)
+    utils.set_environment_texture_rotation(scene.world, hdri_rotation)
+
+    # Camera pose on a spherical shell around the target, which is tracked through the constraint
+    camera_target_object.location = (rng.uniform(-0.5, 0.5), rng.uniform(-0.5, 0.5), rng.uniform(0.3, 1.0))
+    azimuth = rng.uniform(0.0, 2.0 * math.pi)
+    elevation = math.radians(rng.uniform(10.0, 40.0))
+    distance = rng.uniform(8.0, 14.0)
+    scene.camera.location = (camera_target_object.location[0] + distance * math.cos(elevation) * math.cos(azimuth),
+                             camera_target_object.location[1] + distance * math.cos(elevation) * math.sin(azimuth),
+                             camera_target_object.location[2] + distance * math.sin(elevation))
+
+    return {"objects": object_labels, "hdri_rotation": hdri_rotation}
+
+
+def get_camera_labels(scene: bpy.types.Scene) -> Dict[str, Any]:
+    # The evaluated camera has the pose given by the track-to constraint
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    camera_object = scene.camera.evaluated_get(depsgraph)
+
+    resolution_scale = scene.render.resolution_percentage / 100.0
+    resolution_x = int(scene.render.resolution_x * resolution_scale)
+    resolution_y = int(scene.render.resolution_y * resolution_scale)
+    projection_matrix = camera_object.calc_matrix_camera(depsgraph, x=resolution_x, y=resolution_y)
+
+    return {
+        "matrix_world": [list(row) for row in camera_object.matrix_world],
+        "projection_matrix": [list(row) for row in projection_matrix],
+        "resolution": [resolution_x, resolution_y],
+        "lens": camera_object.data.lens,
+        "sensor_width": camera_object.data.sensor_width,
+    }
+
+
+def get_bounding_boxes(camera_labels: Dict[str, Any], mesh_objects: List[bpy.types.Object],
+                       local_vertices: List[np.ndarray]) -> List[Optional[List[float]]]:
+    '''
+    Return the 2D bounding boxes [x_min, y_min, x_max, y_max] in pixels (from the top-left corner, clamped to the
+    frame) of the projected vertices, or None for objects outside the frame or behind the camera.
+    '''
+
+    resolution_x, resolution_y = camera_labels["resolution"]
+    projection_matrix = np.array(camera_labels["projection_matrix"])
+    view_matrix = np.linalg.inv(np.array(camera_labels["matrix_world"]))
+
+    bounding_boxes: List[Optional[List[float]]] = []
+    for mesh_object, vertices in zip(mesh_objects, local_vertices):
+        matrix = projection_matrix @ view_matrix @ np.array(mesh_object.matrix_world)
+        clip_coords = vertices @ matrix[:, 0:3].T + matrix[:, 3]
+        clip_coords = clip_coords[clip_coords[:, 3] > 0.0]
+        if clip_coords.shape[0] == 0:
+            bounding_boxes.append(None)
+            continue
+
+        xs = np.clip((clip_coords[:, 0] / clip_coords[:, 3] + 1.0) * 0.5 * resolution_x, 0.0, resolution_x)
+        ys = np.clip((1.0 - clip_coords[:, 1] / clip_coords[:, 3]) * 0.5 * resolution_y, 0.0, resolution_y)
+        if xs.min() == xs.max() or ys.min() == ys.max():
+            bounding_boxes.append(None)
+            continue
+        bounding_boxes.append([float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())])
+
+    return bounding_boxes
+
+
+def get_local_vertices(mesh_object: bpy.types.Object) -> np.ndarray:
+    # The objects are only moved, so the vertices with the modifiers applied are computed once
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    evaluated_object = mesh_object.evaluated_get(depsgraph)
+    mesh = evaluated_object.to_mesh()
+
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+
+    evaluated_object.to_mesh_clear()
+
+    return vertices.reshape(-1, 3)
+
+
+def generate_dataset(options: argparse.Namespace) -> None:
+    output_dir_path = os.path.abspath(options.output_dir_path)
+    os.makedirs(output_dir_path, exist_ok=True)
+
+    start_time = time.perf_counter()
+
+    # Scene Building
+    scene = bpy.context.scene
+    utils.clean_objects()
+
+    mesh_objects, principled_nodes, camera_target_object = build_base_scene(scene, options.num_objects, options.hdri)
+
+    radius = utils.get_bounding_radius(mesh_objects[0])
+    ground_offset = -min(corner[2] for corner in mesh_objects[0].bound_box)
+    local_vertices = [get_local_vertices(mesh_object) for mesh_object in mesh_objects]
+
+    # Render Setting
+    utils.set_output_properties(scene, options.resolution_percentage)
+    utils.set_cycles_renderer(scene, scene.camera, options.num_samples)
+    scene.render.use_persistent_data = True
+
+    pass_names = [pass_name for pass_name in options.passes.split(",") if pass_name]
+    pass_indices: Dict[str, int] = {}
+    if pass_names:
+        utils.set_render_passes(scene, pass_names)
+        pass_indices = utils.set_object_pass_indices(scene)
+        utils.set_multilayer_exr_output(scene)
+
+    # The probes render the base scene with the parameters of the last build, which stand for the randomized ones
+    utils.calibrate_sampling_from_environment(scene)
+
+    build_time = time.perf_counter() - start_time
+
+    rng = np.random.default_rng(options.seed)
+    randomization_time = 0.0
+    render_time = 0.0
+
+    with open(os.path.join(output_dir_path, "labels.jsonl"), "w") as labels_file:
+        for index in range(options.num_images):
+            image_name = "{:06d}.{}".format(index, "exr" if pass_names else "png")
+
+            randomization_start_time = time.perf_counter()
+            labels = set_random_parameters(scene, mesh_objects, principled_nodes, camera_target_object, radius,
+                                           ground_offset, rng)
+            labels["image"] = image_name
+            labels["camera"] = get_camera_labels(scene)
+            bounding_boxes = get_bounding_boxes(labels["camera"], mesh_objects, local_vertices)
+            for object_labels, bounding_box in zip(labels["objects"], bounding_boxes):
+                object_labels["bounding_box"] = bounding_box
+                if object_labels["name"] in pass_indices:
+                    object_labels["pass_index"] = pass_indices[object_labels["name"]]
+            randomization_time += time.perf_counter() - randomization_start_time
+
+            render_start_time = time.perf_counter()
+            scene.render.filepath = os.path.join(output_dir_path, image_name)
+            bpy.ops.render.render(write_still=True, scene=scene.name)
+            render_time += time.perf_counter() - render_start_time
+
+            labels_file.write(json.dumps(labels) + "\n")
+            labels_file.flush()
+
+    total_time = time.perf_counter() - start_time
+    summary = {
+        "num_images": options.num_images,
+        "build_time": build_time,
+        "randomization_time": randomization_time,
+        "render_time": render_time,
+        "total_time": total_time,
+        "images_per_hour": 3600.0 * options.num_images / total_time,
+        "render_only_images_per_hour": 3600.0 * options.num_images / render_time if render_time > 0.0 else None,
+    }
+    with open(os.path.join(output_dir_path, "summary.json"), "w") as file:
+        json.dump(summary, file, indent=2)
+
+    print("----")
+    print("Dataset: {} images in {:.2f} sec (build {:.2f} sec, randomization {:.2f} sec, render {:.2f} sec)".format(
+        options.num_images, total_time, build_time, randomization_time, render_time))
+    if render_time > 0.0:
+        print("Dataset: {:.0f} images/hour ({:.0f} images/hour for the render time only)".format(
+            summary["images_per_hour"], summary["render_only_images_per_hour"]))
+    print("----")
+
+
+if __name__ == "__main__":
+    generate_dataset(parse_args(sys.argv[sys.argv.index('--') + 1:]))
@@ -0,0 +1,34 @@
+# blender --background --python generate_texture_lods.py -- [</path/to/texture/directory>]
+#
+# Generate the levels (1024, 512 and 256 pixels on the longer side) of every texture image under the directory
+# (default: ./assets/cc0textures.com) for utils.apply_texture_lods. Up-to-date levels are skipped.
+
+import glob
+import os
+import sys
+
+working_dir_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(working_dir_path)
+
+import utils
+
+
+def get_texture_dir_path() -> str:
+    args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    return os.path.abspath(args[0]) if len(args) > 0 else os.path.join(working_dir_path, "assets/cc0textures.com")
+
+
+if __name__ == "__main__":
+    texture_dir_path = get_texture_dir_path()
+
+    texture_paths = []
+    for extension in ("jpg", "jpeg", "png", "tif", "tiff", "exr", "hdr"):
+        texture_paths += glob.glob(os.path.join(glob.escape(texture_dir_path), "**", "*." + extension), recursive=True)
+
+    for texture_path in sorted(texture_paths):
+        # Do not generate levels of levels
+        if os.sep + "lod" + os.sep in texture_path:
+            continue
+
+        for lod_path in utils.generate_texture_lods(texture_path):
+            print("Saved: " + lod_path)
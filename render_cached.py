@@ -0,0 +1,112 @@
+# blender --background -noaudio --python render_cached.py <render options> -- [cache options] <script.py> <script arguments...>
+#
+# Example:
+#   blender --background -noaudio --python render_cached.py --render-frame 1 -- 07_texturing.py ./out/07_ 100 128
+#
+# Build the scene of a numbered script once and reuse it across Blender processes. The scene is identified by the
+# script source, the utils source, the script arguments except the output path and the sampling policy of the
+# environment (BLENDER_CLI_RENDERING_SAMPLING); the fully built scene is saved as a .blend snapshot in the cache
+# directory, and later runs open the snapshot instead of running the script. The render options given before "--"
+# (--render-frame, --render-anim, --frame-start, ...) then render the scene as usual, so changing only the output path
+# or the frame range hits the cache.
+#
+# Cache options:
+#   --no-scene-cache              Always run the script and neither read nor write snapshots
+#   --scene-cache-dir <path>      Where the snapshots are stored (default: ./out/scene_cache)
+#   --max-scene-cache-size <MB>   Least recently used snapshots are removed beyond this size (default: 4096)
+
+import bpy
+import argparse
+import os
+import runpy
+import sys
+import time
+from typing import List, Tuple
+
+working_dir_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(working_dir_path)
+
+import utils
+
+
+def parse_args(args: List[str]) -> Tuple[argparse.Namespace, str, List[str]]:
+    script_index = next((index for index, arg in enumerate(args) if arg.endswith(".py")), None)
+    if script_index is None:
+        print("Usage: blender --background --python render_cached.py <render options> -- [cache options] <script.py> "
+              "<script arguments...>")
+        sys.exit(1)
+
+    parser = argparse.ArgumentParser(prog="render_cached.py")
+    parser.add_argument("--no-scene-cache", action="store_true", help="Do not read or write scene snapshots")
+    parser.add_argument("--scene-cache-dir", default="./out/scene_cache", help="Where the snapshots are stored")
+    parser.add_argument("--max-scene-cache-size", type=float, default=4096.0, help="Cache size limit in megabytes")
+    options = parser.parse_args(args[:script_index])
+
+    return options, os.path.abspath(args[script_index]), args[script_index + 1:]
+
+
+def run_script(script_path: str, script_args: List[str]) -> None:
+    # The scene scripts read their arguments after "--"
+    argv = sys.argv
+    sys.argv = [bpy.app.binary_path, "--background", "--python", script_path, "--"] + script_args
+    try:
+        runpy.run_path(script_path, run_name="__main__")
+    finally:
+        sys.argv = argv
+
+
+def get_absolute_output_path(output_path: str) -> str:
+    # Keep the trailing separator (e.g., "./out/10/"), which is meaningful for the output path of Blender
+    absolute_output_path = os.path.abspath(output_path)
+    return absolute_output_path + os.sep if output_path.endswith(("/", os.sep)) else absolute_output_path
+
+
+def build_or_open_scene(script_path: str, script_args: List[str], options: argparse.Namespace) -> None:
+    output_arg_index = utils.find_output_path_arg_index(script_args)
+
+    if options.no_scene_cache or output_arg_index is None:
+        run_script(script_path, script_args)
+        return
+
+    scene_args = script_args[:output_arg_index] + script_args[output_arg_index + 1:]
+    key = utils.get_scene_cache_key(script_path, scene_args)
+    cache_dir_path = os.path.abspath(options.scene_cache_dir)
+    snapshot_path = utils.get_scene_snapshot_path(cache_dir_path, key)
+    output_path = get_absolute_output_path(script_args[output_arg_index])
+
+    start_time = time.time()
+
+    if os.path.isfile(snapshot_path):
+        utils.open_scene_snapshot(snapshot_path)
+
+        # Relative paths would be resolved against the location of the snapshot
+        scene = bpy.context.scene
+        scene.render.filepath = output_path
+
+        # Device preferences and the render handlers of the sampling policy are not saved in .blend files
+        utils.set_cycles_devices(prefer_cuda_use=scene.cycles.device == "GPU")
+        utils.restore_sampling_policy_from_environment(scene)
+
+        print("Scene cache: opened {} in {:.2f} sec".format(snapshot_path, time.time() - start_time))
+        return
+
+    run_script(script_path, script_args)
+
+    # The snapshot can be reused only if the output path argument has been identified correctly
+    scene = bpy.context.scene
+    if get_absolute_output_path(bpy.path.abspath(scene.render.filepath)) != output_path:
+        print("Scene cache: the output path of the scene does not match \"{}\"; not cached".format(
+            script_args[output_arg_index]))
+        return
+
+    utils.save_scene_snapshot(snapshot_path)
+    num_evicted_snapshots = utils.evict_scene_snapshots(cache_dir_path,
+                                                        int(options.max_scene_cache_size * 1024 * 1024))
+
+    print("Scene cache: built and saved {} in {:.2f} sec ({} snapshots evicted)".format(
+        snapshot_path, time.time() - start_time, num_evicted_snapshots))
+
+
+if __name__ == "__main__":
+    options, script_path, script_args = parse_args(sys.argv[sys.argv.index('--') + 1:])
+    build_or_open_scene(script_path, script_args, options)
@@ -0,0 +1,141 @@
+# blender --background -noaudio --python render_server.py -- </path/to/spool/directory> [--exit-when-idle]
+#
+# A long-lived render worker. Blender startup, add-on initialization and Cycles kernel loading are paid only once, and
+# scene jobs are rendered back to back. Jobs are JSON files put in "<spool>/pending/":
+#
+#   {"script": "02_suzanne.py", "args": ["./out/02_suzanne_", "100", "128"], "frames": [1]}
+#   {"script": "08_animation.py", "args": ["./out/08/frame_", "100", "128"], "animation": true}
+#
+# "script" is relative to this directory (or absolute) and "args" are the arguments given after "--" as in run.sh.
+# A job is claimed by atomically moving it to "<spool>/running/", and is moved to "<spool>/done/" or "<spool>/failed/"
+# together with a "<job>.log.json" report. Several workers can share one spool directory.
+
+import bpy
+import glob
+import json
+import os
+import runpy
+import sys
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+working_dir_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(working_dir_path)
+
+import utils
+
+spool_sub_dirs = ("pending", "running", "done", "failed")
+
+
+def get_spool_dir_path() -> str:
+    return os.path.abspath(str(sys.argv[sys.argv.index('--') + 1]))
+
+
+def get_exit_when_idle() -> bool:
+    return "--exit-when-idle" in sys.argv[sys.argv.index('--') + 1:]
+
+
+def claim_next_job(spool_dir_path: str) -> Optional[str]:
+    for pending_job_path in sorted(glob.glob(os.path.join(spool_dir_path, "pending", "*.json"))):
+        running_job_path = os.path.join(spool_dir_path, "running", os.path.basename(pending_job_path))
+        try:
+            # Renaming is atomic, so only one worker can claim the job
+            os.rename(pending_job_path, running_job_path)
+        except FileNotFoundError:
+            continue
+        return running_job_path
+
+    return None
+
+
+def reset_blender_state() -> None:
+    # Reload the factory startup file so that every job sees exactly what a fresh Blender process sees (e.g.,
+    # 01_cube.py renders the default cube and camera, and world/compositor settings must not leak between jobs).
+    # Loading a file frees all the datablocks of the previous job; the Cycles kernels stay loaded.
+    bpy.ops.wm.read_homefile(use_factory_startup=True)
+
+    # The caches in utils refer to the datablocks that have just been freed
+    utils.clear_image_cache()
+    utils.deferred_node_trees.clear()
+    utils.clear_node_group_registry()
+    utils.clear_pbr_textured_material_registry()
+    utils.clear_sampling_policy()
+
+    # The profiling report of each job covers only that job
+    utils.clear_profiling_data()
+
+
+def render_job(job: Dict[str, Any]) -> None:
+    script_path = job["script"]
+    if not os.path.isabs(script_path):
+        script_path = os.path.join(working_dir_path, script_path)
+    args: List[str] = [str(arg) for arg in job.get("args", [])]
+
+    # The scene scripts read their arguments after "--"
+    sys.argv = [bpy.app.binary_path, "--background", "--python", script_path, "--"] + args
+    runpy.run_path(script_path, run_name="__main__")
+
+    scene = bpy.context.scene
+    if job.get("animation", False):
+        bpy.ops.render.render(animation=True, scene=scene.name)
+    else:
+        for frame in job.get("frames", [1]):
+            scene.frame_set(int(frame))
+            bpy.ops.render.render(write_still=True, scene=scene.name)
+
+
+def serve(spool_dir_path: str, exit_when_idle: bool, poll_interval: float = 0.5) -> None:
+    for sub_dir in spool_sub_dirs:
+        os.makedirs(os.path.join(spool_dir_path, sub_dir), exist_ok=True)
+
+    server_argv = sys.argv
+    num_jobs = 0
+    server_start_time = time.time()
+
+    while True:
+        job_path = claim_next_job(spool_dir_path)
+
+        if job_path is None:
+            if exit_when_idle:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        job_name = os.path.basename(job_path)
+        print("----")
+        print("Render server: starting " + job_name)
+
+        report: Dict[str, Any] = {"job": job_name}
+        job_start_time = time.time()
+        try:
+            with open(job_path) as file:
+                job = json.load(file)
+            reset_blender_state()
+            render_job(job)
+            status = "done"
+        except Exception:
+            report["traceback"] = traceback.format_exc()
+            print(report["traceback"])
+            status = "failed"
+        finally:
+            sys.argv = server_argv
+
+        report["status"] = status
+        report["elapsed_time"] = time.time() - job_start_time
+
+        finished_job_path = os.path.join(spool_dir_path, status, job_name)
+        os.rename(job_path, finished_job_path)
+        with open(finished_job_path[:-len(".json")] + ".log.json", "w") as file:
+            json.dump(report, file, indent=2)
+
+        num_jobs += 1
+        print("Render server: {} {} in {:.2f} sec".format(job_name, status, report["elapsed_time"]))
+
+    print("----")
+    print("Render server: processed {} jobs in {:.2f} sec".format(num_jobs, time.time() - server_start_time))
+    print("----")
+
+
+if __name__ == "__main__":
+    serve(get_spool_dir_path(), get_exit_when_idle())
@@ -0,0 +1,178 @@
+# python render_shards.py [options] -- <script.py> <script arguments...>
+#
+# Example:
+#   python render_shards.py --num-shards 4 --bake -- 12_cloth.py ./out/12/frame_ 100 128
+#
+# Render the frame range of an animation script (08_animation.py, 09_armature.py, 10_mocap.py, 12_cloth.py, ...) with
+# several Blender processes. The range "scene.frame_start..frame_end" set by the script is split into shards, and each
+# worker process renders one shard with its share of the CPU threads. Workers write placeholders and never overwrite
+# existing frames, so an interrupted run can be resumed and the "dynamic" schedule can balance the load by itself.
+#
+# With "--bake", the scene is built and its simulations (e.g., the cloth in 12_cloth.py) are baked once into a .blend
+# file with a disk cache, and all the workers render from that file instead of simulating again.
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+no_overwrite_expr = "import bpy; bpy.context.scene.render.use_placeholder = True; " \
+                    "bpy.context.scene.render.use_overwrite = False"
+
+
+def get_blender_command(blender_path: str) -> List[str]:
+    return [blender_path, "--background", "-noaudio"]
+
+
+def query_frame_range(blender_path: str, script_path: str, script_args: List[str]) -> Tuple[int, int]:
+    expr = "import bpy; scene = bpy.context.scene; print('FRAME_RANGE', scene.frame_start, scene.frame_end)"
+    command = get_blender_command(blender_path) + ["--python", script_path, "--python-expr", expr, "--"] + script_args
+    output = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    match = re.search(r"^FRAME_RANGE (-?\d+) (-?\d+)$", output, re.MULTILINE)
+    if match is None:
+        raise RuntimeError("Failed to get the frame range from " + script_path)
+
+    return int(match.group(1)), int(match.group(2))
+
+
+def bake_scene(blender_path: str, script_path: str, script_args: List[str], blend_file_path: str) -> None:
+    expr = "import bpy, utils; utils.bake_point_caches_to_disk(bpy.context.scene, {})".format(repr(blend_file_path))
+    command = get_blender_command(blender_path) + ["--python", script_path, "--python-expr", expr, "--"] + script_args
+    subprocess.run(command, check=True)
+
+
+def split_frame_range(frame_start: int, frame_end: int, num_shards: int, schedule: str) -> List[Tuple[int, int]]:
+    if schedule == "dynamic":
+        # Every worker walks through the whole range and skips the frames claimed by the others with placeholders
+        return [(frame_start, frame_end)] * num_shards
+
+    num_frames = frame_end - frame_start + 1
+    num_shards = max(1, min(num_shards, num_frames))
+
+    shards = []
+    for index in range(num_shards):
+        shard_start = frame_start + (num_frames * index) // num_shards
+        shard_end = frame_start + (num_frames * (index + 1)) // num_shards - 1
+        shards.append((shard_start, shard_end))
+
+    return shards
+
+
+class ProgressMonitor:
+    def __init__(self, num_frames: int) -> None:
+        self.num_frames = num_frames
+        self.num_saved_frames = 0
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+    def watch(self, shard_index: int, process: subprocess.Popen) -> None:
+        for line in process.stdout:
+            if line.startswith("Saved:"):
+                with self.lock:
+                    self.num_saved_frames += 1
+                    print("[{:4d}/{:4d}] ({:7.1f} sec) shard #{}: {}".format(self.num_saved_frames, self.num_frames,
+                                                                             time.time() - self.start_time,
+                                                                             shard_index, line.strip()))
+
+
+def render_shards(blender_path: str,
+                  script_path: str,
+                  script_args: List[str],
+                  num_shards: int,
+                  num_threads: int,
+                  schedule: str = "contiguous",
+                  frame_range: Optional[Tuple[int, int]] = None,
+                  bake_blend_file_path: Optional[str] = None) -> bool:
+    if frame_range is None:
+        frame_range = query_frame_range(blender_path, script_path, script_args)
+    frame_start, frame_end = frame_range
+
+    if bake_blend_file_path is not None:
+        os.makedirs(os.path.dirname(bake_blend_file_path), exist_ok=True)
+        bake_scene(blender_path, script_path, script_args, bake_blend_file_path)
+        scene_args = [bake_blend_file_path]
+    else:
+        scene_args = ["--python", script_path]
+
+    shards = split_frame_range(frame_start, frame_end, num_shards, schedule)
+
+    print("----")
+    print("Rendering frames {}..{} with {} workers ({} threads each):".format(frame_start, frame_end, len(shards),
+                                                                            num_threads))
+    for index, (shard_start, shard_end) in enumerate(shards):
+        print("- shard #{}: {}..{}".format(index, shard_start, shard_end))
+    print("----")
+
+    monitor = ProgressMonitor(frame_end - frame_start + 1)
+    processes = []
+    threads = []
+    for index, (shard_start, shard_end) in enumerate(shards):
+        # Blender processes the arguments in order, so the frame range given here overrides the one set by the script
+        command = get_blender_command(blender_path) + scene_args + ["--python-expr", no_overwrite_expr]
+        command += ["--threads", str(num_threads), "--frame-start", str(shard_start), "--frame-end", str(shard_end)]
+        command += ["--render-anim", "--"] + script_args
+
+        process = subprocess.Popen(command,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        thread = threading.Thread(target=monitor.watch, args=(index, process), daemon=True)
+        thread.start()
+
+        processes.append(process)
+        threads.append(thread)
+
+    return_codes = [process.wait() for process in processes]
+    for thread in threads:
+        thread.join()
+
+    print("----")
+    print("Saved {} frames in {:.2f} sec".format(monitor.num_saved_frames, time.time() - monitor.start_time))
+    for index, return_code in enumerate(return_codes):
+        if return_code != 0:
+            print("Shard #{} failed with the exit code {}".format(index, return_code))
+    print("----")
+
+    return all(return_code == 0 for return_code in return_codes)
+
+
+if __name__ == "__main__":
+    if "--" not in sys.argv:
+        print("Usage: python render_shards.py [options] -- <script.py> <script arguments...>")
+        sys.exit(1)
+
+    separator_index = sys.argv.index("--")
+    script_path = os.path.abspath(sys.argv[separator_index + 1])
+    script_args = sys.argv[separator_index + 2:]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blender", default="blender", help="Path to the Blender executable")
+    parser.add_argument("--num-shards", type=int, default=4, help="Number of worker Blender processes")
+    parser.add_argument("--threads", type=int, default=0, help="Threads per worker (default: CPU count / shards)")
+    parser.add_argument("--schedule", choices=("contiguous", "dynamic"), default="contiguous")
+    parser.add_argument("--frame-start", type=int, default=None, help="Override the frame range of the script")
+    parser.add_argument("--frame-end", type=int, default=None, help="Override the frame range of the script")
+    parser.add_argument("--bake", action="store_true", help="Bake simulations once and share them across shards")
+    parser.add_argument("--bake-dir", default="./out/bake", help="Where the baked .blend file and cache are stored")
+    options = parser.parse_args(sys.argv[1:separator_index])
+
+    num_threads = options.threads if options.threads > 0 else max(1, (os.cpu_count() or 1) // options.num_shards)
+
+    frame_range = None
+    if options.frame_start is not None and options.frame_end is not None:
+        frame_range = (options.frame_start, options.frame_end)
+
+    bake_blend_file_path = None
+    if options.bake:
+        script_name = os.path.splitext(os.path.basename(script_path))[0]
+        bake_blend_file_path = os.path.join(os.path.abspath(options.bake_dir), script_name + ".blend")
+
+    succeeded = render_shards(options.blender, script_path, script_args, options.num_shards, num_threads,
+                              options.schedule, frame_range, bake_blend_file_path)
+
+    sys.exit(0 if succeeded else 1)
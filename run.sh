@@ -4,6 +4,10 @@ OUT_DIR="./out"
 
 RESOLUTION=100
 SAMPLINGS=128
+
+# Sampling policy overriding ${SAMPLINGS} per scene, e.g., "noise=0.01,calibrate" or "time=60" (see utils/sampling.py)
+SAMPLING_POLICY=""
+export BLENDER_CLI_RENDERING_SAMPLING=${SAMPLING_POLICY}
 ANIM_FRAMES_OPTION="--render-anim"
 
 # Make this "true" when testing the scripts
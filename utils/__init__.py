@@ -1,5 +1,7 @@
 from utils.utils import *
+from utils.animation import *
 from utils.armature import *
+from utils.bvh import *
 from utils.camera import *
 from utils.composition import *
 from utils.image import *
@@ -8,3 +10,10 @@ from utils.material import *
 from utils.mesh import *
 from utils.modifier import *
 from utils.node import *
+from utils.profiling import *
+from utils.render_passes import *
+from utils.sampling import *
+from utils.scattering import *
+from utils.scene_cache import *
+from utils.texture_lod import *
+from utils.simulation import *
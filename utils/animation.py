@@ -0,0 +1,105 @@
+import bpy
+import numpy as np
+from typing import Optional
+
+
+def get_keyframe_interpolation_value(interpolation: str) -> int:
+    # foreach_set takes the integer values of enum properties
+    return bpy.types.Keyframe.bl_rna.properties["interpolation"].enum_items[interpolation].value
+
+
+def set_fcurve_keyframes(fcurve: bpy.types.FCurve,
+                         frames: np.ndarray,
+                         values: np.ndarray,
+                         interpolation: str = 'LINEAR') -> None:
+    '''
+    Replace the keyframes of the F-Curve with the given (N,) frames and (N,) values in bulk instead of inserting them
+    one by one.
+    '''
+
+    num_keyframes = frames.shape[0]
+    assert values.shape[0] == num_keyframes
+
+    # Reuse the existing keyframe points, which are overwritten below
+    keyframe_points = fcurve.keyframe_points
+    while len(keyframe_points) > num_keyframes:
+        keyframe_points.remove(keyframe_points[-1], fast=True)
+    keyframe_points.add(num_keyframes - len(keyframe_points))
+
+    coords = np.empty((num_keyframes, 2), dtype=np.float32)
+    coords[:, 0] = frames
+    coords[:, 1] = values
+    keyframe_points.foreach_set("co", coords.ravel())
+    keyframe_points.foreach_set("interpolation",
+                                np.full(num_keyframes, get_keyframe_interpolation_value(interpolation), dtype=np.int32))
+
+    # Sort the keyframes and recalculate the handles once
+    fcurve.update()
+
+
+def add_fcurve_with_keyframes(action: bpy.types.Action,
+                              data_path: str,
+                              index: int,
+                              frames: np.ndarray,
+                              values: np.ndarray,
+                              group_name: Optional[str] = None,
+                              interpolation: str = 'LINEAR') -> bpy.types.FCurve:
+    if group_name is None:
+        fcurve = action.fcurves.new(data_path=data_path, index=index)
+    else:
+        fcurve = action.fcurves.new(data_path=data_path, index=index, action_group=group_name)
+    set_fcurve_keyframes(fcurve, frames, values, interpolation)
+    return fcurve
+
+
+def get_or_add_action(id_data: bpy.types.ID) -> bpy.types.Action:
+    '''
+    Return the action of the ID (e.g., an object), adding one named as keyframe_insert does (e.g., "CubeAction") if
+    there is none.
+    '''
+
+    animation_data = id_data.animation_data if id_data.animation_data is not None else id_data.animation_data_create()
+    if animation_data.action is None:
+        animation_data.action = bpy.data.actions.new(name=id_data.name + "Action")
+    return animation_data.action
+
+
+def set_keyframes(id_data: bpy.types.ID,
+                  data_path: str,
+                  frames: np.ndarray,
+                  values: np.ndarray,
+                  interpolation: str = 'BEZIER',
+                  group_name: Optional[str] = None) -> None:
+    '''
+    Key a property of the ID (e.g., an object) at all the frames at once instead of assigning the property and calling
+    keyframe_insert for each frame. Existing keyframes of the property are replaced.
+
+    frames: (N,) frames
+    values: (N,) values of a single property or (N, C) values of an array property (e.g., "location")
+    '''
+
+    action = get_or_add_action(id_data)
+
+    channel_values = values.reshape(values.shape[0], -1)
+    for index in range(channel_values.shape[1]):
+        fcurve = action.fcurves.find(data_path, index=index)
+        if fcurve is None:
+            add_fcurve_with_keyframes(action, data_path, index, frames, channel_values[:, index], group_name,
+                                      interpolation)
+        else:
+            set_fcurve_keyframes(fcurve, frames, channel_values[:, index], interpolation)
+
+
+def set_pose_bone_keyframes(armature_object: bpy.types.Object,
+                            bone_name: str,
+                            property_name: str,
+                            frames: np.ndarray,
+                            values: np.ndarray,
+                            interpolation: str = 'BEZIER') -> None:
+    '''
+    Key a property of the pose bone (e.g., "rotation_euler") at all the frames at once (see set_keyframes). The
+    F-Curves are grouped by the bone name, as keyframe_insert does.
+    '''
+
+    data_path = 'pose.bones["{}"].{}'.format(bone_name, property_name)
+    set_keyframes(armature_object, data_path, frames, values, interpolation, group_name=bone_name)
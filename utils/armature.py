@@ -1,40 +1,39 @@
 import bpy
-import mathutils
-from utils.mesh import create_mesh_from_pydata
+import numpy as np
+from utils.mesh import create_mesh_from_numpy
 from utils.modifier import add_subdivision_surface_modifier
-from typing import Any, Dict, Iterable, List, Tuple
+from typing import List, Tuple
+from utils.profiling import profile_function
 
 
+@profile_function
 def create_armature_mesh(scene: bpy.types.Scene, armature_object: bpy.types.Object, mesh_name: str) -> bpy.types.Object:
     assert armature_object.type == 'ARMATURE', 'Error'
     assert len(armature_object.data.bones) != 0, 'Error'
 
-    def add_rigid_vertex_group(target_object: bpy.types.Object, name: str, vertex_indices: Iterable[int]) -> None:
-        new_vertex_group = target_object.vertex_groups.new(name=name)
-        for vertex_index in vertex_indices:
-            new_vertex_group.add([vertex_index], 1.0, 'REPLACE')
-
-    def generate_bone_mesh_pydata(radius: float, length: float) -> Tuple[List[mathutils.Vector], List[List[int]]]:
-        base_radius = radius
-        top_radius = 0.5 * radius
-
-        vertices = [
+    def get_bone_mesh_template() -> Tuple[np.ndarray, np.ndarray, List[List[int]]]:
+        # The vertices of a bone with a radius r and a length l are given by r * radius_coeffs + l * length_coeffs
+        # in the bone space; the top part is half the size of the base part
+        radius_coeffs = np.array([
             # Cross section of the base part
-            mathutils.Vector((-base_radius, 0.0, +base_radius)),
-            mathutils.Vector((+base_radius, 0.0, +base_radius)),
-            mathutils.Vector((+base_radius, 0.0, -base_radius)),
-            mathutils.Vector((-base_radius, 0.0, -base_radius)),
+            (-1.0, 0.0, +1.0),
+            (+1.0, 0.0, +1.0),
+            (+1.0, 0.0, -1.0),
+            (-1.0, 0.0, -1.0),
 
             # Cross section of the top part
-            mathutils.Vector((-top_radius, length, +top_radius)),
-            mathutils.Vector((+top_radius, length, +top_radius)),
-            mathutils.Vector((+top_radius, length, -top_radius)),
-            mathutils.Vector((-top_radius, length, -top_radius)),
+            (-0.5, 0.0, +0.5),
+            (+0.5, 0.0, +0.5),
+            (+0.5, 0.0, -0.5),
+            (-0.5, 0.0, -0.5),
 
             # End points
-            mathutils.Vector((0.0, -base_radius, 0.0)),
-            mathutils.Vector((0.0, length + top_radius, 0.0))
-        ]
+            (0.0, -1.0, 0.0),
+            (0.0, +0.5, 0.0),
+        ])
+        length_coeffs = np.zeros((10, 3))
+        length_coeffs[4:8, 1] = 1.0
+        length_coeffs[9, 1] = 1.0
 
         faces = [
             # End point for the base part
@@ -56,46 +55,44 @@ def create_armature_mesh(scene: bpy.types.Scene, armature_object: bpy.types.Obje
             [3, 0, 4, 7],
         ]
 
-        return vertices, faces
+        return radius_coeffs, length_coeffs, faces
 
     armature_data: bpy.types.Armature = armature_object.data
-
-    vertices: List[mathutils.Vector] = []
-    faces: List[List[int]] = []
-    vertex_groups: List[Dict[str, Any]] = []
-
-    for bone in armature_data.bones:
-        radius = 0.10 * (0.10 + bone.length)
-        temp_vertices, temp_faces = generate_bone_mesh_pydata(radius, bone.length)
-
-        vertex_index_offset = len(vertices)
-
-        temp_vertex_group = {'name': bone.name, 'vertex_indices': []}
-        for local_index, vertex in enumerate(temp_vertices):
-            vertices.append(bone.matrix_local @ vertex)
-            temp_vertex_group['vertex_indices'].append(local_index + vertex_index_offset)
-        vertex_groups.append(temp_vertex_group)
-
-        for face in temp_faces:
-            if len(face) == 3:
-                faces.append([
-                    face[0] + vertex_index_offset,
-                    face[1] + vertex_index_offset,
-                    face[2] + vertex_index_offset,
-                ])
-            else:
-                faces.append([
-                    face[0] + vertex_index_offset,
-                    face[1] + vertex_index_offset,
-                    face[2] + vertex_index_offset,
-                    face[3] + vertex_index_offset,
-                ])
-
-    new_object = create_mesh_from_pydata(scene, vertices, faces, mesh_name, mesh_name)
+    bones = armature_data.bones
+    num_bones = len(bones)
+
+    radius_coeffs, length_coeffs, template_faces = get_bone_mesh_template()
+    num_template_vertices = radius_coeffs.shape[0]
+
+    lengths = np.empty(num_bones, dtype=np.float32)
+    bones.foreach_get("length", lengths)
+    # Matrices are read in the column-major order
+    matrices = np.empty(num_bones * 16, dtype=np.float32)
+    bones.foreach_get("matrix_local", matrices)
+    matrices = matrices.reshape(num_bones, 4, 4).transpose(0, 2, 1)
+
+    # Build the vertices of all the bones in the bone spaces and transform them with one batched multiplication
+    radii = 0.10 * (0.10 + lengths)
+    local_vertices = radii[:, None, None] * radius_coeffs + lengths[:, None, None] * length_coeffs
+    vertices = local_vertices @ matrices[:, :3, :3].transpose(0, 2, 1) + matrices[:, None, :3, 3]
+
+    # Repeat the faces of the template with the vertex index offsets of the bones
+    template_loop_vertex_indices = np.concatenate([np.array(face) for face in template_faces])
+    vertex_index_offsets = num_template_vertices * np.arange(num_bones)
+    loop_vertex_indices = (template_loop_vertex_indices[None, :] + vertex_index_offsets[:, None]).ravel()
+    template_loop_totals = np.array([len(face) for face in template_faces])
+    loop_totals = np.tile(template_loop_totals, num_bones)
+    loop_starts = np.concatenate(([0], np.cumsum(loop_totals)[:-1]))
+
+    new_object = create_mesh_from_numpy(scene, vertices.reshape(-1, 3), loop_vertex_indices, loop_starts, loop_totals,
+                                        mesh_name, mesh_name)
     new_object.matrix_world = armature_object.matrix_world
 
-    for vertex_group in vertex_groups:
-        add_rigid_vertex_group(new_object, vertex_group['name'], vertex_group['vertex_indices'])
+    # Each bone rigidly moves its own vertices
+    for bone, vertex_index_offset in zip(bones, vertex_index_offsets.tolist()):
+        new_vertex_group = new_object.vertex_groups.new(name=bone.name)
+        new_vertex_group.add(list(range(vertex_index_offset, vertex_index_offset + num_template_vertices)), 1.0,
+                             'REPLACE')
 
     armature_modifier = new_object.modifiers.new('Armature', 'ARMATURE')
     armature_modifier.object = armature_object
@@ -0,0 +1,496 @@
+import bpy
+import hashlib
+import math
+import os
+import re
+import numpy as np
+from bpy_extras.io_utils import axis_conversion
+from typing import Any, Dict, List, Optional, Tuple
+from utils.animation import add_fcurve_with_keyframes
+from utils.profiling import profile_function, increment_counter
+
+axis_indices = {"X": 0, "Y": 1, "Z": 2}
+
+# Columns of the channel index table: the channel of each of them in a frame, or -1 if the joint does not have it
+bvh_channel_columns = ("xposition", "yposition", "zposition", "xrotation", "yrotation", "zrotation")
+
+################################################################################
+# Parsing
+################################################################################
+
+
+def parse_bvh(bvh_path: str) -> Dict[str, Any]:
+    '''
+    Parse a BVH file into a clip, a dictionary of NumPy arrays:
+
+    joint_names: (J,) joint names in the file order, where a parent always precedes its children
+    parent_indices: (J,) index of the parent joint, or -1 for the root
+    offsets: (J, 3) offsets from the parent joint
+    end_site_offsets: (J, 3) offsets of the end sites from the joints (zero if has_end_sites is False)
+    has_end_sites: (J,)
+    channel_indices: (J, 6) channel of the X/Y/Z position and X/Y/Z rotation in a frame, or -1
+    rotation_orders: (J,) rotation channels in the file order, e.g., "ZYX" (the first one is the outermost rotation)
+    motion: (F, C) channel values of all the frames (rotations in degrees)
+    frame_time: () seconds per frame
+
+    The hierarchy is parsed line by line, and the motion block is read at once.
+    '''
+
+    with open(bvh_path, "r") as file:
+        text = file.read()
+
+    motion_match = re.search(r"^\s*MOTION\s*$", text, flags=re.MULTILINE)
+    if motion_match is None:
+        raise ValueError("{} does not have a MOTION section".format(bvh_path))
+
+    joint_names: List[str] = []
+    parent_indices: List[int] = []
+    offsets: List[List[float]] = []
+    end_site_offsets: List[List[float]] = []
+    has_end_sites: List[bool] = []
+    channel_indices: List[List[int]] = []
+    rotation_orders: List[str] = []
+
+    # Joint index for each open brace, or -1 for the brace of an end site
+    stack: List[int] = []
+    end_site_owner = -1
+    num_channels = 0
+
+    for line in text[:motion_match.start()].splitlines():
+        words = line.split()
+        if len(words) == 0:
+            continue
+
+        keyword = words[0].upper()
+        if keyword in ("ROOT", "JOINT"):
+            joint_names.append(" ".join(words[1:]))
+            parent_indices.append(stack[-1] if stack else -1)
+            offsets.append([0.0, 0.0, 0.0])
+            end_site_offsets.append([0.0, 0.0, 0.0])
+            has_end_sites.append(False)
+            channel_indices.append([-1] * len(bvh_channel_columns))
+            rotation_orders.append("")
+        elif keyword == "END":
+            end_site_owner = stack[-1]
+        elif keyword == "{":
+            stack.append(-1 if end_site_owner >= 0 else len(joint_names) - 1)
+        elif keyword == "}":
+            if stack.pop() == -1:
+                end_site_owner = -1
+        elif keyword == "OFFSET":
+            offset = [float(word) for word in words[1:4]]
+            if end_site_owner >= 0:
+                end_site_offsets[end_site_owner] = offset
+                has_end_sites[end_site_owner] = True
+            else:
+                offsets[-1] = offset
+        elif keyword == "CHANNELS":
+            for channel_name in words[2:2 + int(words[1])]:
+                channel_name = channel_name.lower()
+                channel_indices[-1][bvh_channel_columns.index(channel_name)] = num_channels
+                if channel_name.endswith("rotation"):
+                    rotation_orders[-1] += channel_name[0].upper()
+                num_channels += 1
+
+    header_match = re.search(r"Frames:\s*(\d+)\s*Frame\s+Time:\s*(\S+)", text[motion_match.end():])
+    if header_match is None:
+        raise ValueError("{} does not have a valid MOTION header".format(bvh_path))
+
+    # Read all the frames at once; a truncated last frame is dropped
+    values = np.fromstring(text[motion_match.end() + header_match.end():], dtype=np.float64, sep=" ")
+    num_frames = min(int(header_match.group(1)), values.shape[0] // max(num_channels, 1))
+
+    return {
+        "joint_names": np.array(joint_names, dtype=np.str_),
+        "parent_indices": np.array(parent_indices, dtype=np.int32),
+        "offsets": np.array(offsets, dtype=np.float64).reshape(-1, 3),
+        "end_site_offsets": np.array(end_site_offsets, dtype=np.float64).reshape(-1, 3),
+        "has_end_sites": np.array(has_end_sites, dtype=bool),
+        "channel_indices": np.array(channel_indices, dtype=np.int32).reshape(-1, len(bvh_channel_columns)),
+        "rotation_orders": np.array(rotation_orders, dtype=np.str_),
+        "motion": values[:num_frames * num_channels].reshape(num_frames, num_channels),
+        "frame_time": np.array(float(header_match.group(2))),
+    }
+
+
+################################################################################
+# Rotations
+################################################################################
+
+
+def get_axis_rotation_matrices(axis: str, angles: np.ndarray) -> np.ndarray:
+    cos, sin = np.cos(angles), np.sin(angles)
+    i = axis_indices[axis]
+    j, k = (i + 1) % 3, (i + 2) % 3
+
+    matrices = np.zeros(angles.shape + (3, 3))
+    matrices[..., i, i] = 1.0
+    matrices[..., j, j] = cos
+    matrices[..., k, k] = cos
+    matrices[..., j, k] = -sin
+    matrices[..., k, j] = sin
+
+    return matrices
+
+
+def get_rotation_matrices_from_euler(angles: np.ndarray, order: str) -> np.ndarray:
+    '''
+    Convert (..., 3) X/Y/Z angles into (..., 3, 3) rotation matrices with the convention of Blender's Euler (e.g.,
+    "XYZ" means that the X rotation is applied first, i.e., Rz @ Ry @ Rx).
+    '''
+
+    matrices = np.broadcast_to(np.eye(3), angles.shape[:-1] + (3, 3))
+    for axis in order:
+        matrices = get_axis_rotation_matrices(axis, angles[..., axis_indices[axis]]) @ matrices
+    return matrices
+
+
+def get_euler_from_rotation_matrices(matrices: np.ndarray, order: str) -> np.ndarray:
+    '''
+    The inverse of get_rotation_matrices_from_euler, returning X/Y/Z angles with the middle angle in [-pi/2, pi/2].
+    '''
+
+    i, j, k = (axis_indices[axis] for axis in order)
+    parity = 1.0 if (j - i) % 3 == 1 else -1.0
+
+    angles = np.empty(matrices.shape[:-2] + (3,))
+    angles[..., i] = np.arctan2(parity * matrices[..., k, j], matrices[..., k, k])
+    angles[..., j] = np.arctan2(-parity * matrices[..., k, i], np.hypot(matrices[..., i, i], matrices[..., j, i]))
+    angles[..., k] = np.arctan2(parity * matrices[..., j, i], matrices[..., i, i])
+
+    return angles
+
+
+################################################################################
+# Armature creation
+################################################################################
+
+
+def get_bvh_rest_pose(clip: Dict[str, Any], global_scale: float) -> Tuple[np.ndarray, ...]:
+    '''
+    Compute the (J, 3) heads and tails of the joints in the same way as Blender's BVH importer, returning (heads
+    relative to the parents, heads in the BVH space, tails relative to the parents, tails in the BVH space).
+    '''
+
+    parent_indices = clip["parent_indices"]
+    num_joints = parent_indices.shape[0]
+
+    heads_local = global_scale * clip["offsets"]
+    heads_world = heads_local.copy()
+    for joint_index in range(num_joints):
+        if parent_indices[joint_index] >= 0:
+            heads_world[joint_index] += heads_world[parent_indices[joint_index]]
+
+    end_site_offsets = global_scale * clip["end_site_offsets"]
+    tails_local = heads_local + end_site_offsets
+    tails_world = heads_world + end_site_offsets
+
+    for joint_index in range(num_joints):
+        if not clip["has_end_sites"][joint_index]:
+            child_indices = np.flatnonzero(parent_indices == joint_index)
+            if child_indices.shape[0] == 1:
+                tails_world[joint_index] = heads_world[child_indices[0]]
+                tails_local[joint_index] = heads_local[joint_index] + heads_local[child_indices[0]]
+            elif child_indices.shape[0] > 1:
+                tails_world[joint_index] = heads_world[child_indices].mean(axis=0)
+                tails_local[joint_index] = heads_local[child_indices].mean(axis=0)
+
+        # Make sure that the tail is not at the head
+        if np.linalg.norm(tails_local[joint_index] - heads_local[joint_index]) <= 0.001 * global_scale:
+            tails_local[joint_index, 1] += global_scale / 10.0
+            tails_world[joint_index, 1] += global_scale / 10.0
+
+    return heads_local, heads_world, tails_local, tails_world
+
+
+def build_bvh_bones(armature_object: bpy.types.Object, clip: Dict[str, Any], global_scale: float) -> List[str]:
+    '''
+    Create the bones of the clip in the BVH space with the same rules as Blender's BVH importer (including the
+    handling of zero-length bones and connected bones) and return the bone names.
+    '''
+
+    parent_indices = clip["parent_indices"]
+    has_locations = (clip["channel_indices"][:, :3] >= 0).any(axis=1)
+    heads_local, heads_world, tails_local, tails_world = get_bvh_rest_pose(clip, global_scale)
+
+    lengths = np.linalg.norm(heads_local - tails_local, axis=1)
+    average_length = lengths[lengths > 0.0].mean() if (lengths > 0.0).any() else 0.1
+
+    bpy.context.view_layer.objects.active = armature_object
+    bpy.ops.object.mode_set(mode='EDIT')
+
+    edit_bones: List[bpy.types.EditBone] = []
+    is_zero_length: List[bool] = []
+    for joint_index, joint_name in enumerate(clip["joint_names"]):
+        edit_bone = armature_object.data.edit_bones.new(str(joint_name))
+
+        head = heads_world[joint_index]
+        tail = tails_world[joint_index].copy()
+        is_zero_length.append(bool(np.linalg.norm(head - tail) < 0.001))
+        if is_zero_length[-1]:
+            parent_index = parent_indices[joint_index]
+            parent_offset = heads_local[parent_index] - tails_local[parent_index] if parent_index >= 0 else np.zeros(3)
+            if np.linalg.norm(parent_offset) > 0.0:
+                tail -= parent_offset
+            else:
+                tail[1] += average_length
+
+        edit_bone.head = head
+        edit_bone.tail = tail
+        edit_bones.append(edit_bone)
+
+    for joint_index, parent_index in enumerate(parent_indices):
+        if parent_index < 0:
+            continue
+        edit_bones[joint_index].parent = edit_bones[parent_index]
+        edit_bones[joint_index].use_connect = bool(not has_locations[joint_index] and not is_zero_length[parent_index]
+                                                   and np.array_equal(tails_local[parent_index],
+                                                                      heads_local[joint_index]))
+
+    # The names may have been changed (e.g., shortened) by Blender
+    bone_names = [edit_bone.name for edit_bone in edit_bones]
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    return bone_names
+
+
+def get_bvh_pose_channels(clip: Dict[str, Any], global_scale: float,
+                          rest_matrices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert the motion of the clip into the channels of the pose bones in batch, given the (J, 3, 3) rest orientations
+    of the bones. Returns the (K, 2) joint index and column (0-2 for the location, 3-5 for the Euler rotation in the
+    rotation mode of the bone) of each channel and the (F, K) channel values of all the frames.
+    '''
+
+    heads_local = global_scale * clip["offsets"]
+    motion = clip["motion"]
+
+    curve_channels: List[Tuple[int, int]] = []
+    pose_channels: List[np.ndarray] = [np.empty((motion.shape[0], 0))]
+    for joint_index, rest_matrix in enumerate(rest_matrices):
+        location_channels = clip["channel_indices"][joint_index, :3]
+        rotation_channels = clip["channel_indices"][joint_index, 3:]
+
+        # The motion is given in the BVH space, and the pose is relative to the rest orientation of the bone
+        if (location_channels >= 0).any():
+            locations = np.where(location_channels >= 0, global_scale * motion[:, location_channels], 0.0)
+            locations = (locations - heads_local[joint_index]) @ rest_matrix
+
+            curve_channels += [(joint_index, column) for column in range(3)]
+            pose_channels.append(locations)
+
+        if (rotation_channels >= 0).any():
+            rotation_mode = get_bvh_rotation_mode(clip, joint_index)
+
+            angles = np.where(rotation_channels >= 0, np.radians(motion[:, rotation_channels]), 0.0)
+            rotations = get_rotation_matrices_from_euler(angles, rotation_mode)
+            rotations = rest_matrix.T @ rotations @ rest_matrix
+
+            # Avoid jumps of 2 pi between consecutive frames
+            angles = np.unwrap(get_euler_from_rotation_matrices(rotations, rotation_mode), axis=0)
+
+            curve_channels += [(joint_index, column) for column in range(3, 6)]
+            pose_channels.append(angles)
+
+    curve_channels_array = np.array(curve_channels, dtype=np.int32).reshape(-1, 2)
+    return curve_channels_array, np.concatenate(pose_channels, axis=1).astype(np.float32)
+
+
+def get_bvh_rotation_mode(clip: Dict[str, Any], joint_index: int) -> str:
+    # The first rotation channel is the outermost one, which is the last one in the order of Blender's Euler
+    rotation_order = str(clip["rotation_orders"][joint_index])
+    return rotation_order[::-1] if len(rotation_order) == 3 else 'XYZ'
+
+
+def build_bvh_action(scene: bpy.types.Scene,
+                     armature_object: bpy.types.Object,
+                     bone_names: List[str],
+                     clip: Dict[str, Any],
+                     frame_start: int,
+                     use_fps_scale: bool) -> None:
+    '''
+    Create the action of the armature from the pose channels of the clip (see get_bvh_pose_channels), writing each
+    F-Curve at once.
+    '''
+
+    name = armature_object.name
+    pose_channels = clip["pose_channels"]
+    num_frames = pose_channels.shape[0]
+
+    frame_step = scene.render.fps * float(clip["frame_time"]) if use_fps_scale else 1.0
+    frames = frame_start + frame_step * np.arange(num_frames)
+
+    action = bpy.data.actions.new(name=name)
+    armature_object.animation_data_create()
+    armature_object.animation_data.action = action
+
+    for curve_index, (joint_index, column) in enumerate(clip["curve_channels"]):
+        bone_name = bone_names[joint_index]
+        if column < 3:
+            data_path = 'pose.bones["{}"].location'.format(bone_name)
+        else:
+            data_path = 'pose.bones["{}"].rotation_euler'.format(bone_name)
+            armature_object.pose.bones[bone_name].rotation_mode = get_bvh_rotation_mode(clip, joint_index)
+
+        add_fcurve_with_keyframes(action, data_path, column % 3, frames, pose_channels[:, curve_index],
+                                  str(clip["joint_names"][joint_index]))
+
+
+@profile_function
+def create_armature_from_bvh_clip(scene: bpy.types.Scene,
+                                  clip: Dict[str, Any],
+                                  name: str,
+                                  global_scale: float = 1.0,
+                                  axis_forward: str = '-Z',
+                                  axis_up: str = 'Y',
+                                  frame_start: int = 1,
+                                  use_fps_scale: bool = True,
+                                  update_scene_duration: bool = True) -> bpy.types.Object:
+    '''
+    Create an animated armature from a clip (see parse_bvh). The result is equivalent to that of
+    bpy.ops.import_anim.bvh with target='ARMATURE' and rotate_mode='NATIVE', except that the axis conversion is kept as
+    the object transform instead of being applied to the bones. The channel curves of all the frames are computed in
+    batch and written to each F-Curve at once.
+
+    The pose channels are added to the clip ("curve_channels", "pose_channels" and "pose_global_scale"), so that the
+    clip can be saved as a motion cache. If the clip already has them for the global scale (e.g., a clip loaded from
+    a motion cache), they are used as they are and the clip does not need the "motion" item.
+    '''
+
+    armature: bpy.types.Armature = bpy.data.armatures.new(name)
+    armature_object: bpy.types.Object = bpy.data.objects.new(name, armature)
+    scene.collection.objects.link(armature_object)
+
+    bone_names = build_bvh_bones(armature_object, clip, global_scale)
+
+    if "pose_channels" not in clip or float(clip["pose_global_scale"]) != global_scale:
+        rest_matrices = np.array([armature.bones[bone_name].matrix_local.to_3x3() for bone_name in bone_names])
+        clip["curve_channels"], clip["pose_channels"] = get_bvh_pose_channels(clip, global_scale, rest_matrices)
+        clip["pose_global_scale"] = np.array(global_scale)
+
+    build_bvh_action(scene, armature_object, bone_names, clip, frame_start, use_fps_scale)
+
+    armature_object.matrix_world = axis_conversion(from_forward=axis_forward, from_up=axis_up).to_4x4()
+
+    if update_scene_duration:
+        num_frames = clip["pose_channels"].shape[0]
+        if use_fps_scale:
+            scene_fps = scene.render.fps / scene.render.fps_base
+            frame_end = frame_start + math.ceil(num_frames * float(clip["frame_time"]) * scene_fps)
+        else:
+            frame_end = frame_start + num_frames - 1
+        scene.frame_end = max(scene.frame_end, frame_end)
+
+    return armature_object
+
+
+################################################################################
+# Motion cache
+################################################################################
+
+# Items of a clip stored in the motion cache; the pose channels are stored separately so that they can be mapped
+motion_cache_items = ("joint_names", "parent_indices", "offsets", "end_site_offsets", "has_end_sites",
+                      "channel_indices", "rotation_orders", "frame_time", "curve_channels", "pose_global_scale")
+
+# Bump this when the conversion changes so that old caches are not used
+motion_cache_version = 1
+
+
+def get_bvh_motion_cache_key(bvh_path: str, global_scale: float, axis_forward: str, axis_up: str,
+                             use_fps_scale: bool) -> str:
+    '''
+    A hash of the content of the BVH file and the import settings.
+    '''
+
+    hasher = hashlib.sha1()
+    with open(bvh_path, "rb") as file:
+        hasher.update(file.read())
+    hasher.update(repr([motion_cache_version, global_scale, axis_forward, axis_up, use_fps_scale]).encode("utf-8"))
+
+    return hasher.hexdigest()[:16]
+
+
+def get_bvh_motion_cache_paths(cache_dir_path: str, cache_key: str) -> Tuple[str, str]:
+    # (the hierarchy and the curve layout, the (F, K) float32 pose channels)
+    file_path_prefix = os.path.join(os.path.abspath(cache_dir_path), "motion_" + cache_key)
+    return file_path_prefix + ".npz", file_path_prefix + ".npy"
+
+
+def save_bvh_motion_cache(cache_dir_path: str, cache_key: str, clip: Dict[str, Any]) -> None:
+    '''
+    Save a clip with pose channels (see create_armature_from_bvh_clip). Both files are written under temporary names
+    first, and the pose channels are written before the hierarchy, so a cache with the hierarchy file is complete.
+    '''
+
+    hierarchy_path, pose_channels_path = get_bvh_motion_cache_paths(cache_dir_path, cache_key)
+    os.makedirs(os.path.dirname(hierarchy_path), exist_ok=True)
+
+    temp_path_prefix = "{}.{}.tmp".format(hierarchy_path[:-len(".npz")], os.getpid())
+
+    np.save(temp_path_prefix + ".npy", np.ascontiguousarray(clip["pose_channels"], dtype=np.float32))
+    os.replace(temp_path_prefix + ".npy", pose_channels_path)
+
+    np.savez(temp_path_prefix + ".npz", **{item: clip[item] for item in motion_cache_items})
+    os.replace(temp_path_prefix + ".npz", hierarchy_path)
+
+
+def load_bvh_motion_cache(cache_dir_path: str, cache_key: str) -> Optional[Dict[str, Any]]:
+    '''
+    Load a clip saved by save_bvh_motion_cache, or return None if there is no such cache. The pose channels are
+    memory-mapped, so processes loading the same clip share the pages of the file.
+    '''
+
+    hierarchy_path, pose_channels_path = get_bvh_motion_cache_paths(cache_dir_path, cache_key)
+    if not os.path.isfile(hierarchy_path) or not os.path.isfile(pose_channels_path):
+        return None
+
+    with np.load(hierarchy_path) as hierarchy:
+        clip = {item: hierarchy[item] for item in motion_cache_items}
+    clip["pose_channels"] = np.load(pose_channels_path, mmap_mode='r')
+
+    return clip
+
+
+def create_armature_from_bvh(scene: bpy.types.Scene,
+                             bvh_path: str,
+                             global_scale: float = 1.0,
+                             axis_forward: str = '-Z',
+                             axis_up: str = 'Y',
+                             frame_start: int = 1,
+                             use_fps_scale: bool = True,
+                             update_scene_duration: bool = True,
+                             motion_cache_dir_path: Optional[str] = None) -> bpy.types.Object:
+    '''
+    A faster alternative to bpy.ops.import_anim.bvh (see create_armature_from_bvh_clip). The armature, the action and
+    the object are named after the file, as the operator does.
+
+    motion_cache_dir_path: if given, the converted motion is cached there (keyed by the file content and the import
+    settings), and later calls with the same file and settings skip parsing and conversion
+    '''
+
+    name = bpy.path.display_name_from_filepath(bvh_path)
+    settings = {
+        "global_scale": global_scale,
+        "axis_forward": axis_forward,
+        "axis_up": axis_up,
+        "frame_start": frame_start,
+        "use_fps_scale": use_fps_scale,
+        "update_scene_duration": update_scene_duration,
+    }
+
+    if motion_cache_dir_path is None:
+        return create_armature_from_bvh_clip(scene, parse_bvh(bvh_path), name, **settings)
+
+    cache_key = get_bvh_motion_cache_key(bvh_path, global_scale, axis_forward, axis_up, use_fps_scale)
+    clip = load_bvh_motion_cache(motion_cache_dir_path, cache_key)
+    if clip is not None:
+        increment_counter("motion_cache_hits")
+        return create_armature_from_bvh_clip(scene, clip, name, **settings)
+
+    increment_counter("motion_cache_misses")
+    clip = parse_bvh(bvh_path)
+    armature_object = create_armature_from_bvh_clip(scene, clip, name, **settings)
+    save_bvh_motion_cache(motion_cache_dir_path, cache_key, clip)
+
+    return armature_object
@@ -1,11 +1,15 @@
 import bpy
-from typing import Tuple
+from typing import Optional, Tuple
+from utils.profiling import profile_function
+from utils.utils import create_object
 
 
-def create_camera(location: Tuple[float, float, float]) -> bpy.types.Object:
-    bpy.ops.object.camera_add(location=location)
+@profile_function
+def create_camera(location: Tuple[float, float, float],
+                  collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    camera = bpy.data.cameras.new("Camera")
 
-    return bpy.context.object
+    return create_object(camera, "Camera", location, collection=collection)
 
 
 def set_camera_params(camera: bpy.types.Camera,
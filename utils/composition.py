@@ -1,8 +1,9 @@
 import bpy
-from utils.node import set_socket_value_range, clean_nodes, arrange_nodes
+from utils.node import set_socket_value_range, clean_nodes, request_arrange_nodes, get_or_add_node_group
+from utils.profiling import profile_function
 
 
-def add_split_tone_node_group() -> bpy.types.NodeGroup:
+def add_split_tone_sub_node_group() -> bpy.types.NodeGroup:
     group = bpy.data.node_groups.new(type="CompositorNodeTree", name="SplitToneSub")
 
     input_node = group.nodes.new("NodeGroupInput")
@@ -39,9 +40,13 @@ def add_split_tone_node_group() -> bpy.types.NodeGroup:
     group.links.new(input_sep_node.outputs["A"], comb_node.inputs["A"])
     group.links.new(comb_node.outputs["Image"], output_node.inputs["Image"])
 
-    arrange_nodes(group)
+    request_arrange_nodes(group)
+
+    return group
 
-    # --------------------------------------------------------------------------
+
+def add_split_tone_node_group() -> bpy.types.NodeGroup:
+    split_tone_sub_node_group = get_or_add_node_group(add_split_tone_sub_node_group)
 
     group = bpy.data.node_groups.new(type="CompositorNodeTree", name="SplitTone")
 
@@ -78,11 +83,11 @@ def add_split_tone_node_group() -> bpy.types.NodeGroup:
 
     shadows_node = group.nodes.new(type='CompositorNodeGroup')
     shadows_node.name = "Shadows"
-    shadows_node.node_tree = bpy.data.node_groups["SplitToneSub"]
+    shadows_node.node_tree = split_tone_sub_node_group
 
     highlights_node = group.nodes.new(type='CompositorNodeGroup')
     highlights_node.name = "Highlights"
-    highlights_node.node_tree = bpy.data.node_groups["SplitToneSub"]
+    highlights_node.node_tree = split_tone_sub_node_group
 
     comb_node = group.nodes.new(type="CompositorNodeMixRGB")
     comb_node.use_clamp = False
@@ -106,7 +111,7 @@ def add_split_tone_node_group() -> bpy.types.NodeGroup:
     group.links.new(highlights_node.outputs["Image"], comb_node.inputs[2])
     group.links.new(comb_node.outputs["Image"], output_node.inputs["Image"])
 
-    arrange_nodes(group)
+    request_arrange_nodes(group)
 
     return group
 
@@ -146,13 +151,14 @@ def add_vignette_node_group() -> bpy.types.NodeGroup:
     group.links.new(blur_node.outputs["Image"], mix_node.inputs[2])
     group.links.new(mix_node.outputs["Image"], output_node.inputs["Image"])
 
-    arrange_nodes(group)
+    request_arrange_nodes(group)
 
     return group
 
 
+@profile_function
 def create_split_tone_node(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
-    split_tone_node_group = add_split_tone_node_group()
+    split_tone_node_group = get_or_add_node_group(add_split_tone_node_group)
 
     node = node_tree.nodes.new(type='CompositorNodeGroup')
     node.name = "SplitTone"
@@ -161,8 +167,9 @@ def create_split_tone_node(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
     return node
 
 
+@profile_function
 def create_vignette_node(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
-    vignette_node_group = add_vignette_node_group()
+    vignette_node_group = get_or_add_node_group(add_vignette_node_group)
 
     node = node_tree.nodes.new(type='CompositorNodeGroup')
     node.name = "Vignette"
@@ -171,6 +178,7 @@ def create_vignette_node(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
     return node
 
 
+@profile_function
 def build_scene_composition(scene: bpy.types.Scene,
                             vignette: float = 0.20,
                             dispersion: float = 0.050,
@@ -207,4 +215,4 @@ def build_scene_composition(scene: bpy.types.Scene,
     scene.node_tree.links.new(split_tone_node.outputs['Image'], glare_node.inputs['Image'])
     scene.node_tree.links.new(glare_node.outputs['Image'], composite_node.inputs['Image'])
 
-    arrange_nodes(scene.node_tree)
+    request_arrange_nodes(scene.node_tree)
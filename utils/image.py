@@ -1,13 +1,213 @@
 import bpy
+import hashlib
+import os
 import numpy as np
+from typing import Dict, Optional, Sequence, Tuple
+from utils.profiling import profile_function
 
 
-def get_image_pixels_in_numpy(image: bpy.types.Image) -> np.array:
-    return np.array(image.pixels[:]).reshape(image.size[0] * image.size[1], image.channels)
+def get_image_pixels_in_numpy(image: bpy.types.Image, out: Optional[np.ndarray] = None) -> np.ndarray:
+    '''
+    Return the pixels as a float32 array of the shape (height, width, channels); the first row is the bottom row.
 
+    The pixels are copied directly into the array by foreach_get without creating a Python list. A preallocated array
+    can be given as "out" to reuse the same buffer across frames.
+    '''
 
-def set_image_pixels_in_numpy(image: bpy.types.Image, pixels: np.array) -> None:
+    width, height = image.size
+    shape = (height, width, image.channels)
+
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    else:
+        assert out.shape == shape and out.dtype == np.float32 and out.flags['C_CONTIGUOUS']
+
+    image.pixels.foreach_get(out.reshape(-1))
+
+    return out
+
+
+def set_image_pixels_in_numpy(image: bpy.types.Image, pixels: np.ndarray) -> None:
     # The sizes should be the same; otherwise, Blender may crush.
     assert len(image.pixels) == pixels.size
 
-    image.pixels = pixels.flatten()
+    image.pixels.foreach_set(np.ascontiguousarray(pixels, dtype=np.float32).reshape(-1))
+    image.update()
+
+
+################################################################################
+# Image cache
+################################################################################
+
+# (absolute path, is_data, modification time) -> image datablock
+image_cache: Dict[Tuple[str, bool, float], bpy.types.Image] = {}
+image_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def is_image_alive(image: bpy.types.Image) -> bool:
+    try:
+        image.name
+    except ReferenceError:
+        return False
+    return True
+
+
+@profile_function
+def load_cached_image(path: str, is_data: bool = False) -> bpy.types.Image:
+    '''
+    Return an image datablock for the file, reusing the one loaded by a previous call whenever possible.
+
+    The cache key is (absolute path, is_data, modification time): the same file used both as color and non-color data
+    gets two datablocks because the colorspace is a datablock setting, and a file edited on disk is loaded again.
+    Images already in bpy.data.images with the same file path and colorspace are reused as well, except for the ones
+    cached for an older modification time.
+    '''
+
+    abs_path = os.path.normpath(os.path.abspath(bpy.path.abspath(path)))
+    key = (abs_path, is_data, os.path.getmtime(abs_path))
+
+    image = image_cache.get(key)
+    if image is not None and is_image_alive(image):
+        image_cache_stats["hits"] += 1
+        return image
+
+    # Datablocks cached for an older version of the file hold its old pixels
+    stale_images = [
+        cached_image for (cached_path, cached_is_data, _), cached_image in image_cache.items()
+        if cached_path == abs_path and cached_is_data == is_data and is_image_alive(cached_image)
+    ]
+
+    # Look for an existing datablock (like "check_existing=True" but aware of the colorspace)
+    for existing_image in bpy.data.images:
+        if existing_image.source != 'FILE' or existing_image.colorspace_settings.is_data != is_data:
+            continue
+        if any(existing_image == stale_image for stale_image in stale_images):
+            continue
+        if os.path.normpath(os.path.abspath(bpy.path.abspath(existing_image.filepath))) == abs_path:
+            image_cache[key] = existing_image
+            image_cache_stats["hits"] += 1
+            return existing_image
+
+    image = bpy.data.images.load(abs_path, check_existing=False)
+    image.colorspace_settings.is_data = is_data
+
+    image_cache[key] = image
+    image_cache_stats["misses"] += 1
+
+    return image
+
+
+def get_image_cache_stats() -> Dict[str, int]:
+    return dict(image_cache_stats, size=len(image_cache))
+
+
+def evict_unused_cached_images() -> int:
+    '''
+    Remove the cached image datablocks that are no longer used by anything. Returns the number of evicted images.
+    '''
+
+    num_evicted_images = 0
+
+    for key, image in list(image_cache.items()):
+        if not is_image_alive(image):
+            del image_cache[key]
+        elif image.users == 0:
+            bpy.data.images.remove(image)
+            del image_cache[key]
+            num_evicted_images += 1
+
+    image_cache_stats["evictions"] += num_evicted_images
+
+    return num_evicted_images
+
+
+def clear_image_cache() -> None:
+    '''
+    Forget all the cached images (the datablocks themselves are not removed) and reset the statistics.
+    '''
+
+    image_cache.clear()
+    for name in image_cache_stats:
+        image_cache_stats[name] = 0
+
+
+################################################################################
+# Channel packing
+################################################################################
+
+
+def get_packed_texture_path(channel_paths: Sequence[str], packed_texture_dir_path: Optional[str] = None) -> str:
+    '''
+    Return the path where the channel-packed image of the single-channel images is cached. By default, it is stored in
+    "packed/" next to the first image.
+    '''
+
+    used_paths = [path for path in channel_paths if path != ""]
+    assert len(used_paths) != 0
+
+    if packed_texture_dir_path is None:
+        packed_texture_dir_path = os.path.join(os.path.dirname(os.path.abspath(used_paths[0])), "packed")
+
+    key = repr([os.path.abspath(path) if path != "" else "" for path in channel_paths])
+    return os.path.join(packed_texture_dir_path, hashlib.sha1(key.encode()).hexdigest()[:16] + ".png")
+
+
+@profile_function
+def pack_texture_channels(channel_paths: Sequence[str], packed_texture_path: str) -> None:
+    '''
+    Combine up to four single-channel images (e.g., roughness, metallic, ambient occlusion and displacement maps) into
+    the RGBA channels of one 8-bit PNG image. An empty path leaves the channel black. The images are resized to the
+    size of the first one if necessary.
+    '''
+
+    assert len(channel_paths) <= 4
+
+    packed_pixels: Optional[np.ndarray] = None
+
+    for channel_index, path in enumerate(channel_paths):
+        if path == "":
+            continue
+
+        image = bpy.data.images.load(path, check_existing=False)
+        image.colorspace_settings.is_data = True
+
+        if packed_pixels is None:
+            width, height = image.size
+            packed_pixels = np.zeros((height, width, 4), dtype=np.float32)
+        elif tuple(image.size) != (packed_pixels.shape[1], packed_pixels.shape[0]):
+            image.scale(packed_pixels.shape[1], packed_pixels.shape[0])
+
+        # Grayscale maps are usually stored as RGB, so the first channel holds the whole information
+        packed_pixels[:, :, channel_index] = get_image_pixels_in_numpy(image)[:, :, 0]
+
+        bpy.data.images.remove(image)
+
+    assert packed_pixels is not None
+
+    packed_image = bpy.data.images.new("Packed Texture", packed_pixels.shape[1], packed_pixels.shape[0], alpha=True)
+    packed_image.colorspace_settings.is_data = True
+    packed_image.alpha_mode = 'CHANNEL_PACKED'
+    set_image_pixels_in_numpy(packed_image, packed_pixels)
+
+    os.makedirs(os.path.dirname(os.path.abspath(packed_texture_path)), exist_ok=True)
+    packed_image.filepath_raw = packed_texture_path
+    packed_image.file_format = 'PNG'
+    packed_image.save()
+
+    bpy.data.images.remove(packed_image)
+
+
+def get_or_pack_texture_channels(channel_paths: Sequence[str], packed_texture_dir_path: Optional[str] = None) -> str:
+    '''
+    Return the path of the channel-packed image of the single-channel images, packing them only if the cached image is
+    missing or older than any of them.
+    '''
+
+    packed_texture_path = get_packed_texture_path(channel_paths, packed_texture_dir_path)
+
+    is_up_to_date = os.path.isfile(packed_texture_path) and all(
+        os.path.getmtime(packed_texture_path) >= os.path.getmtime(path) for path in channel_paths if path != "")
+    if not is_up_to_date:
+        pack_texture_channels(channel_paths, packed_texture_path)
+
+    return packed_texture_path
@@ -1,36 +1,37 @@
 import bpy
 from typing import Optional, Tuple
+from utils.profiling import profile_function
+from utils.utils import create_object
 
 
+@profile_function
 def create_area_light(location: Tuple[float, float, float] = (0.0, 0.0, 5.0),
                       rotation: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                       size: float = 5.0,
                       color: Tuple[float, float, float, float] = (1.00, 0.90, 0.80, 1.00),
                       strength: float = 1000.0,
-                      name: Optional[str] = None) -> bpy.types.Object:
-    if bpy.app.version >= (2, 80, 0):
-        bpy.ops.object.light_add(type='AREA', location=location, rotation=rotation)
-    else:
-        bpy.ops.object.lamp_add(type='AREA', location=location, rotation=rotation)
+                      name: Optional[str] = None,
+                      collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    name = "Area" if name is None else name
 
-    if name is not None:
-        bpy.context.object.name = name
-
-    light = bpy.context.object.data
+    light: bpy.types.AreaLight = bpy.data.lights.new(name, type='AREA')
     light.size = size
     light.use_nodes = True
     light.node_tree.nodes["Emission"].inputs["Color"].default_value = color
     light.energy = strength
 
-    return bpy.context.object
+    return create_object(light, name, location, rotation, collection)
 
 
+@profile_function
 def create_sun_light(location: Tuple[float, float, float] = (0.0, 0.0, 5.0),
                      rotation: Tuple[float, float, float] = (0.0, 0.0, 0.0),
-                     name: Optional[str] = None) -> bpy.types.Object:
-    bpy.ops.object.light_add(type='SUN', location=location, rotation=rotation)
+                     name: Optional[str] = None,
+                     collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    name = "Sun" if name is None else name
 
-    if name is not None:
-        bpy.context.object.name = name
+    # light_add gives suns a strength of 1.0 instead of the default 10.0 of the data API
+    light: bpy.types.SunLight = bpy.data.lights.new(name, type='SUN')
+    light.energy = 1.0
 
-    return bpy.context.object
+    return create_object(light, name, location, rotation, collection)
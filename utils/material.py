@@ -1,17 +1,18 @@
 import bpy
-from typing import Tuple
-from utils.node import set_socket_value_range, arrange_nodes, create_frame_node, clean_nodes
+from typing import Any, Dict, Optional, Tuple
+from utils.image import load_cached_image, get_or_pack_texture_channels
+from utils.node import set_socket_value_range, request_arrange_nodes, create_frame_node, clean_nodes
+from utils.node import get_or_add_node_group
+from utils.profiling import profile_function, increment_counter
 
 
+@profile_function
 def create_texture_node(node_tree: bpy.types.NodeTree, path: str, is_color_data: bool) -> bpy.types.Node:
     # Instantiate a new texture image node
     texture_node = node_tree.nodes.new(type='ShaderNodeTexImage')
 
-    # Open an image and set it to the node
-    texture_node.image = bpy.data.images.load(path)
-
-    # Set other parameters
-    texture_node.image.colorspace_settings.is_data = False if is_color_data else True
+    # Open an image (or reuse the one already loaded) and set it to the node
+    texture_node.image = load_cached_image(path, is_data=not is_color_data)
 
     # Return the node
     return texture_node
@@ -54,6 +55,7 @@ def set_principled_node(principled_node: bpy.types.Node,
     principled_node.inputs['Transmission Roughness'].default_value = transmission_roughness
 
 
+@profile_function
 def build_pbr_nodes(node_tree: bpy.types.NodeTree,
                     base_color: Tuple[float, float, float, float] = (0.6, 0.6, 0.6, 1.0),
                     metallic: float = 0.0,
@@ -71,9 +73,10 @@ def build_pbr_nodes(node_tree: bpy.types.NodeTree,
                         roughness=roughness,
                         sheen=sheen)
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
 
 
+@profile_function
 def build_checker_board_nodes(node_tree: bpy.types.NodeTree, size: float) -> None:
     output_node = node_tree.nodes.new(type='ShaderNodeOutputMaterial')
     principled_node = node_tree.nodes.new(type='ShaderNodeBsdfPrincipled')
@@ -85,9 +88,10 @@ def build_checker_board_nodes(node_tree: bpy.types.NodeTree, size: float) -> Non
     node_tree.links.new(checker_texture_node.outputs['Color'], principled_node.inputs['Base Color'])
     node_tree.links.new(principled_node.outputs['BSDF'], output_node.inputs['Surface'])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
 
 
+@profile_function
 def build_matcap_nodes(node_tree: bpy.types.NodeTree, image_path: str) -> None:
     tex_coord_node = node_tree.nodes.new(type='ShaderNodeTexCoord')
     vector_transform_node = node_tree.nodes.new(type='ShaderNodeVectorTransform')
@@ -118,9 +122,10 @@ def build_matcap_nodes(node_tree: bpy.types.NodeTree, image_path: str) -> None:
     node_tree.links.new(texture_image_node.outputs['Color'], emmission_node.inputs['Color'])
     node_tree.links.new(emmission_node.outputs['Emission'], output_node.inputs['Surface'])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
 
 
+@profile_function
 def build_pbr_textured_nodes(node_tree: bpy.types.NodeTree,
                              color_texture_path: str = "",
                              metallic_texture_path: str = "",
@@ -132,10 +137,12 @@ def build_pbr_textured_nodes(node_tree: bpy.types.NodeTree,
                              displacement_scale: float = 1.0) -> None:
     output_node = node_tree.nodes.new(type='ShaderNodeOutputMaterial')
     principled_node = node_tree.nodes.new(type='ShaderNodeBsdfPrincipled')
+    principled_node.name = "Principled BSDF"
     node_tree.links.new(principled_node.outputs['BSDF'], output_node.inputs['Surface'])
 
     coord_node = node_tree.nodes.new(type='ShaderNodeTexCoord')
     mapping_node = node_tree.nodes.new(type='ShaderNodeMapping')
+    mapping_node.name = "Mapping"
     mapping_node.vector_type = 'TEXTURE'
     if bpy.app.version >= (2, 81, 0):
         mapping_node.inputs["Scale"].default_value = scale
@@ -145,9 +152,11 @@ def build_pbr_textured_nodes(node_tree: bpy.types.NodeTree,
 
     if color_texture_path != "":
         texture_node = create_texture_node(node_tree, color_texture_path, True)
+        texture_node.name = "Color Texture"
         node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
         if ambient_occlusion_texture_path != "":
             ao_texture_node = create_texture_node(node_tree, ambient_occlusion_texture_path, False)
+            ao_texture_node.name = "Ambient Occlusion Texture"
             node_tree.links.new(mapping_node.outputs['Vector'], ao_texture_node.inputs['Vector'])
             mix_node = node_tree.nodes.new(type='ShaderNodeMixRGB')
             mix_node.blend_type = 'MULTIPLY'
@@ -159,16 +168,19 @@ def build_pbr_textured_nodes(node_tree: bpy.types.NodeTree,
 
     if metallic_texture_path != "":
         texture_node = create_texture_node(node_tree, metallic_texture_path, False)
+        texture_node.name = "Metallic Texture"
         node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
         node_tree.links.new(texture_node.outputs['Color'], principled_node.inputs['Metallic'])
 
     if roughness_texture_path != "":
         texture_node = create_texture_node(node_tree, roughness_texture_path, False)
+        texture_node.name = "Roughness Texture"
         node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
         node_tree.links.new(texture_node.outputs['Color'], principled_node.inputs['Roughness'])
 
     if normal_texture_path != "":
         texture_node = create_texture_node(node_tree, normal_texture_path, False)
+        texture_node.name = "Normal Texture"
         node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
         normal_map_node = node_tree.nodes.new(type='ShaderNodeNormalMap')
         node_tree.links.new(texture_node.outputs['Color'], normal_map_node.inputs['Color'])
@@ -176,13 +188,105 @@ def build_pbr_textured_nodes(node_tree: bpy.types.NodeTree,
 
     if displacement_texture_path != "":
         texture_node = create_texture_node(node_tree, displacement_texture_path, False)
+        texture_node.name = "Displacement Texture"
         node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
         displacement_node = node_tree.nodes.new(type='ShaderNodeDisplacement')
+        displacement_node.name = "Displacement"
         displacement_node.inputs['Scale'].default_value = displacement_scale
         node_tree.links.new(texture_node.outputs['Color'], displacement_node.inputs['Height'])
         node_tree.links.new(displacement_node.outputs['Displacement'], output_node.inputs['Displacement'])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
+
+
+@profile_function
+def build_pbr_packed_textured_nodes(node_tree: bpy.types.NodeTree,
+                                    color_texture_path: str = "",
+                                    metallic_texture_path: str = "",
+                                    roughness_texture_path: str = "",
+                                    normal_texture_path: str = "",
+                                    displacement_texture_path: str = "",
+                                    ambient_occlusion_texture_path: str = "",
+                                    scale: Tuple[float, float, float] = (1.0, 1.0, 1.0),
+                                    displacement_scale: float = 1.0,
+                                    packed_texture_dir_path: Optional[str] = None) -> None:
+    '''
+    A variant of build_pbr_textured_nodes that samples the roughness, metallic, ambient occlusion and displacement
+    maps from one channel-packed RGBA image (R, G, B and A, respectively; see get_or_pack_texture_channels) through a
+    Separate RGB node instead of one image per map.
+    '''
+
+    channel_paths = (roughness_texture_path, metallic_texture_path, ambient_occlusion_texture_path,
+                     displacement_texture_path)
+    if all(path == "" for path in channel_paths):
+        build_pbr_textured_nodes(node_tree,
+                                 color_texture_path=color_texture_path,
+                                 normal_texture_path=normal_texture_path,
+                                 scale=scale,
+                                 displacement_scale=displacement_scale)
+        return
+
+    output_node = node_tree.nodes.new(type='ShaderNodeOutputMaterial')
+    principled_node = node_tree.nodes.new(type='ShaderNodeBsdfPrincipled')
+    principled_node.name = "Principled BSDF"
+    node_tree.links.new(principled_node.outputs['BSDF'], output_node.inputs['Surface'])
+
+    coord_node = node_tree.nodes.new(type='ShaderNodeTexCoord')
+    mapping_node = node_tree.nodes.new(type='ShaderNodeMapping')
+    mapping_node.name = "Mapping"
+    mapping_node.vector_type = 'TEXTURE'
+    if bpy.app.version >= (2, 81, 0):
+        mapping_node.inputs["Scale"].default_value = scale
+    else:
+        mapping_node.scale = scale
+    node_tree.links.new(coord_node.outputs['UV'], mapping_node.inputs['Vector'])
+
+    packed_texture_path = get_or_pack_texture_channels(channel_paths, packed_texture_dir_path)
+    packed_texture_node = create_texture_node(node_tree, packed_texture_path, False)
+    packed_texture_node.name = "Packed Texture"
+
+    # Otherwise, the RGB channels would be premultiplied by the displacement in the alpha channel
+    packed_texture_node.image.alpha_mode = 'CHANNEL_PACKED'
+
+    node_tree.links.new(mapping_node.outputs['Vector'], packed_texture_node.inputs['Vector'])
+    separate_node = node_tree.nodes.new(type='ShaderNodeSeparateRGB')
+    node_tree.links.new(packed_texture_node.outputs['Color'], separate_node.inputs['Image'])
+
+    if color_texture_path != "":
+        texture_node = create_texture_node(node_tree, color_texture_path, True)
+        texture_node.name = "Color Texture"
+        node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
+        if ambient_occlusion_texture_path != "":
+            mix_node = node_tree.nodes.new(type='ShaderNodeMixRGB')
+            mix_node.blend_type = 'MULTIPLY'
+            node_tree.links.new(texture_node.outputs['Color'], mix_node.inputs['Color1'])
+            node_tree.links.new(separate_node.outputs['B'], mix_node.inputs['Color2'])
+            node_tree.links.new(mix_node.outputs['Color'], principled_node.inputs['Base Color'])
+        else:
+            node_tree.links.new(texture_node.outputs['Color'], principled_node.inputs['Base Color'])
+
+    if metallic_texture_path != "":
+        node_tree.links.new(separate_node.outputs['G'], principled_node.inputs['Metallic'])
+
+    if roughness_texture_path != "":
+        node_tree.links.new(separate_node.outputs['R'], principled_node.inputs['Roughness'])
+
+    if normal_texture_path != "":
+        texture_node = create_texture_node(node_tree, normal_texture_path, False)
+        texture_node.name = "Normal Texture"
+        node_tree.links.new(mapping_node.outputs['Vector'], texture_node.inputs['Vector'])
+        normal_map_node = node_tree.nodes.new(type='ShaderNodeNormalMap')
+        node_tree.links.new(texture_node.outputs['Color'], normal_map_node.inputs['Color'])
+        node_tree.links.new(normal_map_node.outputs['Normal'], principled_node.inputs['Normal'])
+
+    if displacement_texture_path != "":
+        displacement_node = node_tree.nodes.new(type='ShaderNodeDisplacement')
+        displacement_node.name = "Displacement"
+        displacement_node.inputs['Scale'].default_value = displacement_scale
+        node_tree.links.new(packed_texture_node.outputs['Alpha'], displacement_node.inputs['Height'])
+        node_tree.links.new(displacement_node.outputs['Displacement'], output_node.inputs['Displacement'])
+
+    request_arrange_nodes(node_tree)
 
 
 def add_parametric_color_ramp() -> bpy.types.NodeGroup:
@@ -241,18 +345,14 @@ def add_parametric_color_ramp() -> bpy.types.NodeGroup:
 
     # Return
 
-    arrange_nodes(group)
+    request_arrange_nodes(group)
 
     return group
 
 
+@profile_function
 def create_parametric_color_ramp_node(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
-    color_ramp_node_group: bpy.types.NodeGroup
-
-    if "Parametric Color Ramp" in bpy.data.node_groups:
-        color_ramp_node_group = bpy.data.node_groups["Parametric Color Ramp"]
-    else:
-        color_ramp_node_group = add_parametric_color_ramp()
+    color_ramp_node_group = get_or_add_node_group(add_parametric_color_ramp)
 
     node = node_tree.nodes.new(type='ShaderNodeGroup')
     node.name = "Parametric Color Ramp"
@@ -330,18 +430,14 @@ def add_tri_parametric_color_ramp() -> bpy.types.NodeGroup:
 
     # Return
 
-    arrange_nodes(group)
+    request_arrange_nodes(group)
 
     return group
 
 
+@profile_function
 def create_tri_parametric_color_ramp_node(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
-    tri_color_ramp_node_group: bpy.types.NodeGroup
-
-    if "Tri Parametric Color Ramp" in bpy.data.node_groups:
-        tri_color_ramp_node_group = bpy.data.node_groups["Tri Parametric Color Ramp"]
-    else:
-        tri_color_ramp_node_group = add_tri_parametric_color_ramp()
+    tri_color_ramp_node_group = get_or_add_node_group(add_tri_parametric_color_ramp)
 
     node = node_tree.nodes.new(type='ShaderNodeGroup')
     node.name = "Tri Parametric Color Ramp"
@@ -507,18 +603,14 @@ def add_peeling_paint_metal_node_group() -> bpy.types.NodeGroup:
     group.links.new(roughness_node.outputs["Color"], output_node.inputs["Roughness"])
     group.links.new(bump_node.outputs["Normal"], output_node.inputs["Bump"])
 
-    arrange_nodes(group)
+    request_arrange_nodes(group)
 
     return group
 
 
+@profile_function
 def create_peeling_paint_metal_node_group(node_tree: bpy.types.NodeTree) -> bpy.types.Node:
-    peeling_paint_metal_node_group: bpy.types.NodeGroup
-
-    if "Peeling Paint Metal" in bpy.data.node_groups:
-        peeling_paint_metal_node_group = bpy.data.node_groups["Peeling Paint Metal"]
-    else:
-        peeling_paint_metal_node_group = add_peeling_paint_metal_node_group()
+    peeling_paint_metal_node_group = get_or_add_node_group(add_peeling_paint_metal_node_group)
 
     node = node_tree.nodes.new(type='ShaderNodeGroup')
     node.name = "Peeling Paint Metal"
@@ -527,6 +619,7 @@ def create_peeling_paint_metal_node_group(node_tree: bpy.types.NodeTree) -> bpy.
     return node
 
 
+@profile_function
 def build_peeling_paint_metal_nodes(node_tree: bpy.types.NodeTree) -> None:
     output_node = node_tree.nodes.new(type='ShaderNodeOutputMaterial')
     principled_node = node_tree.nodes.new(type='ShaderNodeBsdfPrincipled')
@@ -538,9 +631,10 @@ def build_peeling_paint_metal_nodes(node_tree: bpy.types.NodeTree) -> None:
     node_tree.links.new(peeling_paint_metal_node.outputs['Bump'], principled_node.inputs['Normal'])
     node_tree.links.new(principled_node.outputs['BSDF'], output_node.inputs['Surface'])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
 
 
+@profile_function
 def build_emission_nodes(node_tree: bpy.types.NodeTree,
                          color: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                          strength: float = 1.0) -> None:
@@ -555,7 +649,7 @@ def build_emission_nodes(node_tree: bpy.types.NodeTree,
 
     node_tree.links.new(emission_node.outputs['Emission'], output_node.inputs['Surface'])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
 
 
 def add_material(name: str = "Material",
@@ -575,3 +669,144 @@ def add_material(name: str = "Material",
         clean_nodes(material.node_tree.nodes)
 
     return material
+
+
+################################################################################
+# Material factory
+################################################################################
+
+pbr_texture_kinds = (
+    # (argument name, node name, is color data)
+    ("color_texture_path", "Color Texture", True),
+    ("metallic_texture_path", "Metallic Texture", False),
+    ("roughness_texture_path", "Roughness Texture", False),
+    ("normal_texture_path", "Normal Texture", False),
+    ("displacement_texture_path", "Displacement Texture", False),
+    ("ambient_occlusion_texture_path", "Ambient Occlusion Texture", False),
+)
+
+# Fingerprint of the requested parameters -> material
+pbr_textured_materials: Dict[str, bpy.types.Material] = {}
+
+# Node tree structure (which textures are used) -> (material to be cloned, its parameters)
+pbr_textured_material_templates: Dict[Tuple[bool, ...], Tuple[bpy.types.Material, Dict[str, Any]]] = {}
+
+pbr_textured_material_stats: Dict[str, int] = {"builds": 0, "clones": 0, "reuses": 0}
+
+
+def is_material_alive(material: bpy.types.Material) -> bool:
+    try:
+        material.name
+    except ReferenceError:
+        return False
+    return True
+
+
+def patch_pbr_textured_material(material: bpy.types.Material, parameters: Dict[str, Any],
+                                template_parameters: Dict[str, Any]) -> None:
+    nodes = material.node_tree.nodes
+
+    for argument_name, node_name, is_color_data in pbr_texture_kinds:
+        # The ambient occlusion texture is not used without the color texture
+        if parameters[argument_name] != template_parameters[argument_name] and node_name in nodes:
+            nodes[node_name].image = load_cached_image(parameters[argument_name], is_data=not is_color_data)
+
+    if parameters["scale"] != template_parameters["scale"]:
+        if bpy.app.version >= (2, 81, 0):
+            nodes["Mapping"].inputs["Scale"].default_value = parameters["scale"]
+        else:
+            nodes["Mapping"].scale = parameters["scale"]
+
+    is_displacement_used = parameters["displacement_texture_path"] != ""
+    if is_displacement_used and parameters["displacement_scale"] != template_parameters["displacement_scale"]:
+        nodes["Displacement"].inputs['Scale'].default_value = parameters["displacement_scale"]
+
+    if parameters["principled_values"] != template_parameters["principled_values"]:
+        set_principled_node(nodes["Principled BSDF"], **parameters["principled_values"])
+
+
+@profile_function
+def get_or_add_pbr_textured_material(name: str,
+                                     color_texture_path: str = "",
+                                     metallic_texture_path: str = "",
+                                     roughness_texture_path: str = "",
+                                     normal_texture_path: str = "",
+                                     displacement_texture_path: str = "",
+                                     ambient_occlusion_texture_path: str = "",
+                                     scale: Tuple[float, float, float] = (1.0, 1.0, 1.0),
+                                     displacement_scale: float = 1.0,
+                                     principled_values: Optional[Dict[str, Any]] = None) -> bpy.types.Material:
+    '''
+    Return a material with the node tree of build_pbr_textured_nodes() whose principled BSDF node is set by
+    set_principled_node(**principled_values).
+
+    A material previously returned for the same parameters is returned again (its name may differ from the requested
+    one), so returned materials are shared and should not be edited. Otherwise, a material with the same textures in
+    use is cloned with Material.copy() and only the differing images and socket values are patched; nodes are built
+    from scratch only for a new combination of textures.
+    '''
+
+    parameters: Dict[str, Any] = {
+        "color_texture_path": color_texture_path,
+        "metallic_texture_path": metallic_texture_path,
+        "roughness_texture_path": roughness_texture_path,
+        "normal_texture_path": normal_texture_path,
+        "displacement_texture_path": displacement_texture_path,
+        "ambient_occlusion_texture_path": ambient_occlusion_texture_path,
+        "scale": tuple(scale),
+        "displacement_scale": displacement_scale,
+        "principled_values": dict(principled_values) if principled_values is not None else {},
+    }
+    fingerprint = repr([(key, sorted(value.items()) if isinstance(value, dict) else value)
+                        for key, value in sorted(parameters.items())])
+
+    material = pbr_textured_materials.get(fingerprint)
+    if material is not None and is_material_alive(material):
+        pbr_textured_material_stats["reuses"] += 1
+        increment_counter("pbr_textured_material_reuses")
+        return material
+
+    structure = tuple(parameters[argument_name] != "" for argument_name, _, _ in pbr_texture_kinds)
+
+    template = pbr_textured_material_templates.get(structure)
+    if template is not None and is_material_alive(template[0]):
+        template_material, template_parameters = template
+
+        material = template_material.copy()
+        material.name = name
+        patch_pbr_textured_material(material, parameters, template_parameters)
+
+        pbr_textured_material_stats["clones"] += 1
+        increment_counter("pbr_textured_material_clones")
+    else:
+        material = add_material(name, use_nodes=True, make_node_tree_empty=True)
+        build_pbr_textured_nodes(material.node_tree,
+                                 color_texture_path=color_texture_path,
+                                 metallic_texture_path=metallic_texture_path,
+                                 roughness_texture_path=roughness_texture_path,
+                                 normal_texture_path=normal_texture_path,
+                                 displacement_texture_path=displacement_texture_path,
+                                 ambient_occlusion_texture_path=ambient_occlusion_texture_path,
+                                 scale=scale,
+                                 displacement_scale=displacement_scale)
+        set_principled_node(material.node_tree.nodes["Principled BSDF"], **parameters["principled_values"])
+
+        pbr_textured_material_templates[structure] = (material, parameters)
+
+        pbr_textured_material_stats["builds"] += 1
+        increment_counter("pbr_textured_material_builds")
+
+    pbr_textured_materials[fingerprint] = material
+
+    return material
+
+
+def get_pbr_textured_material_stats() -> Dict[str, int]:
+    return dict(pbr_textured_material_stats, size=len(pbr_textured_materials))
+
+
+def clear_pbr_textured_material_registry() -> None:
+    pbr_textured_materials.clear()
+    pbr_textured_material_templates.clear()
+    for name in pbr_textured_material_stats:
+        pbr_textured_material_stats[name] = 0
@@ -1,14 +1,20 @@
 import bpy
+import bmesh
 import math
-from typing import Tuple, Iterable, Optional, Sequence
+import mathutils
+import numpy as np
+from typing import Tuple, Iterable, List, Optional, Sequence
 from utils.modifier import add_subdivision_surface_modifier
+from utils.node import request_arrange_nodes
+from utils.profiling import profile_function, increment_counter
+from utils.utils import create_object, create_objects, get_transform_components
 
 
 def set_smooth_shading(mesh: bpy.types.Mesh) -> None:
-    for polygon in mesh.polygons:
-        polygon.use_smooth = True
+    mesh.polygons.foreach_set("use_smooth", np.ones(len(mesh.polygons), dtype=bool))
 
 
+@profile_function
 def create_mesh_from_pydata(scene: bpy.types.Scene,
                             vertices: Iterable[Iterable[float]],
                             faces: Iterable[Iterable[int]],
@@ -30,6 +36,142 @@ def create_mesh_from_pydata(scene: bpy.types.Scene,
     return new_object
 
 
+def get_loop_arrays_from_faces(faces: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Convert an (F, K) array of vertex indices (e.g., K = 3 for triangles) into the flat loop arrays used by
+    create_mesh_from_numpy: (loop vertex indices, loop starts, loop totals).
+    '''
+
+    num_faces, face_size = faces.shape
+    loop_starts = np.arange(0, num_faces * face_size, face_size, dtype=np.int32)
+    loop_totals = np.full(num_faces, face_size, dtype=np.int32)
+
+    return faces.astype(np.int32).ravel(), loop_starts, loop_totals
+
+
+def add_mesh_from_numpy(mesh_name: str,
+                        vertices: np.ndarray,
+                        loop_vertex_indices: np.ndarray,
+                        loop_starts: np.ndarray,
+                        loop_totals: np.ndarray,
+                        use_smooth: bool = True,
+                        loop_uvs: Optional[np.ndarray] = None) -> bpy.types.Mesh:
+    '''
+    Add a mesh filled in bulk instead of going through Python lists (see create_mesh_from_numpy for the arguments).
+
+    loop_uvs: (M, 2) texture coordinates of all the face corners, stored in the "UVMap" layer if given
+    '''
+
+    num_vertices = vertices.shape[0]
+    num_loops = loop_vertex_indices.shape[0]
+    num_polygons = loop_starts.shape[0]
+
+    new_mesh: bpy.types.Mesh = bpy.data.meshes.new(mesh_name)
+    new_mesh.vertices.add(num_vertices)
+    new_mesh.vertices.foreach_set("co", np.ascontiguousarray(vertices, dtype=np.float32).ravel())
+    new_mesh.loops.add(num_loops)
+    new_mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loop_vertex_indices, dtype=np.int32))
+    new_mesh.polygons.add(num_polygons)
+    new_mesh.polygons.foreach_set("loop_start", np.ascontiguousarray(loop_starts, dtype=np.int32))
+    new_mesh.polygons.foreach_set("loop_total", np.ascontiguousarray(loop_totals, dtype=np.int32))
+    new_mesh.polygons.foreach_set("use_smooth", np.full(num_polygons, use_smooth, dtype=bool))
+
+    if loop_uvs is not None:
+        uv_layer = new_mesh.uv_layers.new(name="UVMap")
+        uv_layer.data.foreach_set("uv", np.ascontiguousarray(loop_uvs, dtype=np.float32).ravel())
+
+    # Edges are not given, so let Blender compute them
+    new_mesh.update(calc_edges=True)
+
+    return new_mesh
+
+
+@profile_function
+def create_mesh_from_numpy(scene: bpy.types.Scene,
+                           vertices: np.ndarray,
+                           loop_vertex_indices: np.ndarray,
+                           loop_starts: np.ndarray,
+                           loop_totals: np.ndarray,
+                           mesh_name: str,
+                           object_name: str,
+                           use_smooth: bool = True) -> bpy.types.Object:
+    '''
+    A NumPy-native variant of create_mesh_from_pydata for large meshes.
+
+    vertices: (N, 3) vertex positions
+    loop_vertex_indices: (M,) vertex indices of all the face corners, face by face
+    loop_starts, loop_totals: (F,) the first corner and the number of corners of each face
+    '''
+
+    new_mesh = add_mesh_from_numpy(mesh_name, vertices, loop_vertex_indices, loop_starts, loop_totals, use_smooth)
+
+    new_object: bpy.types.Object = bpy.data.objects.new(object_name, new_mesh)
+    scene.collection.objects.link(new_object)
+
+    return new_object
+
+
+def get_colors_from_ramp(values: np.ndarray, ramp_colors: Sequence[Sequence[float]]) -> np.ndarray:
+    '''
+    Map scalar values in [0, 1] to colors by linearly interpolating the evenly spaced ramp colors (in bulk).
+    '''
+
+    ramp = np.asarray(ramp_colors, dtype=np.float32)
+
+    a = np.clip(np.asarray(values, dtype=np.float32), 0.0, 1.0) * (len(ramp) - 1)
+    lower_indices = np.minimum(np.floor(a).astype(np.int64), len(ramp) - 1)
+    upper_indices = np.minimum(lower_indices + 1, len(ramp) - 1)
+    t = (a - lower_indices)[:, np.newaxis]
+
+    return (1.0 - t) * ramp[lower_indices] + t * ramp[upper_indices]
+
+
+def set_vertex_colors_in_numpy(mesh: bpy.types.Mesh,
+                               colors: np.ndarray,
+                               domain: str = 'FACE',
+                               name: str = "Col") -> None:
+    '''
+    Write per-face (domain='FACE') or per-vertex (domain='VERTEX') colors to the vertex color layer (created if it does
+    not exist) with a single foreach_set. The colors can be either RGB or RGBA.
+
+    https://docs.blender.org/api/current/bpy.types.MeshLoopColorLayer.html
+    '''
+
+    if name not in mesh.vertex_colors:
+        mesh.vertex_colors.new(name=name)
+
+    colors = np.asarray(colors, dtype=np.float32)
+    if colors.shape[1] == 3:
+        colors = np.concatenate((colors, np.ones((colors.shape[0], 1), dtype=np.float32)), axis=1)
+
+    num_loops = len(mesh.loops)
+
+    if domain == 'FACE':
+        assert colors.shape[0] == len(mesh.polygons)
+
+        loop_starts = np.empty(len(mesh.polygons), dtype=np.int32)
+        loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+
+        # Expand the face colors to the loop order (the corners of a face are contiguous from its loop start)
+        face_indices = np.repeat(np.arange(len(loop_starts)), loop_totals)
+        corner_offsets = np.arange(num_loops) - np.repeat(np.cumsum(loop_totals) - loop_totals, loop_totals)
+        loop_colors = np.empty((num_loops, 4), dtype=np.float32)
+        loop_colors[np.repeat(loop_starts, loop_totals) + corner_offsets] = colors[face_indices]
+    elif domain == 'VERTEX':
+        assert colors.shape[0] == len(mesh.vertices)
+
+        loop_vertex_indices = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertex_indices)
+        loop_colors = colors[loop_vertex_indices]
+    else:
+        raise ValueError("Unknown domain: " + domain)
+
+    mesh.vertex_colors[name].data.foreach_set("color", loop_colors.ravel())
+
+
+@profile_function
 def create_cached_mesh_from_alembic(file_path: str, name: str) -> bpy.types.Object:
     bpy.ops.wm.alembic_import(filepath=file_path, as_background_job=False)
     bpy.context.active_object.name = name
@@ -37,30 +179,155 @@ def create_cached_mesh_from_alembic(file_path: str, name: str) -> bpy.types.Obje
     return bpy.context.active_object
 
 
+def export_mesh_to_alembic(mesh_object: bpy.types.Object, file_path: str, frame_start: int, frame_end: int) -> None:
+    '''
+    Export the animated (e.g., simulated) mesh so that it can be loaded by create_cached_mesh_from_alembic().
+    '''
+
+    bpy.ops.object.select_all(action='DESELECT')
+    mesh_object.select_set(True)
+    bpy.context.view_layer.objects.active = mesh_object
+
+    bpy.ops.wm.alembic_export(filepath=file_path,
+                              start=frame_start,
+                              end=frame_end,
+                              selected=True,
+                              uvs=True,
+                              normals=True,
+                              as_background_job=False)
+
+
+################################################################################
+# Primitives
+################################################################################
+
+
+def add_plane_mesh(size: float = 2.0, name: str = "Plane") -> bpy.types.Mesh:
+    # The same geometry and UVs as bpy.ops.mesh.primitive_plane_add
+    half_size = 0.5 * size
+    vertices = np.array([
+        (-half_size, -half_size, 0.0),
+        (+half_size, -half_size, 0.0),
+        (-half_size, +half_size, 0.0),
+        (+half_size, +half_size, 0.0),
+    ])
+    loop_uvs = np.array([(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)])
+
+    return add_mesh_from_numpy(name,
+                               vertices,
+                               np.array([0, 1, 3, 2]),
+                               np.array([0]),
+                               np.array([4]),
+                               use_smooth=False,
+                               loop_uvs=loop_uvs)
+
+
+def add_uv_sphere_mesh(radius: float = 1.0,
+                       num_segments: int = 32,
+                       num_rings: int = 16,
+                       name: str = "Sphere") -> bpy.types.Mesh:
+    '''
+    Add a UV sphere with the same resolution as bpy.ops.mesh.primitive_uv_sphere_add: triangle fans around the poles
+    and quads in between, with UVs covering the unit square.
+    '''
+
+    # Rings of vertices from the top to the bottom (without the poles), followed by the top and bottom poles
+    thetas = np.pi * np.arange(1, num_rings) / num_rings
+    phis = 2.0 * np.pi * np.arange(num_segments) / num_segments
+    ring_vertices = np.stack((np.outer(np.sin(thetas), np.cos(phis)), np.outer(np.sin(thetas), np.sin(phis)),
+                              np.repeat(np.cos(thetas)[:, None], num_segments, axis=1)),
+                             axis=2).reshape(-1, 3)
+    vertices = radius * np.concatenate((ring_vertices, [(0.0, 0.0, 1.0), (0.0, 0.0, -1.0)]))
+    top_index = ring_vertices.shape[0]
+    bottom_index = top_index + 1
+
+    segments = np.arange(num_segments)
+    next_segments = (segments + 1) % num_segments
+
+    # Texture coordinates use an unwrapped segment index (num_segments instead of 0) at the seam
+    top_us = (segments + 0.5) / num_segments
+    us = segments / num_segments
+    next_us = (segments + 1) / num_segments
+
+    faces = []
+    face_uvs = []
+
+    def get_ring_v(ring: int) -> float:
+        return 1.0 - (ring + 1) / num_rings
+
+    # Triangle fan around the top pole
+    faces.append(np.stack((np.full(num_segments, top_index), segments, next_segments), axis=1))
+    face_uvs.append(np.stack((np.stack((top_us, np.ones(num_segments)), axis=1),
+                              np.stack((us, np.full(num_segments, get_ring_v(0))), axis=1),
+                              np.stack((next_us, np.full(num_segments, get_ring_v(0))), axis=1)),
+                             axis=1))
+
+    # Quads between consecutive rings
+    for ring in range(num_rings - 2):
+        upper = ring * num_segments
+        lower = upper + num_segments
+        quads = np.stack((upper + segments, lower + segments, lower + next_segments, upper + next_segments), axis=1)
+        quad_uvs = np.stack((np.stack((us, np.full(num_segments, get_ring_v(ring))), axis=1),
+                             np.stack((us, np.full(num_segments, get_ring_v(ring + 1))), axis=1),
+                             np.stack((next_us, np.full(num_segments, get_ring_v(ring + 1))), axis=1),
+                             np.stack((next_us, np.full(num_segments, get_ring_v(ring))), axis=1)),
+                            axis=1)
+        faces.append(quads)
+        face_uvs.append(quad_uvs)
+
+    # Triangle fan around the bottom pole
+    last = (num_rings - 2) * num_segments
+    faces.append(np.stack((np.full(num_segments, bottom_index), last + next_segments, last + segments), axis=1))
+    face_uvs.append(np.stack((np.stack((top_us, np.zeros(num_segments)), axis=1),
+                              np.stack((next_us, np.full(num_segments, get_ring_v(num_rings - 2))), axis=1),
+                              np.stack((us, np.full(num_segments, get_ring_v(num_rings - 2))), axis=1)),
+                             axis=1))
+
+    loop_vertex_indices = np.concatenate([face_array.ravel() for face_array in faces])
+    loop_uvs = np.concatenate([uv_array.reshape(-1, 2) for uv_array in face_uvs])
+    loop_totals = np.concatenate([np.full(face_array.shape[0], face_array.shape[1]) for face_array in faces])
+    loop_starts = np.concatenate(([0], np.cumsum(loop_totals)[:-1]))
+
+    return add_mesh_from_numpy(name,
+                               vertices,
+                               loop_vertex_indices,
+                               loop_starts,
+                               loop_totals,
+                               use_smooth=False,
+                               loop_uvs=loop_uvs)
+
+
+def add_monkey_mesh(name: str = "Suzanne") -> bpy.types.Mesh:
+    # Suzanne is not procedural, so take her from bmesh, which does not need any context either
+    bm = bmesh.new()
+    bm.loops.layers.uv.new("UVMap")
+    bmesh.ops.create_monkey(bm, matrix=mathutils.Matrix.Identity(4), calc_uvs=True)
+
+    new_mesh: bpy.types.Mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(new_mesh)
+    bm.free()
+
+    return new_mesh
+
+
+@profile_function
 def create_plane(location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                  rotation: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                  size: float = 2.0,
-                 name: Optional[str] = None) -> bpy.types.Object:
-    bpy.ops.mesh.primitive_plane_add(size=size, location=location, rotation=rotation)
-
-    current_object = bpy.context.object
-
-    if name is not None:
-        current_object.name = name
-
-    return current_object
+                 name: Optional[str] = None,
+                 collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    name = "Plane" if name is None else name
+    return create_object(add_plane_mesh(size, name), name, location, rotation, collection)
 
 
+@profile_function
 def create_smooth_sphere(location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                          radius: float = 1.0,
                          subdivision_level: int = 1,
-                         name: Optional[str] = None) -> bpy.types.Object:
-    bpy.ops.mesh.primitive_uv_sphere_add(radius=radius, location=location, calc_uvs=True)
-
-    current_object = bpy.context.object
-
-    if name is not None:
-        current_object.name = name
+                         name: Optional[str] = None,
+                         collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    name = "Sphere" if name is None else name
+    current_object = create_object(add_uv_sphere_mesh(radius, name=name), name, location, (0.0, 0.0, 0.0), collection)
 
     set_smooth_shading(current_object.data)
     add_subdivision_surface_modifier(current_object, subdivision_level)
@@ -68,16 +335,14 @@ def create_smooth_sphere(location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
     return current_object
 
 
+@profile_function
 def create_smooth_monkey(location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                          rotation: Tuple[float, float, float] = (0.0, 0.0, 0.0),
                          subdivision_level: int = 2,
-                         name: Optional[str] = None) -> bpy.types.Object:
-    bpy.ops.mesh.primitive_monkey_add(location=location, rotation=rotation, calc_uvs=True)
-
-    current_object = bpy.context.object
-
-    if name is not None:
-        current_object.name = name
+                         name: Optional[str] = None,
+                         collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    name = "Suzanne" if name is None else name
+    current_object = create_object(add_monkey_mesh(name), name, location, rotation, collection)
 
     set_smooth_shading(current_object.data)
     add_subdivision_surface_modifier(current_object, subdivision_level)
@@ -85,6 +350,60 @@ def create_smooth_monkey(location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
     return current_object
 
 
+@profile_function
+def create_planes(transforms: np.ndarray,
+                  size: float = 2.0,
+                  name: str = "Plane",
+                  collection: Optional[bpy.types.Collection] = None) -> List[bpy.types.Object]:
+    '''
+    Create a plane at each of the (N, 9) transforms at once (see utils.create_objects). The planes share one mesh.
+    '''
+
+    return create_objects(add_plane_mesh(size, name), transforms, name, collection)
+
+
+@profile_function
+def create_smooth_spheres(transforms: np.ndarray,
+                          radius: float = 1.0,
+                          subdivision_level: int = 1,
+                          name: str = "Sphere",
+                          collection: Optional[bpy.types.Collection] = None) -> List[bpy.types.Object]:
+    '''
+    Create a smooth sphere at each of the (N, 9) transforms at once (see utils.create_objects). The spheres share one
+    mesh.
+    '''
+
+    mesh = add_uv_sphere_mesh(radius, name=name)
+    set_smooth_shading(mesh)
+
+    new_objects = create_objects(mesh, transforms, name, collection)
+    for new_object in new_objects:
+        add_subdivision_surface_modifier(new_object, subdivision_level)
+
+    return new_objects
+
+
+@profile_function
+def create_smooth_monkeys(transforms: np.ndarray,
+                          subdivision_level: int = 2,
+                          name: str = "Suzanne",
+                          collection: Optional[bpy.types.Collection] = None) -> List[bpy.types.Object]:
+    '''
+    Create a smooth Suzanne at each of the (N, 9) transforms at once (see utils.create_objects). The Suzannes share one
+    mesh.
+    '''
+
+    mesh = add_monkey_mesh(name)
+    set_smooth_shading(mesh)
+
+    new_objects = create_objects(mesh, transforms, name, collection)
+    for new_object in new_objects:
+        add_subdivision_surface_modifier(new_object, subdivision_level)
+
+    return new_objects
+
+
+@profile_function
 def create_three_smooth_monkeys(
         names: Optional[Tuple[str, str, str]] = None) -> Tuple[bpy.types.Object, bpy.types.Object, bpy.types.Object]:
     if names is None:
@@ -97,6 +416,93 @@ def create_three_smooth_monkeys(
     return left, center, right
 
 
+@profile_function
+def add_evaluated_mesh(mesh_object: bpy.types.Object, name: Optional[str] = None) -> bpy.types.Mesh:
+    '''
+    Add a mesh with the modifiers of the object (e.g., subdivision surfaces) applied, so that objects sharing it do not
+    evaluate the modifiers separately.
+    '''
+
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    evaluated_mesh = bpy.data.meshes.new_from_object(mesh_object.evaluated_get(depsgraph),
+                                                     preserve_all_data_layers=True,
+                                                     depsgraph=depsgraph)
+    evaluated_mesh.name = mesh_object.name + " Evaluated" if name is None else name
+
+    return evaluated_mesh
+
+
+@profile_function
+def create_linked_duplicates(scene: bpy.types.Scene, mesh: bpy.types.Mesh, transforms: np.ndarray,
+                             name: str) -> List[bpy.types.Object]:
+    '''
+    Create an object for each of the (N, 9) transforms (see utils.get_transform_components) sharing the mesh data,
+    named "<name><index>" and gathered in a new collection in the scene (see utils.create_objects). Cycles stores the
+    shared mesh once, but each object still has its own overhead, so this suits up to thousands of copies that need to
+    be individual objects (e.g., to be animated or constrained).
+    '''
+
+    return create_objects(mesh, transforms, name, scene.collection)
+
+
+def add_point_instancer_node_group(instanced_object: bpy.types.Object) -> bpy.types.NodeGroup:
+    group = bpy.data.node_groups.new(type="GeometryNodeTree", name="Instancer " + instanced_object.name)
+
+    input_node = group.nodes.new("NodeGroupInput")
+    group.inputs.new("NodeSocketGeometry", "Geometry")
+
+    # The location, the "rotation" attribute and the "scale" attribute of each point are used for its instance
+    instance_node = group.nodes.new(type="GeometryNodePointInstance")
+    instance_node.instance_type = 'OBJECT'
+    instance_node.inputs["Object"].default_value = instanced_object
+
+    output_node = group.nodes.new("NodeGroupOutput")
+    group.outputs.new("NodeSocketGeometry", "Geometry")
+
+    group.links.new(input_node.outputs["Geometry"], instance_node.inputs["Geometry"])
+    group.links.new(instance_node.outputs["Geometry"], output_node.inputs["Geometry"])
+
+    request_arrange_nodes(group)
+
+    return group
+
+
+@profile_function
+def create_point_instancer(scene: bpy.types.Scene, instanced_object: bpy.types.Object, transforms: np.ndarray,
+                           name: str) -> bpy.types.Object:
+    '''
+    Create a single object that instances the object at each of the (N, 9) transforms (see
+    utils.get_transform_components) through a geometry-nodes modifier. The transforms are written to the points of the
+    object in bulk, the instanced object (including its modifiers) is evaluated once, and Cycles instances its
+    geometry, so memory and BVH build cost stay nearly constant as N grows. The instanced object itself is hidden in
+    renders.
+    '''
+
+    locations, rotations, scales = get_transform_components(transforms)
+    num_points = locations.shape[0]
+
+    point_mesh: bpy.types.Mesh = bpy.data.meshes.new(name)
+    point_mesh.vertices.add(num_points)
+    point_mesh.vertices.foreach_set("co", np.ascontiguousarray(locations).ravel())
+    for attribute_name, values in (("rotation", rotations), ("scale", scales)):
+        attribute = point_mesh.attributes.new(attribute_name, 'FLOAT_VECTOR', 'POINT')
+        attribute.data.foreach_set("vector", np.ascontiguousarray(values).ravel())
+    point_mesh.update()
+
+    new_object: bpy.types.Object = bpy.data.objects.new(name, point_mesh)
+    scene.collection.objects.link(new_object)
+
+    modifier: bpy.types.NodesModifier = new_object.modifiers.new(name="Instancer", type='NODES')
+    modifier.node_group = add_point_instancer_node_group(instanced_object)
+
+    # The instances are still rendered
+    instanced_object.hide_render = True
+
+    increment_counter("point_instances", num_points)
+
+    return new_object
+
+
 # https://docs.blender.org/api/current/bpy.types.VertexGroups.html
 # https://docs.blender.org/api/current/bpy.types.VertexGroup.html
 def add_vertex_group(mesh_object: bpy.types.Object, name: str = "Group") -> bpy.types.VertexGroup:
@@ -1,7 +1,11 @@
 import bpy
+import hashlib
 import sys
 import math
-from typing import Iterable
+import numpy as np
+import os
+from typing import Any, Callable, Container, Dict, Iterable, List, Optional, Tuple
+from utils.profiling import profile_function, increment_counter
 
 
 def create_frame_node(node_tree: bpy.types.NodeTree,
@@ -34,7 +38,427 @@ def clean_nodes(nodes: bpy.types.Nodes) -> None:
         nodes.remove(node)
 
 
-def arrange_nodes(node_tree: bpy.types.NodeTree, verbose: bool = False) -> None:
+################################################################################
+# Layout policy
+################################################################################
+
+# Environment variable that selects the node layout policy (see get_node_layout_policy)
+NODE_LAYOUT_POLICY_ENV_VAR = "BLENDER_CLI_RENDERING_NODE_LAYOUT"
+
+node_layout_policies = ('OFF', 'DEFERRED', 'EAGER')
+
+current_node_layout_policy: Optional[str] = None
+deferred_node_trees: List[bpy.types.NodeTree] = []
+
+
+def get_node_layout_policy() -> str:
+    '''
+    Return the policy used by request_arrange_nodes():
+
+    - 'OFF': never arrange nodes
+    - 'DEFERRED': queue node trees and arrange them only when a .blend file is saved
+    - 'EAGER': arrange nodes immediately (the original behavior)
+
+    The policy set by set_node_layout_policy() has the highest priority, followed by the environment variable
+    BLENDER_CLI_RENDERING_NODE_LAYOUT. Otherwise, 'DEFERRED' is used in background mode (nobody sees the node editor)
+    and 'EAGER' is used in interactive sessions. Node locations do not affect rendered pixels.
+    '''
+
+    if current_node_layout_policy is not None:
+        return current_node_layout_policy
+
+    env_policy = os.environ.get(NODE_LAYOUT_POLICY_ENV_VAR, "").upper()
+    if env_policy in node_layout_policies:
+        return env_policy
+
+    return 'DEFERRED' if bpy.app.background else 'EAGER'
+
+
+def set_node_layout_policy(policy: Optional[str]) -> None:
+    '''
+    Set the node layout policy ('OFF', 'DEFERRED' or 'EAGER'). Passing None restores the default resolution.
+    '''
+
+    global current_node_layout_policy
+
+    if policy is not None and policy.upper() not in node_layout_policies:
+        raise ValueError("Unknown node layout policy: " + policy)
+
+    current_node_layout_policy = policy.upper() if policy is not None else None
+
+
+def request_arrange_nodes(node_tree: bpy.types.NodeTree) -> None:
+    policy = get_node_layout_policy()
+
+    if policy == 'EAGER':
+        arrange_nodes(node_tree)
+    elif policy == 'DEFERRED':
+        if not any(deferred_node_tree == node_tree for deferred_node_tree in deferred_node_trees):
+            deferred_node_trees.append(node_tree)
+        if arrange_deferred_nodes_on_save not in bpy.app.handlers.save_pre:
+            bpy.app.handlers.save_pre.append(arrange_deferred_nodes_on_save)
+
+
+@profile_function
+def arrange_deferred_nodes() -> None:
+    for node_tree in deferred_node_trees:
+        try:
+            arrange_nodes(node_tree)
+        except ReferenceError:
+            # The node tree has been removed since it was queued
+            pass
+
+    deferred_node_trees.clear()
+
+
+@bpy.app.handlers.persistent
+def arrange_deferred_nodes_on_save(dummy) -> None:
+    arrange_deferred_nodes()
+
+
+################################################################################
+# Node group registry
+################################################################################
+
+# Node properties that do not affect the evaluation of a node tree
+ignored_node_properties = {
+    "name", "label", "location", "width", "width_hidden", "height", "dimensions", "select", "hide", "show_options",
+    "show_preview", "show_texture", "use_custom_color", "color"
+}
+
+# Structural hash -> node group
+interned_node_groups: Dict[str, bpy.types.NodeGroup] = {}
+
+# Builder function and its arguments -> structural hash of the node group built by it
+node_group_builder_hashes: Dict[str, str] = {}
+
+node_group_registry_stats: Dict[str, int] = {"builds": 0, "avoided_builds": 0, "merged_duplicates": 0}
+
+
+def is_node_group_alive(node_group: bpy.types.NodeGroup) -> bool:
+    try:
+        node_group.name
+    except ReferenceError:
+        return False
+    return True
+
+
+def get_interned_node_group(node_group_hash: str) -> Optional[bpy.types.NodeGroup]:
+    node_group = interned_node_groups.get(node_group_hash)
+
+    # The node group may have been removed or edited since it was registered
+    if node_group is None or not is_node_group_alive(node_group) or get_node_tree_hash(node_group) != node_group_hash:
+        return None
+
+    return node_group
+
+
+def get_rna_property_values(struct: bpy.types.bpy_struct,
+                            ignored_identifiers: Container[str] = ()) -> List[Tuple[str, str]]:
+    values = []
+    for rna_property in struct.bl_rna.properties:
+        if rna_property.identifier == "rna_type" or rna_property.identifier in ignored_identifiers:
+            continue
+        if rna_property.type not in {'BOOLEAN', 'INT', 'FLOAT', 'ENUM', 'STRING'}:
+            continue
+
+        value = getattr(struct, rna_property.identifier)
+        if getattr(rna_property, "is_array", False):
+            value = tuple(value)
+        elif isinstance(value, set):
+            value = tuple(sorted(value))
+        values.append((rna_property.identifier, repr(value)))
+
+    return values
+
+
+def get_socket_default_value(socket: bpy.types.NodeSocket) -> str:
+    if not hasattr(socket, "default_value"):
+        return ""
+    value = socket.default_value
+    return repr(tuple(value)) if hasattr(value, "__len__") and not isinstance(value, str) else repr(value)
+
+
+def get_node_tree_hash(node_tree: bpy.types.NodeTree) -> str:
+    '''
+    Return a hash of the structure of the node tree (interface sockets, nodes with their settings and socket default
+    values, and links). Names, labels and locations are ignored, so two node trees built by the same code are equal.
+    '''
+
+    nodes = list(node_tree.nodes)
+    node_indices = {node.name: index for index, node in enumerate(nodes)}
+
+    definition: List[Any] = [node_tree.bl_idname]
+
+    for socket in list(node_tree.inputs) + list(node_tree.outputs):
+        definition.append((socket.bl_socket_idname, get_rna_property_values(socket)))
+
+    for node in nodes:
+        node_definition: List[Any] = [node.bl_idname, get_rna_property_values(node, ignored_node_properties)]
+        node_definition.append([(socket.identifier, get_socket_default_value(socket)) for socket in node.inputs])
+        node_definition.append([(socket.identifier, get_socket_default_value(socket)) for socket in node.outputs])
+        node_definition.append(node_indices[node.parent.name] if node.parent is not None else None)
+
+        if getattr(node, "node_tree", None) is not None:
+            node_definition.append(get_node_tree_hash(node.node_tree))
+        if getattr(node, "image", None) is not None:
+            node_definition.append((node.image.filepath, node.image.colorspace_settings.name))
+        if getattr(node, "color_ramp", None) is not None:
+            node_definition.append(get_rna_property_values(node.color_ramp))
+            node_definition.append([(element.position, tuple(element.color)) for element in node.color_ramp.elements])
+        if isinstance(getattr(node, "mapping", None), bpy.types.CurveMapping):
+            node_definition.append([[(tuple(point.location), point.handle_type) for point in curve.points]
+                                    for curve in node.mapping.curves])
+
+        definition.append(node_definition)
+
+    for link in node_tree.links:
+        definition.append((node_indices[link.from_node.name], link.from_socket.identifier,
+                           node_indices[link.to_node.name], link.to_socket.identifier))
+
+    return hashlib.sha1(repr(definition).encode()).hexdigest()
+
+
+def intern_node_group(node_group: bpy.types.NodeGroup) -> bpy.types.NodeGroup:
+    '''
+    Return the registered node group that is structurally identical to the given one, in which case the given one is
+    removed. Otherwise, the given node group is registered and returned.
+    '''
+
+    node_group_hash = get_node_tree_hash(node_group)
+
+    interned_node_group = get_interned_node_group(node_group_hash)
+    if interned_node_group is not None and interned_node_group != node_group:
+        bpy.data.node_groups.remove(node_group)
+        node_group_registry_stats["merged_duplicates"] += 1
+        return interned_node_group
+
+    interned_node_groups[node_group_hash] = node_group
+    return node_group
+
+
+def get_or_add_node_group(add_node_group: Callable[..., bpy.types.NodeGroup], *args: Any) -> bpy.types.NodeGroup:
+    '''
+    Return the node group built by add_node_group(*args), calling it only when no identical node group exists (e.g., it
+    has not been called yet with these arguments, or the node group has been removed or edited since then).
+    '''
+
+    builder_key = add_node_group.__module__ + "." + add_node_group.__qualname__ + repr(args)
+
+    node_group_hash = node_group_builder_hashes.get(builder_key)
+    if node_group_hash is not None:
+        node_group = get_interned_node_group(node_group_hash)
+        if node_group is not None:
+            node_group_registry_stats["avoided_builds"] += 1
+            increment_counter("node_group_avoided_builds")
+            return node_group
+
+    node_group = intern_node_group(add_node_group(*args))
+    node_group_registry_stats["builds"] += 1
+    increment_counter("node_group_builds")
+
+    node_group_builder_hashes[builder_key] = get_node_tree_hash(node_group)
+
+    return node_group
+
+
+def get_node_group_registry_stats() -> Dict[str, int]:
+    return dict(node_group_registry_stats, size=len(interned_node_groups))
+
+
+def clear_node_group_registry() -> None:
+    interned_node_groups.clear()
+    node_group_builder_hashes.clear()
+    for name in node_group_registry_stats:
+        node_group_registry_stats[name] = 0
+
+
+################################################################################
+# Layout solvers
+################################################################################
+
+
+def get_node_height(node: bpy.types.Node) -> float:
+    # Note: "dimensions" and "height" may not be correct depending on the situation
+    epsilon = 1e-05
+    if node.dimensions.y > epsilon:
+        return node.dimensions.y
+    elif math.fabs(node.height - 100.0) > epsilon:
+        return node.height
+    else:
+        return 200.0
+
+
+@profile_function
+def arrange_nodes(node_tree: bpy.types.NodeTree, verbose: bool = False, method: str = 'LAYERED') -> None:
+    '''
+    Arrange the nodes of the node tree so that links flow from left to right without overlaps.
+
+    method: 'LAYERED' (default) or 'GAUSS_SEIDEL' (the original iterative solver)
+    '''
+
+    if method == 'LAYERED':
+        arrange_nodes_by_layers(node_tree, verbose=verbose)
+    elif method == 'GAUSS_SEIDEL':
+        arrange_nodes_by_gauss_seidel(node_tree, verbose=verbose)
+    else:
+        raise ValueError("Unknown node arrangement method: " + method)
+
+
+def pack_node_columns(ys: np.ndarray, heights: np.ndarray, columns: np.ndarray, margin: float) -> np.ndarray:
+    '''
+    Resolve the vertical overlaps within each column while keeping the order of the nodes in the column.
+
+    This is a sweep along the y axis done for all the columns at once: after sorting the nodes by (column, -y), the
+    constraint "y[i] <= y[i - 1] - h[i - 1] - margin" becomes a running minimum of shifted values.
+    '''
+
+    order = np.lexsort((-ys, columns))
+    sorted_ys = ys[order]
+    sorted_heights = heights[order]
+    sorted_columns = columns[order]
+
+    # Accumulated extent of the nodes above each node within the same column
+    extents = np.cumsum(sorted_heights + margin) - (sorted_heights + margin)
+    is_column_head = np.concatenate(([True], sorted_columns[1:] != sorted_columns[:-1]))
+    head_extents = np.maximum.accumulate(np.where(is_column_head, extents, 0.0))
+    extents -= head_extents
+
+    # Offset each column so that a running minimum over all the nodes never crosses a column boundary
+    shifted = sorted_ys + extents
+    big = shifted.max() - shifted.min() + 1.0
+    column_offsets = np.cumsum(is_column_head) * big
+    shifted = np.minimum.accumulate(shifted - column_offsets) + column_offsets
+
+    # Keep the center of each column where it was before resolving the overlaps
+    packed_ys = shifted - extents
+    column_ids = np.cumsum(is_column_head) - 1
+    num_columns = column_ids[-1] + 1
+    drifts = np.bincount(column_ids, weights=sorted_ys - packed_ys, minlength=num_columns)
+    counts = np.bincount(column_ids, minlength=num_columns)
+    packed_ys += (drifts / counts)[column_ids]
+
+    result = np.empty_like(ys)
+    result[order] = packed_ys
+
+    return result
+
+
+def arrange_nodes_by_layers(node_tree: bpy.types.NodeTree, verbose: bool = False) -> None:
+    '''
+    A layered-DAG layout solved in batch with NumPy.
+
+    Node properties (widths, heights, socket indices, links) are read from the node tree only once. Each node is
+    assigned to a column by its longest path to a sink node, the vertical positions are relaxed so that linked
+    sockets face each other, and the overlaps are resolved by a per-column sweep. The locations are written back to
+    the node tree at the end.
+    '''
+
+    max_num_iters = 200
+    epsilon = 1e-03
+    target_space = 50.0
+    socket_offset = 20.0
+    k = 0.5
+
+    # Frame nodes are sized by their children, so they do not participate in the layout
+    nodes = [node for node in node_tree.nodes if node.type != 'FRAME']
+    num_nodes = len(nodes)
+
+    if num_nodes == 0:
+        return
+
+    if verbose:
+        print("-----------------")
+        print("Target nodes:")
+        for node in nodes:
+            print("- " + node.name)
+
+    # Snapshot node properties and precompute socket indices
+    node_indices = {}
+    from_socket_indices = {}
+    to_socket_indices = {}
+    for node_index, node in enumerate(nodes):
+        node_indices[node.as_pointer()] = node_index
+        for socket_index, socket in enumerate(node.outputs):
+            from_socket_indices[socket.as_pointer()] = socket_index
+        for socket_index, socket in enumerate(node.inputs):
+            to_socket_indices[socket.as_pointer()] = socket_index
+
+    widths = np.array([node.width for node in nodes], dtype=np.float64)
+    heights = np.array([get_node_height(node) for node in nodes], dtype=np.float64)
+
+    link_data = [(node_indices[link.from_node.as_pointer()], node_indices[link.to_node.as_pointer()],
+                  from_socket_indices[link.from_socket.as_pointer()], to_socket_indices[link.to_socket.as_pointer()])
+                 for link in node_tree.links
+                 if link.from_node.as_pointer() in node_indices and link.to_node.as_pointer() in node_indices]
+    links = np.array(link_data, dtype=np.int64).reshape(-1, 4)
+    link_from = links[:, 0]
+    link_to = links[:, 1]
+    link_offsets = socket_offset * (links[:, 2] - links[:, 3]).astype(np.float64)
+
+    # Columns: the longest path to a sink (Bellman-Ford-style relaxation; bounded in case of invalid cyclic links)
+    columns = np.zeros(num_nodes, dtype=np.int64)
+    for i in range(num_nodes):
+        new_columns = columns.copy()
+        np.maximum.at(new_columns, link_from, columns[link_to] + 1)
+        if np.array_equal(new_columns, columns):
+            break
+        columns = new_columns
+    num_columns = int(columns.max()) + 1
+
+    # Horizontal locations: right-aligned within each column, sinks at the right-most column
+    column_widths = np.zeros(num_columns)
+    np.maximum.at(column_widths, columns, widths)
+    column_xs = -np.cumsum(np.concatenate(([0.0], column_widths[1:] + target_space)))
+    xs = column_xs[columns] + column_widths[columns] - widths
+
+    # Initial vertical locations: place the columns from right to left at the barycenters of their successors
+    ys = np.zeros(num_nodes)
+    for column in range(num_columns):
+        in_column = columns == column
+        if column != 0:
+            sums = np.zeros(num_nodes)
+            counts = np.zeros(num_nodes)
+            np.add.at(sums, link_from, ys[link_to] + link_offsets)
+            np.add.at(counts, link_from, 1.0)
+            has_successor = in_column & (counts > 0.0)
+            ys[has_successor] = sums[has_successor] / counts[has_successor]
+        ys = pack_node_columns(ys, heights, columns, target_space)
+
+    # Jacobi-style relaxation of the link constraints followed by the overlap projection
+    degrees = np.zeros(num_nodes)
+    np.add.at(degrees, link_from, 1.0)
+    np.add.at(degrees, link_to, 1.0)
+    degrees = np.maximum(degrees, 1.0)
+
+    for i in range(max_num_iters if len(link_data) != 0 else 0):
+        # C = (y_from - offset * from_socket_index) - (y_to - offset * to_socket_index)
+        C = ys[link_from] - ys[link_to] - link_offsets
+        deltas = np.zeros(num_nodes)
+        np.add.at(deltas, link_from, -0.5 * C)
+        np.add.at(deltas, link_to, +0.5 * C)
+
+        new_ys = pack_node_columns(ys + k * deltas / degrees, heights, columns, target_space)
+        residual = float(np.abs(new_ys - ys).max())
+        ys = new_ys
+
+        if verbose:
+            print("Iteration #" + str(i) + ": " + str(residual))
+
+        # Check the termination condition
+        if residual < epsilon:
+            break
+
+    # Write back the locations in a single pass
+    for node, x, y in zip(nodes, xs, ys):
+        node.location = (float(x), float(y))
+
+
+def arrange_nodes_by_gauss_seidel(node_tree: bpy.types.NodeTree, verbose: bool = False) -> None:
+    '''
+    The original position-based solver. It is kept for comparison with the layered solver.
+    '''
+
     max_num_iters = 2000
     epsilon = 1e-05
     target_space = 50.0
@@ -137,19 +561,10 @@ def arrange_nodes(node_tree: bpy.types.NodeTree, verbose: bool = False) -> None:
                     rx_1 = 0.5 * w_1 + margin
                     rx_2 = 0.5 * w_2 + margin
 
-                    # Note: "dimensions" and "height" may not be correct depending on the situation
-                    def get_height(node: bpy.types.Node) -> float:
-                        if node.dimensions.y > epsilon:
-                            return node.dimensions.y
-                        elif math.fabs(node.height - 100.0) > epsilon:
-                            return node.height
-                        else:
-                            return 200.0
-
                     y_1 = node_1.location[1]
                     y_2 = node_2.location[1]
-                    h_1 = get_height(node_1)
-                    h_2 = get_height(node_2)
+                    h_1 = get_node_height(node_1)
+                    h_2 = get_node_height(node_2)
                     cy_1 = y_1 - 0.5 * h_1
                     cy_2 = y_2 - 0.5 * h_2
                     ry_1 = 0.5 * h_1 + margin
@@ -0,0 +1,235 @@
+import bpy
+import functools
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Environment variable that enables profiling and specifies the path of the JSON report
+PROFILE_REPORT_ENV_VAR = "BLENDER_CLI_RENDERING_PROFILE"
+
+profiling_start_time = time.perf_counter()
+
+# Phase name -> {"count": number of calls, "total_time": seconds (inclusive of nested phases)}
+phase_timings: Dict[str, Dict[str, float]] = {}
+counters: Dict[str, int] = {}
+
+# Render-time statistics collected by the handlers
+render_stage_timings: Dict[str, float] = {}
+frame_records: List[Dict[str, Any]] = []
+render_state: Dict[str, Any] = {
+    "report_path": None,
+    "render_init_time": None,
+    "last_stats": None,
+    # Set during probe renders (see utils.calibrate_sampling), which are not part of the rendering being profiled
+    "is_probing": False,
+}
+
+# Keywords in the render statistics of Cycles and the stage they belong to (the first match wins)
+render_stage_keywords = (
+    ("Denoising", "denoising"),
+    ("Compositing", "compositing"),
+    ("BVH", "bvh"),
+    ("Loading images", "image_loading"),
+    ("Loading render kernels", "kernel_loading"),
+    ("Synchronizing", "sync"),
+    ("Updating", "sync"),
+    ("Sample", "sampling"),
+    ("Path Tracing", "sampling"),
+)
+
+
+@contextmanager
+def profile_phase(name: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = phase_timings.setdefault(name, {"count": 0, "total_time": 0.0})
+        timing["count"] += 1
+        timing["total_time"] += time.perf_counter() - start_time
+
+
+def profile_function(function: Callable) -> Callable:
+    '''
+    A decorator that reports the time spent in the function as the phase of the same name.
+    '''
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with profile_phase(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def increment_counter(name: str, value: int = 1) -> None:
+    counters[name] = counters.get(name, 0) + value
+
+
+def get_render_stage(stats: str) -> Optional[str]:
+    for keyword, stage in render_stage_keywords:
+        if keyword in stats:
+            return stage
+    return None
+
+
+def get_peak_memory_in_mb(stats: str) -> Optional[float]:
+    match = re.search(r"Peak[: ]\s*([\d.]+)([KMG])", stats)
+    if match is None:
+        return None
+    return float(match.group(1)) * {"K": 1.0 / 1024.0, "M": 1.0, "G": 1024.0}[match.group(2)]
+
+
+def get_max_rss_in_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else max_rss / 1024.0
+
+
+def close_render_stage(current_time: float) -> None:
+    last_stats = render_state["last_stats"]
+    if last_stats is None:
+        return
+
+    stage, stage_start_time = last_stats
+    if stage is not None:
+        render_stage_timings[stage] = render_stage_timings.get(stage, 0.0) + current_time - stage_start_time
+    render_state["last_stats"] = None
+
+
+@bpy.app.handlers.persistent
+def on_render_init(scene: bpy.types.Scene) -> None:
+    if render_state["is_probing"]:
+        return
+
+    current_time = time.perf_counter()
+    if render_state["render_init_time"] is None:
+        # Everything before the first render is the scene building by the script
+        phase_timings["scene_build"] = {"count": 1, "total_time": current_time - profiling_start_time}
+    render_state["render_init_time"] = current_time
+
+
+@bpy.app.handlers.persistent
+def on_render_pre(scene: bpy.types.Scene) -> None:
+    frame_records.append({
+        "frame": scene.frame_current,
+        "start_time": time.perf_counter(),
+        "render_time": None,
+        "samples": None,
+        "peak_memory_mb": None,
+    })
+
+
+@bpy.app.handlers.persistent
+def on_render_stats(stats: str) -> None:
+    current_time = time.perf_counter()
+
+    close_render_stage(current_time)
+    render_state["last_stats"] = (get_render_stage(stats), current_time)
+
+    if len(frame_records) == 0:
+        return
+
+    frame_record = frame_records[-1]
+
+    match = re.search(r"Sample (\d+)/(\d+)", stats)
+    if match is not None:
+        frame_record["samples"] = int(match.group(1))
+
+    peak_memory = get_peak_memory_in_mb(stats)
+    if peak_memory is not None:
+        frame_record["peak_memory_mb"] = max(peak_memory, frame_record["peak_memory_mb"] or 0.0)
+
+
+@bpy.app.handlers.persistent
+def on_render_post(scene: bpy.types.Scene) -> None:
+    current_time = time.perf_counter()
+    close_render_stage(current_time)
+
+    if len(frame_records) != 0:
+        frame_record = frame_records[-1]
+        frame_record["render_time"] = current_time - frame_record["start_time"]
+
+
+@bpy.app.handlers.persistent
+def on_render_complete(scene: bpy.types.Scene) -> None:
+    if render_state["report_path"] is not None and not render_state["is_probing"]:
+        write_profiling_report(render_state["report_path"])
+
+
+def get_profiling_report() -> Dict[str, Any]:
+    render_peak_memories = [record["peak_memory_mb"] for record in frame_records if record["peak_memory_mb"]]
+
+    return {
+        "script": os.path.basename(sys.argv[sys.argv.index("--python") + 1]) if "--python" in sys.argv else None,
+        "blender_version": bpy.app.version_string,
+        "total_time": time.perf_counter() - profiling_start_time,
+        "phases": phase_timings,
+        "counters": counters,
+        "render_stages": render_stage_timings,
+        "frames": [{key: value for key, value in record.items() if key != "start_time"} for record in frame_records],
+        "peak_memory": {
+            "render_peak_mb": max(render_peak_memories) if render_peak_memories else None,
+            "process_max_rss_mb": get_max_rss_in_mb(),
+        },
+    }
+
+
+def write_profiling_report(report_path: str) -> None:
+    report_dir_path = os.path.dirname(os.path.abspath(report_path))
+    os.makedirs(report_dir_path, exist_ok=True)
+
+    with open(report_path, "w") as file:
+        json.dump(get_profiling_report(), file, indent=2)
+
+
+def enable_render_profiling(report_path: Optional[str] = None) -> None:
+    '''
+    Register the render handlers that record per-frame render time, samples, memory and render stages. If a path is
+    given, the JSON report is written there when rendering completes (and can be written at any time with
+    write_profiling_report).
+    '''
+
+    render_state["report_path"] = report_path
+
+    handler_pairs = (
+        (bpy.app.handlers.render_init, on_render_init),
+        (bpy.app.handlers.render_pre, on_render_pre),
+        (bpy.app.handlers.render_stats, on_render_stats),
+        (bpy.app.handlers.render_post, on_render_post),
+        (bpy.app.handlers.render_complete, on_render_complete),
+        (bpy.app.handlers.render_cancel, on_render_complete),
+    )
+    for handlers, handler in handler_pairs:
+        if handler not in handlers:
+            handlers.append(handler)
+
+
+def clear_profiling_data() -> None:
+    '''
+    Start the profiling over (keeping the handlers and the report path), e.g., before another scene is built and
+    rendered in the same process, so that the report covers only that scene.
+    '''
+
+    global profiling_start_time
+    profiling_start_time = time.perf_counter()
+
+    phase_timings.clear()
+    counters.clear()
+    render_stage_timings.clear()
+    frame_records.clear()
+    render_state.update(render_init_time=None, last_stats=None)
+
+
+# Every scene script can be profiled without modification by setting the environment variable
+if os.environ.get(PROFILE_REPORT_ENV_VAR):
+    enable_render_profiling(os.environ[PROFILE_REPORT_ENV_VAR])
@@ -0,0 +1,239 @@
+import bpy
+import struct
+import zlib
+import numpy as np
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+################################################################################
+# Render passes
+################################################################################
+
+# Pass name (as in the EXR channel names) -> view layer property
+render_pass_properties = {
+    "Depth": "use_pass_z",
+    "Mist": "use_pass_mist",
+    "Normal": "use_pass_normal",
+    "Vector": "use_pass_vector",
+    "UV": "use_pass_uv",
+    "IndexOB": "use_pass_object_index",
+    "IndexMA": "use_pass_material_index",
+    "CryptoObject": "use_pass_cryptomatte_object",
+    "CryptoMaterial": "use_pass_cryptomatte_material",
+    "CryptoAsset": "use_pass_cryptomatte_asset",
+}
+
+# Renderable object types that get pass indices
+pass_index_object_types = ('MESH', 'CURVE', 'SURFACE', 'META', 'FONT')
+
+
+def set_render_passes(scene: bpy.types.Scene,
+                      pass_names: Iterable[str] = ("Depth", "Normal", "IndexOB", "CryptoObject"),
+                      cryptomatte_levels: int = 6,
+                      view_layer: Optional[bpy.types.ViewLayer] = None) -> None:
+    '''
+    Enable the passes (see render_pass_properties, plus "Denoising" for the denoising albedo, normal and depth passes)
+    so that all of them come out of a single render (see set_multilayer_exr_output).
+    '''
+
+    if view_layer is None:
+        view_layer = scene.view_layers[0]
+
+    pass_names = list(pass_names)
+    for pass_name in pass_names:
+        if pass_name == "Denoising":
+            view_layer.cycles.denoising_store_passes = True
+            continue
+        if pass_name not in render_pass_properties:
+            raise ValueError("Unknown render pass: " + pass_name)
+        if pass_name == "Vector" and scene.render.use_motion_blur:
+            raise ValueError("The vector pass is not available with motion blur")
+
+        property_name = render_pass_properties[pass_name]
+        if pass_name.startswith("Crypto") and bpy.app.version < (2, 92, 0):
+            # Cryptomatte used to be a Cycles setting
+            setattr(view_layer.cycles, property_name.replace("cryptomatte", "crypto"), True)
+        else:
+            setattr(view_layer, property_name, True)
+
+    if any(pass_name.startswith("Crypto") for pass_name in pass_names):
+        if bpy.app.version < (2, 92, 0):
+            view_layer.cycles.pass_crypto_depth = cryptomatte_levels
+        else:
+            view_layer.pass_cryptomatte_depth = cryptomatte_levels
+
+
+def set_object_pass_indices(scene: bpy.types.Scene) -> Dict[str, int]:
+    '''
+    Give the renderable objects pass indices (for the IndexOB pass) from 1 in the order of their names, so that the
+    indices stay the same across runs and renders of the same scene; 0 is left for the background. Returns the indices
+    by object name, e.g., to be written along with the labels.
+    '''
+
+    object_names = sorted(scene_object.name for scene_object in scene.objects
+                          if scene_object.type in pass_index_object_types)
+
+    pass_indices = {}
+    for index, object_name in enumerate(object_names):
+        scene.objects[object_name].pass_index = index + 1
+        pass_indices[object_name] = index + 1
+
+    return pass_indices
+
+
+def set_multilayer_exr_output(scene: bpy.types.Scene, use_half_float: bool = True, codec: str = 'NONE') -> None:
+    '''
+    Write the combined image and all the enabled passes into one multilayer OpenEXR file per frame.
+
+    Blender stores only the color passes in half float when use_half_float is set; data passes (depth, normal, vector,
+    index) stay in full float. Cryptomatte stores object hashes in color channels, which half float would corrupt, so
+    full float is used whenever a Cryptomatte pass is enabled.
+
+    codec: 'NONE' lets load_exr_channels memory-map the channels; 'ZIP' and 'ZIPS' are smaller and can also be read
+    '''
+
+    has_cryptomatte = any(
+        getattr(view_layer, property_name, False) for view_layer in scene.view_layers
+        for property_name in ("use_pass_cryptomatte_object", "use_pass_cryptomatte_material",
+                              "use_pass_cryptomatte_asset"))
+
+    image_settings = scene.render.image_settings
+    image_settings.file_format = 'OPEN_EXR_MULTILAYER'
+    image_settings.color_depth = '16' if use_half_float and not has_cryptomatte else '32'
+    image_settings.exr_codec = codec
+
+
+################################################################################
+# OpenEXR reader
+################################################################################
+
+exr_magic_number = 20000630
+
+# EXR pixel type -> NumPy type
+exr_pixel_types = {0: np.dtype("<u4"), 1: np.dtype("<f2"), 2: np.dtype("<f4")}
+
+# EXR compression -> the number of scanlines in a chunk
+exr_compressions = {0: ("NONE", 1), 2: ("ZIPS", 1), 3: ("ZIP", 16)}
+
+
+def read_null_terminated_string(file: BinaryIO) -> str:
+    chars = bytearray()
+    while True:
+        char = file.read(1)
+        if char in (b"", b"\0"):
+            return chars.decode()
+        chars += char
+
+
+def read_exr_header(file: BinaryIO) -> Dict[str, Any]:
+    '''
+    Read the header of a single-part scanline OpenEXR file (e.g., written by Blender), leaving the file at the offset
+    table of the chunks.
+    '''
+
+    magic_number, version = struct.unpack("<ii", file.read(8))
+    if magic_number != exr_magic_number:
+        raise ValueError("Not an OpenEXR file")
+    if version & 0x1200:
+        raise ValueError("Tiled or multi-part OpenEXR files are not supported")
+
+    header: Dict[str, Any] = {}
+    while True:
+        attribute_name = read_null_terminated_string(file)
+        if attribute_name == "":
+            break
+        attribute_type = read_null_terminated_string(file)
+        attribute_size, = struct.unpack("<i", file.read(4))
+        value = file.read(attribute_size)
+
+        if attribute_type == "chlist":
+            # Channels sorted by name: name, pixel type, linear flag, 3 reserved bytes, x/y sampling
+            channels: List[Tuple[str, np.dtype]] = []
+            offset = 0
+            while value[offset] != 0:
+                end = value.index(b"\0", offset)
+                pixel_type, = struct.unpack_from("<i", value, end + 1)
+                channels.append((value[offset:end].decode(), exr_pixel_types[pixel_type]))
+                offset = end + 1 + 16
+            header["channels"] = channels
+        elif attribute_type == "compression":
+            header["compression"] = value[0]
+        elif attribute_type == "box2i":
+            header[attribute_name] = struct.unpack("<iiii", value)
+
+    return header
+
+
+def decompress_zip_chunk(data: bytes) -> bytes:
+    # Undo the zlib compression, the byte delta predictor and the split of even and odd bytes of OpenEXR's ZIP codecs
+    deltas = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    predicted = np.cumsum(deltas.astype(np.int64) - 128 * (np.arange(deltas.shape[0]) > 0)).astype(np.uint8)
+
+    interleaved = np.empty_like(predicted)
+    half_size = (predicted.shape[0] + 1) // 2
+    interleaved[0::2] = predicted[:half_size]
+    interleaved[1::2] = predicted[half_size:]
+
+    return interleaved.tobytes()
+
+
+def load_exr_channels(file_path: str, channel_names: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+    '''
+    Load the channels (all if channel_names is None) of a single-part scanline OpenEXR file, e.g., a multilayer file of
+    set_multilayer_exr_output, as (H, W) arrays by full channel name (e.g., "ViewLayer.Depth.Z"), with the first row at
+    the top of the image. Uncompressed files are memory-mapped, so only the pages of the selected channels are read;
+    ZIP and ZIPS files are decompressed.
+    '''
+
+    with open(file_path, "rb") as file:
+        header = read_exr_header(file)
+        x_min, y_min, x_max, y_max = header["dataWindow"]
+        width, height = x_max - x_min + 1, y_max - y_min + 1
+
+        compression = header.get("compression", 0)
+        if compression not in exr_compressions:
+            raise ValueError("Unsupported OpenEXR compression: {}".format(compression))
+        num_lines_per_chunk = exr_compressions[compression][1]
+        num_chunks = (height + num_lines_per_chunk - 1) // num_lines_per_chunk
+        chunk_offsets = np.frombuffer(file.read(8 * num_chunks), dtype="<u8")
+
+        # Each scanline stores the channels one after another
+        line_dtype = np.dtype([(name, dtype, (width, )) for name, dtype in header["channels"]])
+        names = [name for name, _ in header["channels"]] if channel_names is None else list(channel_names)
+
+        if compression == 0:
+            # Chunks of one scanline, each with a 4-byte y coordinate and a 4-byte size
+            chunk_dtype = np.dtype([("y", "<i4"), ("size", "<i4"), ("line", line_dtype)])
+            if np.all(np.diff(chunk_offsets.astype(np.int64)) == chunk_dtype.itemsize):
+                chunks = np.memmap(file_path, dtype=chunk_dtype, mode='r', offset=int(chunk_offsets[0]),
+                                   shape=(height, ))
+                return {name: chunks["line"][name] for name in names}
+
+        lines = np.empty(height, dtype=line_dtype)
+        for chunk_offset in chunk_offsets:
+            file.seek(int(chunk_offset))
+            y, size = struct.unpack("<ii", file.read(8))
+            data = file.read(size)
+
+            first_line = y - y_min
+            num_lines = min(num_lines_per_chunk, height - first_line)
+            if compression != 0 and size < num_lines * line_dtype.itemsize:
+                data = decompress_zip_chunk(data)
+            lines[first_line:first_line + num_lines] = np.frombuffer(data, dtype=line_dtype, count=num_lines)
+
+    return {name: lines[name] for name in names}
+
+
+def get_exr_pass(channels: Dict[str, np.ndarray], pass_name: str) -> np.ndarray:
+    '''
+    Stack the channels of a pass (e.g., "ViewLayer.Normal" for "ViewLayer.Normal.X/Y/Z") loaded by load_exr_channels
+    into an (H, W, C) array, in the channel order of the pass (e.g., RGBA or XYZ).
+    '''
+
+    channel_order = "RGBAXYZWUV"
+    prefix = pass_name + "."
+    suffixes = sorted((name[len(prefix):] for name in channels if name.startswith(prefix)),
+                      key=lambda suffix: (channel_order.find(suffix), suffix))
+    if len(suffixes) == 0:
+        raise ValueError("No channels of the pass: " + pass_name)
+
+    return np.stack([channels[prefix + suffix] for suffix in suffixes], axis=2)
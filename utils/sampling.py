@@ -0,0 +1,276 @@
+import bpy
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from utils.profiling import enable_render_profiling, frame_records, on_render_pre, render_stage_timings, render_state
+
+# Environment variable that overrides the sampling of the scene scripts (see get_sampling_policy_from_environment)
+SAMPLING_POLICY_ENV_VAR = "BLENDER_CLI_RENDERING_SAMPLING"
+
+# The current policy: "mode" is "samples", "noise" or "time"
+sampling_policy: Dict[str, Any] = {"mode": None}
+
+
+def set_sampling_policy(scene: bpy.types.Scene,
+                        num_samples: Optional[int] = None,
+                        noise_threshold: Optional[float] = None,
+                        time_budget: Optional[float] = None,
+                        min_samples: int = 0,
+                        max_samples: int = 4096) -> None:
+    '''
+    Configure the Cycles sampling with exactly one of the following targets:
+
+    num_samples: a fixed sample count without adaptive sampling
+    noise_threshold: adaptive sampling stops at this noise level (e.g., 0.01), up to max_samples
+    time_budget: seconds per frame; Cycles stops at the budget by itself where it has a time limit (3.0+), and
+    otherwise the sample count of each frame is estimated from the previous frames (or calibrate_sampling)
+
+    min_samples is the minimum adaptive sample count (0 for Blender's automatic choice). The achieved samples, the
+    sample limit and the render time of each frame are recorded in utils.frame_records (and the profiling report).
+    '''
+
+    if sum(target is not None for target in (num_samples, noise_threshold, time_budget)) != 1:
+        raise ValueError("Give exactly one of num_samples, noise_threshold and time_budget")
+
+    cycles = scene.cycles
+    if num_samples is not None:
+        sampling_policy.update(mode="samples", target=num_samples)
+        cycles.use_adaptive_sampling = False
+        cycles.samples = num_samples
+    elif noise_threshold is not None:
+        sampling_policy.update(mode="noise", target=noise_threshold)
+        cycles.use_adaptive_sampling = True
+        cycles.adaptive_threshold = noise_threshold
+        cycles.adaptive_min_samples = min_samples
+        cycles.samples = max_samples
+    else:
+        sampling_policy.update(mode="time", target=time_budget)
+        cycles.use_adaptive_sampling = False
+        if hasattr(cycles, "time_limit"):
+            cycles.time_limit = time_budget
+            cycles.samples = max_samples
+        else:
+            cycles.samples = max(min(cycles.samples, max_samples), min_samples, 1)
+
+    sampling_policy.update(min_samples=min_samples, max_samples=max_samples)
+
+    # The frame records of the profiler are needed to follow the time budget and to record the achieved samples
+    if on_render_pre not in bpy.app.handlers.render_pre:
+        enable_render_profiling()
+    if on_sampling_render_post not in bpy.app.handlers.render_post:
+        bpy.app.handlers.render_post.append(on_sampling_render_post)
+
+
+def clear_sampling_policy() -> None:
+    # Stop recording and following the policy, e.g., before another scene is built in the same process
+    sampling_policy.clear()
+    sampling_policy["mode"] = None
+
+
+def get_next_num_samples(num_samples: int, render_time: float, time_budget: float, min_samples: int,
+                         max_samples: int) -> int:
+    # The render time is roughly proportional to the sample count; the change per frame is limited to keep the
+    # sample count stable when the render time fluctuates
+    ratio = min(max(time_budget / max(render_time, 1e-3), 0.25), 4.0)
+    return int(min(max(math.floor(num_samples * ratio), min_samples, 1), max_samples))
+
+
+@bpy.app.handlers.persistent
+def on_sampling_render_post(scene: bpy.types.Scene) -> None:
+    if sampling_policy["mode"] is None or len(frame_records) == 0:
+        return
+
+    frame_record = frame_records[-1]
+    frame_record["sampling_policy"] = sampling_policy["mode"]
+    frame_record["sampling_target"] = sampling_policy["target"]
+    frame_record["sample_limit"] = scene.cycles.samples
+
+    # Adjust the sample count of the next frame to the time budget unless Cycles follows it by itself
+    if (sampling_policy["mode"] == "time" and not hasattr(scene.cycles, "time_limit")
+            and frame_record["render_time"] is not None):
+        achieved_samples = frame_record["samples"] or scene.cycles.samples
+        scene.cycles.samples = get_next_num_samples(achieved_samples, frame_record["render_time"],
+                                                    sampling_policy["target"], sampling_policy["min_samples"],
+                                                    sampling_policy["max_samples"])
+
+
+def get_probe_frames(scene: bpy.types.Scene, num_frames: int) -> List[int]:
+    if scene.frame_end <= scene.frame_start or num_frames <= 1:
+        return [scene.frame_current]
+
+    step = (scene.frame_end - scene.frame_start) / (num_frames - 1)
+    return sorted(set(int(round(scene.frame_start + index * step)) for index in range(num_frames)))
+
+
+def calibrate_sampling(scene: bpy.types.Scene,
+                       frames: Optional[Sequence[int]] = None,
+                       resolution_percentage: int = 25,
+                       num_probe_samples: int = 16,
+                       margin: float = 1.5) -> Dict[str, Any]:
+    '''
+    Pick the sampling settings of the current policy (see set_sampling_policy) for this scene by rendering a few probe
+    frames (by default, the first, middle and last ones of the animation, or the current one for stills) at a low
+    resolution without writing them:
+
+    - noise policy: the probes use the noise threshold, and the sample limit is set to the largest achieved sample
+      count times the margin, so that a few hard pixels cannot blow up the render time
+    - time policy: each probe frame is rendered with num_probe_samples and a quarter of them, and the render time is
+      fitted as a fixed cost (synchronization, BVH building, kernel loading) plus a cost per sample; only the latter
+      is scaled to the full resolution to find the sample count that fits in the time budget
+
+    The probes render the scene as it is, so call this once the scene is finished. The sample count policy, and the
+    time policy where Cycles has a time limit, need no calibration. Returns the chosen settings and the probe results.
+    '''
+
+    mode = sampling_policy["mode"]
+    if mode is None:
+        raise ValueError("Set a sampling policy before calibration")
+    if mode == "samples" or (mode == "time" and hasattr(scene.cycles, "time_limit")):
+        return {"mode": mode, "samples": scene.cycles.samples}
+
+    render = scene.render
+    cycles = scene.cycles
+    original_settings = (render.resolution_percentage, scene.frame_current, cycles.samples, render.filepath)
+
+    probe_frames = get_probe_frames(scene, 3) if frames is None else list(frames)
+
+    # The noise policy keeps its sample limit; the time policy fits the render time to two sample counts (the larger
+    # one first, so that one-off costs such as kernel loading make the cost per sample conservative)
+    probe_sample_counts = [None] if mode == "noise" else [num_probe_samples, max(num_probe_samples // 4, 1)]
+
+    # Keep the probes out of the time budget feedback and the profiling data (the probe frame records are needed only
+    # for the achieved samples)
+    sampling_policy["mode"] = None
+    render_state["is_probing"] = True
+    num_original_frame_records = len(frame_records)
+    original_render_stage_timings = dict(render_stage_timings)
+    probes = []
+    try:
+        render.resolution_percentage = resolution_percentage
+        for frame in probe_frames:
+            scene.frame_set(frame)
+            for probe_samples in probe_sample_counts:
+                if probe_samples is not None:
+                    cycles.samples = probe_samples
+                num_frame_records = len(frame_records)
+
+                start_time = time.perf_counter()
+                bpy.ops.render.render(write_still=False, scene=scene.name)
+                render_time = time.perf_counter() - start_time
+
+                achieved_samples = frame_records[-1]["samples"] if len(frame_records) > num_frame_records else None
+                probes.append({
+                    "frame": frame,
+                    "render_time": render_time,
+                    "samples": achieved_samples or cycles.samples,
+                })
+    finally:
+        render.resolution_percentage, frame_current, cycles.samples, render.filepath = original_settings
+        scene.frame_set(frame_current)
+        sampling_policy["mode"] = mode
+        render_state["is_probing"] = False
+        del frame_records[num_original_frame_records:]
+        render_stage_timings.clear()
+        render_stage_timings.update(original_render_stage_timings)
+
+    if mode == "noise":
+        cycles.samples = int(min(max(math.ceil(margin * max(probe["samples"] for probe in probes)), 1),
+                                 sampling_policy["max_samples"]))
+    else:
+        # Fixed cost and time per sample of each probe frame (render_time = fixed_time + samples * time_per_sample),
+        # the slowest of which are used; the time per sample grows with the number of pixels, the fixed cost hardly
+        fixed_times = []
+        times_per_sample = []
+        for probe, low_probe in zip(probes[0::2], probes[1::2]):
+            time_per_sample = max(probe["render_time"] - low_probe["render_time"], 0.0) / max(
+                probe["samples"] - low_probe["samples"], 1)
+            if time_per_sample == 0.0:
+                # Too fast to tell apart; assume that all the time is spent on sampling
+                time_per_sample = probe["render_time"] / probe["samples"]
+            fixed_times.append(max(low_probe["render_time"] - low_probe["samples"] * time_per_sample, 0.0))
+            times_per_sample.append(time_per_sample)
+
+        pixel_ratio = (original_settings[0] / resolution_percentage)**2
+        sampling_time = sampling_policy["target"] - max(fixed_times)
+        num_samples = max(math.floor(sampling_time / (max(times_per_sample) * pixel_ratio)),
+                          sampling_policy["min_samples"], 1)
+        cycles.samples = int(min(num_samples, sampling_policy["max_samples"]))
+
+    calibration = {"mode": mode, "target": sampling_policy["target"], "samples": cycles.samples, "probes": probes}
+
+    print("----")
+    print("Sampling calibration: {} policy (target: {}), {} samples".format(mode, sampling_policy["target"],
+                                                                            cycles.samples))
+    for probe in probes:
+        print("- frame {}: {} samples in {:.2f} sec".format(probe["frame"], probe["samples"], probe["render_time"]))
+    print("----")
+
+    return calibration
+
+
+def get_sampling_policy_from_environment() -> Optional[Dict[str, Any]]:
+    '''
+    Parse the sampling policy given by the environment variable, e.g., "noise=0.01", "time=30", "samples=128" or
+    "noise=0.01,calibrate", into the keyword arguments of set_sampling_policy plus "calibrate". Returns None if the
+    variable is not set.
+    '''
+
+    value = os.environ.get(SAMPLING_POLICY_ENV_VAR)
+    if not value:
+        return None
+
+    policy: Dict[str, Any] = {"calibrate": False}
+    for item in value.split(","):
+        key, _, argument = item.strip().partition("=")
+        if key == "calibrate":
+            policy["calibrate"] = True
+        elif key == "samples":
+            policy["num_samples"] = int(argument)
+        elif key == "noise":
+            policy["noise_threshold"] = float(argument)
+        elif key == "time":
+            policy["time_budget"] = float(argument)
+        elif key in ("min_samples", "max_samples"):
+            policy[key] = int(argument)
+        else:
+            raise ValueError("Unknown sampling policy item: " + item)
+
+    return policy
+
+
+def calibrate_sampling_from_environment(scene: bpy.types.Scene,
+                                        frames: Optional[Sequence[int]] = None) -> Optional[Dict[str, Any]]:
+    '''
+    Run calibrate_sampling if the policy given by the environment variable asks for it (e.g., "noise=0.01,calibrate").
+    The probes render the scene as it is, so this must be the last step of building the scene: after the texture LODs,
+    simulation bakes and anything else that changes what is rendered. Returns the calibration, or None if it is not
+    asked for.
+    '''
+
+    policy = get_sampling_policy_from_environment()
+    if policy is None or not policy["calibrate"] or sampling_policy["mode"] is None:
+        return None
+
+    return calibrate_sampling(scene, frames)
+
+
+def restore_sampling_policy_from_environment(scene: bpy.types.Scene) -> bool:
+    '''
+    Set the policy given by the environment variable again for a scene saved with it (e.g., a scene snapshot opened by
+    render_cached.py), so that the time budget feedback and the per-frame records work as in the process that built
+    the scene. The saved sample limit, which may have been calibrated, is kept. Returns whether a policy is set.
+    '''
+
+    policy = get_sampling_policy_from_environment()
+    if policy is None:
+        return False
+
+    policy.pop("calibrate")
+    num_samples = scene.cycles.samples
+    if not any(key in policy for key in ("num_samples", "noise_threshold", "time_budget")):
+        policy["num_samples"] = num_samples
+    set_sampling_policy(scene, **policy)
+    scene.cycles.samples = num_samples
+
+    return True
@@ -0,0 +1,316 @@
+import bpy
+import math
+import numpy as np
+from typing import Callable, Optional, Sequence, Tuple
+from utils.bvh import get_euler_from_rotation_matrices
+from utils.profiling import profile_function, increment_counter
+
+# Large primes for hashing grid cells into buckets (Teschner et al., "Optimized Spatial Hashing for Collision
+# Detection of Deformable Objects")
+hash_primes = np.array([73856093, 19349663, 83492791], dtype=np.int64)
+
+################################################################################
+# Spatial hash
+################################################################################
+
+
+def get_cell_buckets(cells: np.ndarray, num_buckets: int) -> np.ndarray:
+    '''
+    Hash (N, D) integer grid cells into (N,) bucket indices. Different cells may share a bucket, so the points found
+    through a bucket still need a distance test.
+    '''
+
+    keys = cells[:, 0] * hash_primes[0]
+    for axis in range(1, cells.shape[1]):
+        keys = np.bitwise_xor(keys, cells[:, axis] * hash_primes[axis])
+    return keys % num_buckets
+
+
+class SpatialHash:
+    '''
+    A uniform grid over a point set stored as buckets of point indices (counts and offsets into one index array), so
+    that all the neighbours of many query points can be gathered with NumPy at once. With a cell size of at least the
+    largest interaction distance, only the 3^D cells around a query need to be visited, each of which holds a constant
+    number of points on average for Poisson-disk distributions.
+    '''
+
+    def __init__(self, points: np.ndarray, cell_size: float):
+        self.points = points
+        self.cell_size = cell_size
+        self.num_buckets = max(1, 2 * points.shape[0])
+
+        buckets = get_cell_buckets(self.get_cells(points), self.num_buckets)
+        self.indices = np.argsort(buckets, kind='stable')
+        self.offsets = np.zeros(self.num_buckets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=self.num_buckets), out=self.offsets[1:])
+
+    def get_cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor(points / self.cell_size).astype(np.int64)
+
+    def get_neighbor_pairs(self, query_points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Return (query index, point index) pairs of the points in the cells around each of the query points. A pair may
+        appear more than once when neighbouring cells share a bucket.
+        '''
+
+        num_dims = query_points.shape[1]
+        query_cells = self.get_cells(query_points)
+
+        query_indices = []
+        point_indices = []
+        for cell_offset in np.ndindex(*((3, ) * num_dims)):
+            buckets = get_cell_buckets(query_cells + np.array(cell_offset) - 1, self.num_buckets)
+            starts = self.offsets[buckets]
+            counts = self.offsets[buckets + 1] - starts
+
+            # Expand the [start, start + count) ranges into flat index arrays
+            owners = np.repeat(np.arange(query_points.shape[0]), counts)
+            ranks = np.arange(owners.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+            query_indices.append(owners)
+            point_indices.append(self.indices[starts[owners] + ranks])
+
+        return np.concatenate(query_indices), np.concatenate(point_indices)
+
+
+################################################################################
+# Poisson-disk sampling
+################################################################################
+
+
+def get_conflicting_pairs(spatial_hash: SpatialHash, point_radii: np.ndarray, query_points: np.ndarray,
+                          query_radii: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Return (query index, point index) pairs whose disks (or balls) overlap.
+    '''
+
+    query_indices, point_indices = spatial_hash.get_neighbor_pairs(query_points)
+    squared_distances = np.square(query_points[query_indices] - spatial_hash.points[point_indices]).sum(axis=1)
+    is_conflicting = squared_distances < np.square(query_radii[query_indices] + point_radii[point_indices])
+
+    return query_indices[is_conflicting], point_indices[is_conflicting]
+
+
+@profile_function
+def sample_poisson_disk(generate_candidates: Callable[[np.random.Generator, int], Tuple[np.ndarray, np.ndarray]],
+                        num_samples: int,
+                        radii: Sequence[float],
+                        weights: Optional[Sequence[float]] = None,
+                        seed: int = 0,
+                        max_num_rounds: int = 64,
+                        min_acceptance_rate: float = 0.001) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Draw up to num_samples points whose disks (or balls) do not overlap by dart throwing in batches: each round, a
+    batch of candidates is drawn, the candidates overlapping an accepted point are rejected through a spatial hash of
+    the accepted points, and the overlaps among the remaining candidates are resolved through a spatial hash of the
+    candidates by keeping the earlier one. Each candidate picks one of the objects (the radii, e.g., from
+    get_bounding_radius) with the probabilities given by the weights; larger objects are rejected more often, so they
+    end up less frequent than the weights suggest in dense layouts. The sampling stops early when the domain is
+    saturated, i.e., when a round accepts less than min_acceptance_rate of its candidates.
+
+    generate_candidates: a function returning (M, D) uniformly distributed candidate points and (M, ...) attributes
+    carried along with them (e.g., surface normals) for a random generator and M
+
+    Returns the (N, D) points, the (N,) object indices and the (N, ...) attributes.
+    '''
+
+    rng = np.random.default_rng(seed)
+    radii = np.asarray(radii, dtype=np.float64).reshape(-1)
+    probabilities = None if weights is None else np.asarray(weights, dtype=np.float64) / np.sum(weights)
+    cell_size = 2.0 * radii.max()
+
+    # Start from empty (0, D) and (0, ...) arrays, which are returned as they are if nothing is drawn
+    points, attributes = generate_candidates(np.random.default_rng(seed), 0)
+    object_indices = np.empty(0, dtype=np.int64)
+    for _ in range(max_num_rounds):
+        num_accepted = object_indices.shape[0]
+        if num_accepted >= num_samples:
+            break
+
+        num_candidates = max(2 * (num_samples - num_accepted), 1024)
+        candidate_points, candidate_attributes = generate_candidates(rng, num_candidates)
+        candidate_object_indices = rng.choice(radii.shape[0], num_candidates, p=probabilities)
+        candidate_radii = radii[candidate_object_indices]
+
+        # Reject the candidates overlapping the accepted points
+        is_rejected = np.zeros(num_candidates, dtype=bool)
+        if num_accepted > 0:
+            query_indices, _ = get_conflicting_pairs(SpatialHash(points, cell_size), radii[object_indices],
+                                                     candidate_points, candidate_radii)
+            is_rejected[query_indices] = True
+
+        # Among the remaining candidates, keep the first of each overlapping pair; the batch is random, so the order
+        # is too
+        remaining_indices = np.flatnonzero(~is_rejected)
+        remaining_points = candidate_points[remaining_indices]
+        remaining_radii = candidate_radii[remaining_indices]
+        query_indices, point_indices = get_conflicting_pairs(SpatialHash(remaining_points, cell_size), remaining_radii,
+                                                             remaining_points, remaining_radii)
+        is_rejected[remaining_indices[query_indices[point_indices < query_indices]]] = True
+
+        new_indices = np.flatnonzero(~is_rejected)[:num_samples - num_accepted]
+        points = np.concatenate((points, candidate_points[new_indices]))
+        attributes = np.concatenate((attributes, candidate_attributes[new_indices]))
+        object_indices = np.concatenate((object_indices, candidate_object_indices[new_indices]))
+
+        increment_counter("poisson_disk_candidates", num_candidates)
+        if new_indices.shape[0] < min_acceptance_rate * num_candidates:
+            break
+
+    return points, object_indices, attributes
+
+
+################################################################################
+# Scattering
+################################################################################
+
+
+def get_bounding_radius(mesh_object: bpy.types.Object, use_footprint: bool = True) -> float:
+    '''
+    Return the radius of the circle (the footprint on the XY plane, for objects placed upright on a floor with any
+    rotation around Z) or the sphere enclosing the bounding box of the object around its origin, including its
+    modifiers and scale.
+    '''
+
+    corners = np.array(mesh_object.bound_box) * np.array(mesh_object.scale)
+    if use_footprint:
+        corners = corners[:, 0:2]
+    return float(np.sqrt(np.square(corners).sum(axis=1).max()))
+
+
+def get_scatter_transforms(points: np.ndarray,
+                           normals: Optional[np.ndarray],
+                           rng: np.random.Generator,
+                           use_random_rotation: bool = True) -> np.ndarray:
+    '''
+    Build (N, 9) transforms (see utils.get_transform_components) at the points, with the Z axes aligned with the
+    normals if given and a random rotation around them if use_random_rotation is set.
+    '''
+
+    num_points = points.shape[0]
+    angles = rng.uniform(0.0, 2.0 * math.pi, num_points) if use_random_rotation else np.zeros(num_points)
+
+    transforms = np.zeros((num_points, 9))
+    transforms[:, 0:3] = points
+    transforms[:, 6:9] = 1.0
+
+    if normals is None:
+        transforms[:, 5] = angles
+        return transforms
+
+    # A frame around each normal, using the world X (or Y for normals close to it) as the reference for the tangent
+    z_axes = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+    references = np.zeros((num_points, 3))
+    references[np.abs(z_axes[:, 0]) < 0.9, 0] = 1.0
+    references[np.abs(z_axes[:, 0]) >= 0.9, 1] = 1.0
+    y_axes = np.cross(z_axes, references)
+    y_axes /= np.linalg.norm(y_axes, axis=1, keepdims=True)
+    x_axes = np.cross(y_axes, z_axes)
+
+    # Rotate the frame around the normal
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    x_axes, y_axes = cos * x_axes + sin * y_axes, cos * y_axes - sin * x_axes
+
+    transforms[:, 3:6] = get_euler_from_rotation_matrices(np.stack((x_axes, y_axes, z_axes), axis=2), "XYZ")
+
+    return transforms
+
+
+@profile_function
+def get_plane_scatter_transforms(num_samples: int,
+                                 radii: Sequence[float],
+                                 weights: Optional[Sequence[float]] = None,
+                                 size: float = 2.0,
+                                 location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
+                                 use_random_rotation: bool = True,
+                                 seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Scatter up to num_samples non-overlapping objects on a horizontal square (e.g., a floor by utils.create_plane with
+    the same size and location) by Poisson-disk sampling (see sample_poisson_disk). The objects stay inside the square.
+
+    Returns the (N, 9) transforms (see utils.get_transform_components) and the (N,) object indices into the radii, so
+    that the transforms of each object can be passed to utils.create_point_instancer or utils.create_objects as
+    transforms[object_indices == k].
+    '''
+
+    radius_max = max(radii)
+    half_size = 0.5 * size - radius_max
+    assert half_size > 0.0
+
+    def generate_candidates(rng: np.random.Generator, num_candidates: int) -> Tuple[np.ndarray, np.ndarray]:
+        return rng.uniform(-half_size, half_size, (num_candidates, 2)), np.empty((num_candidates, 0))
+
+    points, object_indices, _ = sample_poisson_disk(generate_candidates, num_samples, radii, weights, seed)
+
+    locations = np.zeros((points.shape[0], 3))
+    locations[:, 0:2] = points
+    locations += np.array(location)
+
+    transforms = get_scatter_transforms(locations, None, np.random.default_rng(seed + 1), use_random_rotation)
+
+    return transforms, object_indices
+
+
+def get_mesh_triangles(mesh_object: bpy.types.Object) -> np.ndarray:
+    '''
+    Return the (T, 3, 3) world-space triangles of the object including its modifiers.
+    '''
+
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    evaluated_object = mesh_object.evaluated_get(depsgraph)
+    mesh = evaluated_object.to_mesh()
+    mesh.calc_loop_triangles()
+
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    triangle_vertex_indices = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("vertices", triangle_vertex_indices)
+
+    evaluated_object.to_mesh_clear()
+
+    matrix_world = np.array(mesh_object.matrix_world)
+    world_vertices = vertices.reshape(-1, 3) @ matrix_world[0:3, 0:3].T + matrix_world[0:3, 3]
+
+    return world_vertices[triangle_vertex_indices].reshape(-1, 3, 3)
+
+
+@profile_function
+def get_surface_scatter_transforms(mesh_object: bpy.types.Object,
+                                   num_samples: int,
+                                   radii: Sequence[float],
+                                   weights: Optional[Sequence[float]] = None,
+                                   use_normal_alignment: bool = True,
+                                   use_random_rotation: bool = True,
+                                   seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Scatter up to num_samples non-overlapping objects on the surface of the mesh object by Poisson-disk sampling (see
+    sample_poisson_disk) with area-weighted candidates and 3D distances. The Z axes of the objects are aligned with the
+    face normals if use_normal_alignment is set.
+
+    Returns the (N, 9) transforms and the (N,) object indices as get_plane_scatter_transforms does.
+    '''
+
+    triangles = get_mesh_triangles(mesh_object)
+    cross_products = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    cumulative_areas = np.cumsum(np.linalg.norm(cross_products, axis=1))
+
+    def generate_candidates(rng: np.random.Generator, num_candidates: int) -> Tuple[np.ndarray, np.ndarray]:
+        triangle_indices = np.searchsorted(cumulative_areas, rng.uniform(0.0, cumulative_areas[-1], num_candidates))
+        triangle_indices = np.minimum(triangle_indices, triangles.shape[0] - 1)
+
+        # Uniform barycentric coordinates
+        sqrt_u, v = np.sqrt(rng.random(num_candidates)), rng.random(num_candidates)
+        weights_0, weights_1 = 1.0 - sqrt_u, sqrt_u * (1.0 - v)
+        weights_2 = 1.0 - weights_0 - weights_1
+
+        selected_triangles = triangles[triangle_indices]
+        candidate_points = (weights_0[:, None] * selected_triangles[:, 0] + weights_1[:, None] *
+                            selected_triangles[:, 1] + weights_2[:, None] * selected_triangles[:, 2])
+
+        return candidate_points, cross_products[triangle_indices]
+
+    points, object_indices, normals = sample_poisson_disk(generate_candidates, num_samples, radii, weights, seed)
+
+    transforms = get_scatter_transforms(points, normals if use_normal_alignment else None,
+                                        np.random.default_rng(seed + 1), use_random_rotation)
+
+    return transforms, object_indices
@@ -0,0 +1,119 @@
+import bpy
+import glob
+import hashlib
+import os
+from typing import Any, List, Optional, Sequence
+from utils.sampling import SAMPLING_POLICY_ENV_VAR
+
+utils_dir_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def update_hash_with_file(hasher: Any, file_path: str) -> None:
+    with open(file_path, "rb") as file:
+        hasher.update(file.read())
+
+
+def get_scene_cache_key(script_path: str, scene_args: Sequence[str]) -> str:
+    '''
+    Return a key identifying the scene built by the script with the arguments. It covers the Blender version, the
+    sources of the script and of the utils package, the arguments and the sampling policy given by the environment
+    (which changes the saved sampling settings). For an argument that is an existing file (e.g., the BVH file of
+    10_mocap.py), its size and modification time are covered too.
+
+    Asset files referenced by path (textures, HDRIs) are loaded again at render time, so they are not covered.
+    '''
+
+    hasher = hashlib.sha1()
+    hasher.update(bpy.app.version_string.encode())
+
+    update_hash_with_file(hasher, script_path)
+    for utils_file_path in sorted(glob.glob(os.path.join(utils_dir_path, "*.py"))):
+        hasher.update(os.path.basename(utils_file_path).encode())
+        update_hash_with_file(hasher, utils_file_path)
+
+    for arg in scene_args:
+        hasher.update(b"\0" + arg.encode())
+        if os.path.isfile(arg):
+            stat = os.stat(arg)
+            hasher.update("{}:{}".format(stat.st_size, stat.st_mtime_ns).encode())
+
+    hasher.update(b"\0" + os.environ.get(SAMPLING_POLICY_ENV_VAR, "").encode())
+
+    return hasher.hexdigest()
+
+
+def find_output_path_arg_index(script_args: Sequence[str]) -> Optional[int]:
+    '''
+    Guess which script argument is the output path: the first one that is neither a number, an option nor an existing
+    file or directory (e.g., "./out/02_suzanne_").
+    '''
+
+    for index, arg in enumerate(script_args):
+        if arg.startswith("-") or os.path.exists(arg):
+            continue
+        try:
+            float(arg)
+        except ValueError:
+            return index
+
+    return None
+
+
+def get_scene_snapshot_path(cache_dir_path: str, key: str) -> str:
+    return os.path.join(cache_dir_path, key + ".blend")
+
+
+def save_scene_snapshot(snapshot_path: str) -> None:
+    '''
+    Save the current session as a snapshot without changing the file path of the session. The file is written under a
+    temporary name first, so concurrent processes never open a partially written snapshot.
+    '''
+
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+
+    temp_snapshot_path = "{}.{}.tmp.blend".format(snapshot_path[:-len(".blend")], os.getpid())
+    bpy.ops.wm.save_as_mainfile(filepath=temp_snapshot_path, copy=True)
+    os.replace(temp_snapshot_path, snapshot_path)
+
+
+def open_scene_snapshot(snapshot_path: str) -> None:
+    # The modification time is used as the last access time for the LRU eviction
+    os.utime(snapshot_path)
+
+    bpy.ops.wm.open_mainfile(filepath=snapshot_path, load_ui=False)
+
+
+def get_scene_snapshot_paths(cache_dir_path: str) -> List[str]:
+    snapshot_paths = glob.glob(os.path.join(cache_dir_path, "*.blend"))
+    return [snapshot_path for snapshot_path in snapshot_paths if not snapshot_path.endswith(".tmp.blend")]
+
+
+def evict_scene_snapshots(cache_dir_path: str, max_cache_size_in_bytes: int) -> int:
+    '''
+    Remove the least recently used snapshots until the total size of the cache directory fits in the limit, and
+    return the number of the removed snapshots.
+    '''
+
+    snapshot_paths = []
+    for snapshot_path in get_scene_snapshot_paths(cache_dir_path):
+        try:
+            stat = os.stat(snapshot_path)
+        except FileNotFoundError:
+            continue
+        snapshot_paths.append((stat.st_mtime, stat.st_size, snapshot_path))
+
+    cache_size = sum(size for _, size, _ in snapshot_paths)
+
+    num_evicted_snapshots = 0
+    for _, size, snapshot_path in sorted(snapshot_paths):
+        if cache_size <= max_cache_size_in_bytes:
+            break
+        try:
+            os.remove(snapshot_path)
+        except FileNotFoundError:
+            # Another process has already removed it
+            pass
+        cache_size -= size
+        num_evicted_snapshots += 1
+
+    return num_evicted_snapshots
@@ -0,0 +1,110 @@
+import bpy
+import hashlib
+import os
+import numpy as np
+from typing import Any, List
+from utils.node import get_rna_property_values
+
+
+def get_point_caches(scene: bpy.types.Scene) -> List[bpy.types.PointCache]:
+    '''
+    https://docs.blender.org/api/current/bpy.types.PointCache.html
+    '''
+
+    point_caches = []
+
+    for object in scene.objects:
+        for modifier in object.modifiers:
+            # Cloth and soft body modifiers have their own point caches
+            if hasattr(modifier, "point_cache"):
+                point_caches.append(modifier.point_cache)
+        for particle_system in object.particle_systems:
+            point_caches.append(particle_system.point_cache)
+
+    if scene.rigidbody_world is not None:
+        point_caches.append(scene.rigidbody_world.point_cache)
+
+    return point_caches
+
+
+def bake_point_caches_to_disk(scene: bpy.types.Scene, blend_file_path: str) -> None:
+    '''
+    Save the scene as a .blend file and bake all the simulations of the scene to its disk cache, so that other Blender
+    processes can open the file and render any frame without re-simulating.
+
+    Blender stores disk caches next to the saved .blend file ("blendcache_<name>/"), which is why saving comes first.
+    '''
+
+    # Relative paths would be resolved against the location of the new .blend file
+    scene.render.filepath = os.path.abspath(bpy.path.abspath(scene.render.filepath))
+
+    bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(blend_file_path))
+
+    for point_cache in get_point_caches(scene):
+        point_cache.use_disk_cache = True
+        point_cache.frame_end = max(point_cache.frame_start, scene.frame_end)
+
+    bpy.ops.ptcache.bake_all(bake=True)
+
+    bpy.ops.wm.save_mainfile()
+
+
+def get_mesh_object_signature(mesh_object: bpy.types.Object) -> List[Any]:
+    mesh: bpy.types.Mesh = mesh_object.data
+
+    coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", coords)
+
+    modifier_values = [(modifier.type, get_rna_property_values(modifier)) for modifier in mesh_object.modifiers]
+
+    coords_hash = hashlib.sha1(coords.tobytes()).hexdigest()
+    matrix = [tuple(row) for row in mesh_object.matrix_world]
+
+    return [mesh_object.name, matrix, len(mesh.vertices), len(mesh.polygons), coords_hash, modifier_values]
+
+
+def get_cloth_cache_key(scene: bpy.types.Scene, cloth_object: bpy.types.Object) -> str:
+    '''
+    A hash of everything that affects the cloth simulation of the object: the cloth mesh and its settings, the collision
+    objects in the scene, the frame range and the Blender version.
+    '''
+
+    cloth_modifier = next(modifier for modifier in cloth_object.modifiers if modifier.type == 'CLOTH')
+
+    items: List[Any] = [
+        bpy.app.version,
+        scene.frame_start,
+        scene.frame_end,
+        scene.render.fps,
+        get_mesh_object_signature(cloth_object),
+        get_rna_property_values(cloth_modifier.settings),
+        get_rna_property_values(cloth_modifier.collision_settings),
+    ]
+
+    for object in scene.objects:
+        if object != cloth_object and any(modifier.type == 'COLLISION' for modifier in object.modifiers):
+            items.append(get_mesh_object_signature(object))
+            items.append(get_rna_property_values(object.collision))
+
+    return hashlib.sha1(repr(items).encode("utf-8")).hexdigest()[:16]
+
+
+def get_disk_cache_dir_path(blend_file_path: str) -> str:
+    # Blender stores the disk caches of "<dir>/<name>.blend" in "<dir>/blendcache_<name>/"
+    blend_dir_path, blend_file_name = os.path.split(os.path.abspath(blend_file_path))
+    return os.path.join(blend_dir_path, "blendcache_" + os.path.splitext(blend_file_name)[0])
+
+
+def is_point_cache_baked_on_disk(point_cache: bpy.types.PointCache, cache_dir_path: str, frame_end: int) -> bool:
+    # Cache files are named "<name>_<frame>_<index>.bphys"; the last frame is written at the end of baking
+    last_file_name = "{}_{:06d}_{:02d}.bphys".format(point_cache.name, frame_end, point_cache.index)
+    return os.path.isfile(os.path.join(cache_dir_path, last_file_name))
+
+
+def set_external_point_cache(point_cache: bpy.types.PointCache, cache_dir_path: str) -> None:
+    '''
+    Read the point cache from cache files baked by another Blender process instead of simulating.
+    '''
+
+    point_cache.use_external = True
+    point_cache.filepath = cache_dir_path
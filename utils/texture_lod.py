@@ -0,0 +1,164 @@
+import bpy
+import os
+import mathutils
+from bpy_extras.object_utils import world_to_camera_view
+from typing import Dict, List, Optional, Sequence
+from utils.image import load_cached_image, evict_unused_cached_images
+from utils.profiling import profile_function, increment_counter
+
+# Longer side of the generated levels; the original image (e.g., a [2K] cc0textures image) is the finest level
+texture_lod_sizes = (1024, 512, 256)
+
+
+def get_texture_lod_path(path: str, size: int) -> str:
+    '''
+    Return the path of the level of the texture, e.g., "<dir>/lod/512/<name>.jpg" for "<dir>/<name>.jpg".
+    '''
+
+    return os.path.join(os.path.dirname(path), "lod", str(size), os.path.basename(path))
+
+
+def generate_texture_lods(path: str, sizes: Sequence[int] = texture_lod_sizes) -> List[str]:
+    '''
+    Write downscaled copies of the image file next to it (see get_texture_lod_path) in its own file format. Levels
+    newer than the original file are kept as they are. Returns the paths of the written levels.
+    '''
+
+    written_paths = []
+
+    image: Optional[bpy.types.Image] = None
+    for size in sizes:
+        lod_path = get_texture_lod_path(path, size)
+        if os.path.isfile(lod_path) and os.path.getmtime(lod_path) >= os.path.getmtime(path):
+            continue
+
+        if image is None:
+            image = bpy.data.images.load(path, check_existing=False)
+
+        width, height = image.size
+        if max(width, height) <= size:
+            continue
+
+        scale = size / max(width, height)
+
+        lod_image = image.copy()
+        lod_image.scale(max(1, round(width * scale)), max(1, round(height * scale)))
+
+        os.makedirs(os.path.dirname(lod_path), exist_ok=True)
+        lod_image.filepath_raw = lod_path
+        lod_image.save()
+
+        bpy.data.images.remove(lod_image)
+        written_paths.append(lod_path)
+
+    if image is not None:
+        bpy.data.images.remove(image)
+
+    return written_paths
+
+
+def select_texture_lod_path(path: str, required_size: float) -> str:
+    '''
+    Return the coarsest generated level of the texture whose size is at least the required size, or the original path
+    if there is no such level.
+    '''
+
+    for size in sorted(texture_lod_sizes):
+        if size >= required_size:
+            lod_path = get_texture_lod_path(path, size)
+            if os.path.isfile(lod_path):
+                return lod_path
+
+    return path
+
+
+def get_object_screen_size(scene: bpy.types.Scene, camera_object: bpy.types.Object,
+                           mesh_object: bpy.types.Object) -> float:
+    '''
+    Estimate the on-screen size of the object in pixels as the longer side of the screen-space rectangle of its
+    bounding box, clamped to the frame.
+    '''
+
+    resolution_scale = scene.render.resolution_percentage / 100.0
+    resolution_x = scene.render.resolution_x * resolution_scale
+    resolution_y = scene.render.resolution_y * resolution_scale
+
+    coords = [
+        world_to_camera_view(scene, camera_object, mesh_object.matrix_world @ mathutils.Vector(corner))
+        for corner in mesh_object.bound_box
+    ]
+
+    if all(coord.z <= 0.0 for coord in coords):
+        # Entirely behind the camera
+        return 0.0
+    if any(coord.z <= 0.0 for coord in coords):
+        # The projection is not reliable for an object around the camera (e.g., a floor), so assume the whole frame
+        return max(resolution_x, resolution_y)
+
+    xs = [min(max(coord.x, 0.0), 1.0) for coord in coords]
+    ys = [min(max(coord.y, 0.0), 1.0) for coord in coords]
+
+    return max((max(xs) - min(xs)) * resolution_x, (max(ys) - min(ys)) * resolution_y)
+
+
+def get_texture_repetition(material: bpy.types.Material) -> float:
+    # The mapping node of build_pbr_textured_nodes scales the texture coordinates
+    mapping_node = material.node_tree.nodes.get("Mapping")
+    if mapping_node is None or "Scale" not in mapping_node.inputs:
+        return 1.0
+    return max(abs(value) for value in mapping_node.inputs["Scale"].default_value)
+
+
+@profile_function
+def apply_texture_lods(scene: bpy.types.Scene,
+                       camera_object: Optional[bpy.types.Object] = None,
+                       quality: float = 1.0) -> int:
+    '''
+    Replace the images of the textured materials used in the scene with the coarsest generated level (see
+    generate_texture_lods) that still has at least one texel per pixel, based on the output resolution and the
+    on-screen size of the objects seen from the camera at the current frame (assuming that the UV layout covers each
+    object once). Materials without generated levels are left as they are. Returns the number of replaced images.
+
+    quality: multiplier of the required texture size (e.g., 2.0 for sharper textures)
+    '''
+
+    if camera_object is None:
+        camera_object = scene.camera
+
+    # Material name -> the largest on-screen size of the objects using it
+    screen_sizes: Dict[str, float] = {}
+    for scene_object in scene.objects:
+        if scene_object.type != 'MESH' or scene_object.hide_render:
+            continue
+
+        materials = [slot.material for slot in scene_object.material_slots if slot.material and slot.material.use_nodes]
+        if len(materials) == 0:
+            continue
+
+        screen_size = get_object_screen_size(scene, camera_object, scene_object)
+        for material in materials:
+            screen_sizes[material.name] = max(screen_sizes.get(material.name, 0.0), screen_size)
+
+    num_replaced_images = 0
+    for material_name, screen_size in screen_sizes.items():
+        material = bpy.data.materials[material_name]
+        required_size = screen_size * get_texture_repetition(material) * quality
+
+        for node in material.node_tree.nodes:
+            if node.type != 'TEX_IMAGE' or node.image is None or node.image.source != 'FILE':
+                continue
+
+            path = bpy.path.abspath(node.image.filepath)
+            lod_path = select_texture_lod_path(path, required_size)
+            if lod_path == path:
+                continue
+
+            node.image = load_cached_image(lod_path, is_data=node.image.colorspace_settings.is_data)
+            num_replaced_images += 1
+
+    # Drop the full-resolution images that are no longer used so that they are never loaded by the renderer
+    evict_unused_cached_images()
+
+    increment_counter("texture_lod_replacements", num_replaced_images)
+
+    return num_replaced_images
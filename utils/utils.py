@@ -1,13 +1,18 @@
 import bpy
 import math
-from typing import Optional, Tuple
-from utils.node import arrange_nodes
+import numpy as np
+from typing import List, Optional, Tuple
+from utils.image import load_cached_image
+from utils.node import request_arrange_nodes
+from utils.profiling import profile_function, increment_counter
+from utils.sampling import get_sampling_policy_from_environment, set_sampling_policy
 
 ################################################################################
 # Text
 ################################################################################
 
 
+@profile_function
 def create_text(
     scene: bpy.types.Scene,
     body: str,
@@ -41,6 +46,80 @@ def create_text(
     return new_object
 
 
+################################################################################
+# Objects
+################################################################################
+
+
+def get_transform_components(transforms: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Split (N, 9) transforms, each of which is a location, an XYZ Euler rotation and a scale, into (N, 3) arrays.
+    '''
+
+    transforms = np.asarray(transforms, dtype=np.float32).reshape(-1, 9)
+    return transforms[:, 0:3], transforms[:, 3:6], transforms[:, 6:9]
+
+
+def create_object(data: Optional[bpy.types.ID],
+                  name: str,
+                  location: Tuple[float, float, float] = (0.0, 0.0, 0.0),
+                  rotation: Tuple[float, float, float] = (0.0, 0.0, 0.0),
+                  collection: Optional[bpy.types.Collection] = None) -> bpy.types.Object:
+    '''
+    Create an object with the data (a mesh, a camera, a light, or None for an empty) through the data API instead of
+    bpy.ops.*_add, which looks up the context, pushes an undo step and updates the view layer on every call. The object
+    is linked to the collection (the master collection of the current scene by default) but, unlike with the
+    operators, it is neither selected nor made active.
+    '''
+
+    if collection is None:
+        collection = bpy.context.scene.collection
+
+    new_object: bpy.types.Object = bpy.data.objects.new(name, data)
+    new_object.location = location
+    new_object.rotation_euler = rotation
+    collection.objects.link(new_object)
+
+    return new_object
+
+
+@profile_function
+def create_objects(data: Optional[bpy.types.ID],
+                   transforms: np.ndarray,
+                   name: str,
+                   collection: Optional[bpy.types.Collection] = None,
+                   copy_data: bool = False) -> List[bpy.types.Object]:
+    '''
+    Create an object for each of the (N, 9) transforms (see get_transform_components), named "<name><index>" and
+    sharing the data (or each with its own copy if copy_data is set). The objects are gathered in a new collection
+    named after them, which is linked to the collection (the master collection of the current scene by default) only
+    after all the objects are created, so the view layer is synchronized once instead of once per object.
+    '''
+
+    if collection is None:
+        collection = bpy.context.scene.collection
+
+    locations, rotations, scales = get_transform_components(transforms)
+
+    new_collection = bpy.data.collections.new(name)
+
+    new_objects = []
+    for index in range(locations.shape[0]):
+        object_data = data.copy() if copy_data and data is not None else data
+        new_object: bpy.types.Object = bpy.data.objects.new(name + str(index), object_data)
+        new_object.location = locations[index]
+        new_object.rotation_euler = rotations[index]
+        new_object.scale = scales[index]
+        new_collection.objects.link(new_object)
+        new_objects.append(new_object)
+
+    collection.children.link(new_collection)
+
+    increment_counter("batched_objects", len(new_objects))
+
+    return new_objects
+
+
 ################################################################################
 # Scene
 ################################################################################
@@ -57,6 +136,7 @@ def set_animation(scene: bpy.types.Scene,
     scene.frame_current = frame_current
 
 
+@profile_function
 def build_rgb_background(world: bpy.types.World,
                          rgb: Tuple[float, float, float, float] = (0.9, 0.9, 0.9, 1.0),
                          strength: float = 1.0) -> None:
@@ -70,15 +150,16 @@ def build_rgb_background(world: bpy.types.World,
 
     node_tree.links.new(rgb_node.outputs["Color"], node_tree.nodes["Background"].inputs["Color"])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
 
 
+@profile_function
 def build_environment_texture_background(world: bpy.types.World, hdri_path: str, rotation: float = 0.0) -> None:
     world.use_nodes = True
     node_tree = world.node_tree
 
     environment_texture_node = node_tree.nodes.new(type="ShaderNodeTexEnvironment")
-    environment_texture_node.image = bpy.data.images.load(hdri_path)
+    environment_texture_node.image = load_cached_image(hdri_path)
 
     mapping_node = node_tree.nodes.new(type="ShaderNodeMapping")
     if bpy.app.version >= (2, 81, 0):
@@ -92,7 +173,19 @@ def build_environment_texture_background(world: bpy.types.World, hdri_path: str,
     node_tree.links.new(mapping_node.outputs["Vector"], environment_texture_node.inputs["Vector"])
     node_tree.links.new(environment_texture_node.outputs["Color"], node_tree.nodes["Background"].inputs["Color"])
 
-    arrange_nodes(node_tree)
+    request_arrange_nodes(node_tree)
+
+
+def set_environment_texture_rotation(world: bpy.types.World, rotation: float) -> None:
+    '''
+    Rotate the environment texture added by build_environment_texture_background without rebuilding the nodes.
+    '''
+
+    mapping_node = next(node for node in world.node_tree.nodes if node.type == 'MAPPING')
+    if bpy.app.version >= (2, 81, 0):
+        mapping_node.inputs["Rotation"].default_value = (0.0, 0.0, rotation)
+    else:
+        mapping_node.rotation[2] = rotation
 
 
 def set_output_properties(scene: bpy.types.Scene,
@@ -115,7 +208,16 @@ def set_cycles_renderer(scene: bpy.types.Scene,
                         use_motion_blur: bool = False,
                         use_transparent_bg: bool = False,
                         prefer_cuda_use: bool = True,
-                        use_adaptive_sampling: bool = False) -> None:
+                        use_adaptive_sampling: bool = False,
+                        noise_threshold: Optional[float] = None,
+                        time_budget: Optional[float] = None) -> None:
+    '''
+    Set up Cycles with num_samples samples, or with a noise threshold or a per-frame time budget in seconds instead
+    (see utils.set_sampling_policy). A policy given by the BLENDER_CLI_RENDERING_SAMPLING environment variable (see
+    utils.get_sampling_policy_from_environment) overrides the arguments; its "calibrate" option is applied by
+    utils.calibrate_sampling_from_environment once the scene is finished.
+    '''
+
     scene.camera = camera_object
 
     scene.render.image_settings.file_format = 'PNG'
@@ -128,11 +230,30 @@ def set_cycles_renderer(scene: bpy.types.Scene,
     scene.cycles.use_adaptive_sampling = use_adaptive_sampling
     scene.cycles.samples = num_samples
 
+    policy = get_sampling_policy_from_environment()
+    if policy is not None:
+        policy.pop("calibrate")
+        if not any(key in policy for key in ("num_samples", "noise_threshold", "time_budget")):
+            policy["num_samples"] = num_samples
+        set_sampling_policy(scene, **policy)
+    elif noise_threshold is not None or time_budget is not None:
+        set_sampling_policy(scene, noise_threshold=noise_threshold, time_budget=time_budget)
+
     # Enable GPU acceleration
     # Source - https://blender.stackexchange.com/a/196702
     if prefer_cuda_use:
         bpy.context.scene.cycles.device = "GPU"
 
+    set_cycles_devices(prefer_cuda_use)
+
+
+def set_cycles_devices(prefer_cuda_use: bool = True) -> None:
+    '''
+    Set up the Cycles devices in the preferences. The preferences are not saved in .blend files, so this needs to be
+    called again when a saved scene is rendered by another Blender process.
+    '''
+
+    if prefer_cuda_use:
         # Change the preference setting
         bpy.context.preferences.addons["cycles"].preferences.compute_device_type = "CUDA"
 